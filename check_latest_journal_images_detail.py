@@ -12,6 +12,7 @@ from sqlalchemy.orm import Session
 from database_models.database import SessionLocal
 from database_models.journal import Journal
 from database_models.image import Image
+from database_models.journal_image import JournalImage
 import logging
 
 # 配置日志
@@ -42,14 +43,18 @@ def check_latest_journal_images_detail():
         print(f"  - 时间: {latest_journal.created_at.strftime('%Y-%m-%d %H:%M:%S')}")
         print(f"  - 情绪: {latest_journal.emotion}")
         print(f"  - 内容前50字: {latest_journal.content[:50]}...")
-        print(f"  - 原始图片字段值: '{latest_journal.images}'")
+        print(f"  - 旧版图片字段值: '{latest_journal.images}'")
         
-        if not latest_journal.images:
+        # 从日记图片关联表读取图片ID
+        image_ids = [
+            str(row.image_id) for row in db.query(JournalImage.image_id)
+            .filter(JournalImage.journal_id == latest_journal.id)
+            .order_by(JournalImage.position)
+        ]
+        if not image_ids:
             print(f"📷 图片数量: 0张")
             return True
         
-        # 解析图片ID
-        image_ids = latest_journal.images.split(",")
         image_count = len(image_ids)
         
         print(f"📷 图片数量: {image_count}张")
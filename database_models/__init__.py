@@ -3,13 +3,18 @@
 # 实现：统一导出用户、日记模型和数据库配置
 
 # 导出数据库配置
-from .database import init_db, SessionLocal
+from .database import init_db, SessionLocal, AsyncSessionLocal, get_db, write_session
 
 # 导出数据模型
 from .user import User
 from .journal import Journal
 from .chat_session import ChatSession
+from .chat_message import ChatMessage
+from .chat_session_archive import ChatSessionArchive
 from .image import Image
+from .journal_image import JournalImage
+from .change_log import ChangeLog
+from .journal_emotion_daily import JournalEmotionDaily
 
 # 导出数据验证模型
 from .schemas import AppleLoginRequest
@@ -18,9 +23,17 @@ from .schemas import AppleLoginRequest
 __all__ = [
     "init_db",
     "SessionLocal", 
+    "AsyncSessionLocal",
+    "get_db",
+    "write_session",
     "User",
     "Journal",
     "ChatSession",
+    "ChatMessage",
+    "ChatSessionArchive",
     "Image",
+    "JournalImage",
+    "ChangeLog",
+    "JournalEmotionDaily",
     "AppleLoginRequest"
 ] 
\ No newline at end of file
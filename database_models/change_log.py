@@ -0,0 +1,45 @@
+# File: database_models/change_log.py
+# 功能：数据变更日志模型定义
+# 实现：使用SQLAlchemy ORM，记录日记、会话与图片的最近一次变更（含删除墓碑），供客户端增量同步
+
+from sqlalchemy import Column, Integer, String, DateTime, Index
+from datetime import datetime, timezone, timedelta
+from .database import Base
+
+# ==================== 变更日志模型 ====================
+class ChangeLog(Base):
+    """
+    数据变更日志模型
+    功能：journals / chat_sessions / images 上的触发器在每次增删改后写入一行；
+         同一条数据只保留最近一次变更（REPLACE 覆盖旧行并分配新的自增ID），删除记录即为墓碑
+
+    字段说明：
+        - id: 主键，自增且不复用，作为同步游标（同一用户内单调递增）
+        - user_id: 用户ID
+        - entity: 数据类型（journal/session/image）
+        - entity_id: 数据主键
+        - op: 变更类型（upsert/delete）
+        - changed_at: 变更时间
+    """
+    __tablename__ = "change_log"  # 数据库表名
+    __table_args__ = (
+        # 增量同步：按用户读取某个游标之后的变更
+        Index("ix_change_log_user_id", "user_id", "id"),
+        # 每条数据只保留一行（触发器 REPLACE 依赖该唯一索引）
+        Index("ux_change_log_entity", "entity", "entity_id", unique=True),
+        # 墓碑清理：按变更时间删除过期的删除记录
+        Index("ix_change_log_op_changed", "op", "changed_at"),
+        {"sqlite_autoincrement": True},
+    )
+
+    # 主键字段
+    id = Column(Integer, primary_key=True, autoincrement=True)  # 变更ID，自增主键，不复用
+
+    # 变更内容字段
+    user_id = Column(Integer, nullable=False)  # 用户ID，不可为空（由触发器写入，不设外键）
+    entity = Column(String(20), nullable=False)  # 数据类型，不可为空
+    entity_id = Column(Integer, nullable=False)  # 数据主键，不可为空
+    op = Column(String(10), nullable=False)  # 变更类型，不可为空
+
+    # 时间戳字段
+    changed_at = Column(DateTime, default=lambda: datetime.now(timezone(timedelta(hours=8))))  # 变更时间，东八区
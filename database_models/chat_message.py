@@ -0,0 +1,45 @@
+# File: database_models/chat_message.py
+# 功能：聊天消息数据模型定义
+# 实现：使用SQLAlchemy ORM，按条存储会话消息，支持按序号分页读取
+
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index
+from datetime import datetime, timezone, timedelta
+from .database import Base
+
+# ==================== 聊天消息模型 ====================
+class ChatMessage(Base):
+    """
+    聊天消息数据模型
+    功能：逐条存储会话消息，历史详情接口按 seq 游标分页，无需解析完整 state_data
+
+    字段说明：
+        - id: 主键，消息唯一标识
+        - chat_session_id: 外键，关联 chat_sessions.id
+        - user_id: 外键，关联用户ID（用于按用户批量清理）
+        - seq: 消息在会话中的绝对序号，从0开始递增
+        - role: 消息角色（user/assistant）
+        - content: 消息内容
+        - created_at: 创建时间
+    """
+    __tablename__ = "chat_messages"  # 数据库表名
+
+    # 主键字段
+    id = Column(Integer, primary_key=True, index=True)  # 消息ID，主键，建立索引
+
+    # 外键字段
+    chat_session_id = Column(Integer, ForeignKey("chat_sessions.id"), nullable=False)  # 会话记录ID，不可为空
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)  # 用户ID，不可为空
+
+    # 消息字段
+    seq = Column(Integer, nullable=False)  # 消息序号，不可为空
+    role = Column(String(20), nullable=False)  # 消息角色，不可为空
+    content = Column(Text, nullable=True)  # 消息内容，可为空
+
+    # 时间戳字段
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone(timedelta(hours=8))))  # 创建时间，东八区
+
+    # 索引：按会话 + 序号分页读取
+    __table_args__ = (
+        Index("ix_chat_messages_session_seq", "chat_session_id", "seq", unique=True),
+        Index("ix_chat_messages_user_id", "user_id"),
+    )
@@ -2,11 +2,15 @@
 # 功能：聊天会话数据模型定义
 # 实现：使用SQLAlchemy ORM，存储用户聊天会话状态
 
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from datetime import datetime, timezone, timedelta
+from typing import Any, List, Optional, Tuple
 from .database import Base
 
+# 会话列表中最后一条消息预览的最大长度
+PREVIEW_MAX_LENGTH = 120
+
 # ==================== 聊天会话模型 ====================
 class ChatSession(Base):
     """
@@ -17,9 +21,14 @@ class ChatSession(Base):
         - id: 主键，会话唯一标识
         - user_id: 外键，关联用户ID
         - session_id: 会话ID（前端传入）
-        - state_data: 会话状态数据（JSON格式存储StateTracker数据）
+        - state_data: 会话状态数据（旧版JSON文本，新数据写入state_blob）
+        - state_blob: 会话状态数据（带版本头的编码数据，见 dialogue/state_codec.py）
         - current_image_id: 当前会话的图片ID（如果有）
         - is_active: 会话是否活跃
+        - is_archived: 是否已压缩归档（state_data 与消息移入 chat_session_archives）
+        - message_count: 消息条数（冗余字段，随state_data同步写入）
+        - last_role: 最后一条消息的角色（冗余字段）
+        - last_message_preview: 最后一条消息预览（冗余字段，最多120字）
         - created_at: 创建时间
         - updated_at: 更新时间
         - user: 关联的用户对象（多对一关系）
@@ -36,11 +45,18 @@ class ChatSession(Base):
     session_id = Column(String(255), nullable=False)  # 会话ID，前端传入，不可为空
     
     # 状态数据字段
-    state_data = Column(Text, nullable=True)  # 会话状态数据，JSON格式存储，可为空
+    state_data = Column(Text, nullable=True)  # 旧版会话状态数据，JSON格式存储，可为空
+    state_blob = Column(LargeBinary, nullable=True)  # 会话状态编码数据，可为空
     current_image_id = Column(String(255), nullable=True)  # 当前会话的图片ID，可为空
     
     # 状态字段
     is_active = Column(Boolean, default=True)  # 会话是否活跃，默认为True
+    is_archived = Column(Boolean, default=False)  # 是否已压缩归档，默认为False
+    
+    # 列表摘要字段（冗余存储，避免列表接口解析完整state_data）
+    message_count = Column(Integer, default=0)  # 消息条数
+    last_role = Column(String(20), nullable=True)  # 最后一条消息的角色
+    last_message_preview = Column(String(PREVIEW_MAX_LENGTH), nullable=True)  # 最后一条消息预览
     
     # 时间戳字段
     created_at = Column(DateTime, default=lambda: datetime.now(timezone(timedelta(hours=8))))  # 创建时间，东八区
@@ -49,7 +65,29 @@ class ChatSession(Base):
     # 关联关系：会话属于某个用户
     user = relationship("User", back_populates="chat_sessions")
     
-    # 唯一约束：同一用户的同一session_id只能有一个活跃会话
+    # 索引：会话列表按 (user_id, is_active) 过滤、按 updated_at 倒序
     __table_args__ = (
+        Index("ix_chat_sessions_user_active_updated", "user_id", "is_active", "updated_at"),
+        # 按会话ID读取/保存会话
+        Index("ix_chat_sessions_user_session_active", "user_id", "session_id", "is_active"),
         {"extend_existing": True}
     )
+
+
+def summarize_history(history: List[Any]) -> Tuple[int, Optional[str], str]:
+    """
+    计算会话列表所需的摘要信息
+    :param history: 对话历史，元素为 (role, content) 或 {"role", "content"}
+    :return: (消息条数, 最后一条消息角色, 最后一条消息预览)
+    """
+    last_role = None
+    last_message = ""
+    if history:
+        last_item = history[-1]
+        if isinstance(last_item, (list, tuple)) and len(last_item) >= 2:
+            last_role = str(last_item[0])
+            last_message = str(last_item[1] or "")
+        elif isinstance(last_item, dict):
+            last_role = str(last_item.get("role") or "")
+            last_message = str(last_item.get("content") or "")
+    return len(history or []), last_role, last_message[:PREVIEW_MAX_LENGTH]
@@ -0,0 +1,39 @@
+# File: database_models/chat_session_archive.py
+# 功能：冷会话归档数据模型定义
+# 实现：使用SQLAlchemy ORM，存储压缩后的会话状态与消息
+
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, LargeBinary
+from datetime import datetime, timezone, timedelta
+from .database import Base
+
+# ==================== 冷会话归档模型 ====================
+class ChatSessionArchive(Base):
+    """
+    冷会话归档数据模型
+    功能：长期未访问的会话将 state_data 与 chat_messages 压缩后移入此表，用户重新打开时透明恢复
+
+    字段说明：
+        - chat_session_id: 主键，关联 chat_sessions.id
+        - user_id: 外键，关联用户ID（用于按用户批量清理）
+        - codec: 压缩算法（zstd/zlib）
+        - payload: 压缩后的会话数据
+        - raw_size: 压缩前大小（字节）
+        - compressed_size: 压缩后大小（字节）
+        - archived_at: 归档时间
+    """
+    __tablename__ = "chat_session_archives"  # 数据库表名
+
+    # 主键字段
+    chat_session_id = Column(Integer, ForeignKey("chat_sessions.id"), primary_key=True)  # 会话记录ID，主键
+
+    # 外键字段
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)  # 用户ID，不可为空，建立索引
+
+    # 归档数据字段
+    codec = Column(String(20), nullable=False)  # 压缩算法，不可为空
+    payload = Column(LargeBinary, nullable=False)  # 压缩数据，不可为空
+    raw_size = Column(Integer, nullable=False)  # 压缩前大小，不可为空
+    compressed_size = Column(Integer, nullable=False)  # 压缩后大小，不可为空
+
+    # 时间戳字段
+    archived_at = Column(DateTime, default=lambda: datetime.now(timezone(timedelta(hours=8))))  # 归档时间，东八区
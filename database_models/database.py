@@ -1,21 +1,84 @@
 # File: database_models/database.py
 # 功能：数据库配置和连接管理
-# 实现：使用SQLAlchemy ORM，配置SQLite数据库连接
+# 实现：使用SQLAlchemy ORM，配置SQLite数据库连接；同时提供同步会话与基于 aiosqlite 的异步会话
 
-from sqlalchemy import create_engine
+import os
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 
 # ==================== 数据库配置 ====================
-# SQLite数据库连接URL
-# 参数来源：项目配置，使用本地SQLite文件存储
-DATABASE_URL = "sqlite:///./database/users.db"
+# 数据库连接URL
+# 参数来源：环境变量 DATABASE_URL，默认使用本地SQLite文件存储
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./database/users.db")
+
+def _to_async_url(url: str) -> str:
+    """
+    由同步连接URL推导异步驱动URL（SQLite 使用 aiosqlite）
+    其他数据库请通过 ASYNC_DATABASE_URL 显式指定异步驱动，如 postgresql+asyncpg://...
+    """
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    return url
+
+# 异步连接URL
+# 参数来源：环境变量 ASYNC_DATABASE_URL，默认由 DATABASE_URL 推导
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", _to_async_url(DATABASE_URL))
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+# SQLite 连接参数（可通过环境变量调整）
+# - SQLITE_JOURNAL_MODE: 日志模式，WAL 下读写互不阻塞
+# - SQLITE_SYNCHRONOUS: WAL 模式下 NORMAL 即可保证不损坏数据库，只在断电时可能丢失最近提交
+# - SQLITE_CACHE_SIZE_KB: 每个连接的页缓存大小（KB）
+# - SQLITE_MMAP_SIZE: 内存映射读取的最大字节数
+# - SQLITE_BUSY_TIMEOUT_MS: 遇到锁时的最长等待时间（毫秒），超时才报 "database is locked"
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
 
 # 创建数据库引擎
 # 参数说明：
 # - DATABASE_URL: 数据库连接字符串
-# - connect_args: SQLite特定参数，允许多线程访问
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# - connect_args: SQLite特定参数，允许多线程访问；timeout 为驱动层的锁等待时间（秒）
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000} if IS_SQLITE else {},
+)
+
+# 创建异步数据库引擎（供 async 接口使用，数据库等待不占用线程池）
+# 参数说明：
+# - ASYNC_DATABASE_URL: 异步驱动连接字符串
+# - connect_args: aiosqlite 在独立线程中访问 SQLite，只需设置锁等待时间
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    connect_args={"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000} if IS_SQLITE else {},
+)
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    为每个新建的 SQLite 连接设置 PRAGMA（同步与异步引擎共用）
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")  # 负数表示按 KB 计
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cursor.close()
+
+if IS_SQLITE:
+    event.listen(engine, "connect", _apply_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _apply_sqlite_pragmas)
 
 # 创建会话工厂
 # 参数说明：
@@ -24,17 +87,67 @@ engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 # - autocommit: 禁用自动提交
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
+# 创建异步会话工厂
+# 参数说明：
+# - bind: 绑定到异步数据库引擎
+# - class_: 异步会话类型
+# - expire_on_commit: 提交后不过期对象，避免在异步上下文中触发隐式加载
+AsyncSessionLocal = sessionmaker(bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 # 声明式基类
 Base = declarative_base()
 
+# ==================== 请求级会话 ====================
+def get_db() -> Iterator[Session]:
+    """
+    FastAPI 依赖：每个请求一个数据库会话，请求结束后统一关闭
+    用法：def endpoint(db: Session = Depends(get_db))
+    """
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# ==================== 串行写入 ====================
+# SQLite 同一时刻只允许一个写事务：进程内写操作先排队获取该锁，
+# 再以 BEGIN IMMEDIATE 开启事务，避免多个延迟事务在"读后写"升级写锁时互相冲突
+_write_lock = threading.Lock()
+
+@contextmanager
+def write_session() -> Iterator[Session]:
+    """
+    获取串行化的写会话
+    功能：进程内写事务排队执行，事务开始即持有数据库写锁；正常退出时提交，异常时回滚
+
+    说明：
+        写会话内不要再嵌套打开 write_session，也不要执行耗时的外部调用（如 LLM 请求）
+        多进程部署时进程之间依赖 busy_timeout 排队
+    """
+    with _write_lock:
+        db = SessionLocal()
+        try:
+            if IS_SQLITE:
+                db.connection().exec_driver_sql("BEGIN IMMEDIATE")
+            yield db
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
 # ==================== 数据库初始化 ====================
 def init_db():
     """
     初始化数据库
-    功能：创建所有数据库表结构
+    功能：创建所有数据库表结构，并对已有数据库执行迁移
     
     说明：
         此函数在应用启动时调用，确保数据库表结构存在
-        如果表已存在，不会重复创建
+        如果表已存在，不会重复创建；已有表上新增的列和索引由迁移补齐
     """
-    Base.metadata.create_all(bind=engine)  # 创建所有表结构 
\ No newline at end of file
+    from .migrations import run_migrations
+    
+    Base.metadata.create_all(bind=engine)  # 创建所有表结构
+    run_migrations(engine)  # 补齐新增列、索引并回填数据 
\ No newline at end of file
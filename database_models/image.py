@@ -2,7 +2,7 @@
 # 功能：图片数据模型定义
 # 实现：使用SQLAlchemy ORM，存储用户上传的图片信息
 
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime, timezone, timedelta
 from .database import Base
@@ -19,6 +19,7 @@ class Image(Base):
         - filename: 文件名
         - file_path: 文件存储路径
         - file_size: 文件大小（字节）
+        - file_crc32: 文件内容的 CRC-32（数据导出断点续传时无需重读已发送的文件；早期图片为空）
         - mime_type: 文件MIME类型
         - width: 图片宽度
         - height: 图片高度
@@ -30,6 +31,10 @@ class Image(Base):
         - user: 关联的用户对象（多对一关系）
     """
     __tablename__ = "images"  # 数据库表名
+    __table_args__ = (
+        # 生成日记时按用户和会话查找图片；前缀也覆盖按用户批量删除
+        Index("ix_images_user_session", "user_id", "session_id"),
+    )
     
     # 主键字段
     id = Column(Integer, primary_key=True, index=True)  # 图片ID，主键，建立索引
@@ -41,6 +46,7 @@ class Image(Base):
     filename = Column(String(255), nullable=False)  # 文件名，不可为空
     file_path = Column(String(500), nullable=False)  # 文件存储路径，不可为空
     file_size = Column(Integer, nullable=False)  # 文件大小（字节），不可为空
+    file_crc32 = Column(Integer, nullable=True)  # 文件 CRC-32，可为空
     mime_type = Column(String(100), nullable=False)  # 文件MIME类型，不可为空
     
     # 图片属性字段
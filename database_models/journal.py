@@ -2,7 +2,7 @@
 # 功能：日记数据模型定义
 # 实现：使用SQLAlchemy ORM，存储用户心情日记
 
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Index, text
 from sqlalchemy.orm import relationship
 from datetime import datetime, timezone, timedelta
 from .database import Base
@@ -17,6 +17,7 @@ class Journal(Base):
         - id: 主键，日记唯一标识
         - user_id: 外键，关联用户ID
         - content: 日记内容（LLM生成）
+        - title: 日记标题（LLM生成，可为空）
         - emotion: 情绪标签
         - session_id: 关联的对话会话ID（用于获取完整对话历史）
         - memory_point: 记忆点摘要（LLM生成的智能总结）
@@ -25,6 +26,15 @@ class Journal(Base):
         - user: 关联的用户对象（多对一关系）
     """
     __tablename__ = "journals"  # 数据库表名
+    __table_args__ = (
+        # 日记列表：按用户过滤、按创建时间倒序
+        Index("ix_journals_user_created", "user_id", "created_at"),
+        # 最新记忆点：部分索引只包含已生成记忆点的日记
+        Index("ix_journals_user_memory_created", "user_id", "created_at",
+              sqlite_where=text("memory_point IS NOT NULL")),
+        # 列表 ETag：按用户统计日记数与最后更新时间（覆盖索引，不回表）
+        Index("ix_journals_user_updated", "user_id", "updated_at"),
+    )
     
     # 主键字段
     id = Column(Integer, primary_key=True, index=True)  # 日记ID，主键，建立索引
@@ -34,12 +44,13 @@ class Journal(Base):
     
     # 核心内容字段
     content = Column(Text, nullable=False)  # 日记内容，不可为空
+    title = Column(String, nullable=True)  # 日记标题，LLM生成，可为空
     
     # 关联信息字段
     emotion = Column(String, nullable=True)  # 情绪标签，可为空
     session_id = Column(String, nullable=True)  # 关联的对话会话ID，可为空
     memory_point = Column(Text, nullable=True)  # 记忆点摘要，LLM生成的智能总结，可为空
-    images = Column(String, nullable=True)  # 关联的图片ID列表，用逗号分隔，如"1,2,3"
+    images = Column(String, nullable=True)  # 旧版图片ID列表（逗号分隔），已迁移到 journal_images，不再写入
     
     # 时间戳字段
     # 使用lambda函数确保每次创建时都获取当前时间
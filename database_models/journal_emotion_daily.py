@@ -0,0 +1,29 @@
+# File: database_models/journal_emotion_daily.py
+# 功能：每日情绪统计数据模型定义
+# 实现：使用SQLAlchemy ORM，按用户、日期、情绪汇总日记篇数，由 journals 上的触发器增量维护
+
+from sqlalchemy import Column, Integer, String, Date
+from .database import Base
+
+# ==================== 每日情绪统计模型 ====================
+class JournalEmotionDaily(Base):
+    """
+    每日情绪统计模型
+    功能：日记新建、修改情绪/日期、删除时由触发器增减对应计数（计数归零的行会被删除），
+         情绪日历与趋势统计只读取本表，不扫描 journals
+
+    字段说明：
+        - user_id: 用户ID（联合主键）
+        - day: 日记创建日期（东八区，联合主键）
+        - emotion: 情绪标签，未设置情绪时为空字符串（联合主键）
+        - count: 日记篇数
+    """
+    __tablename__ = "journal_emotion_daily"  # 数据库表名
+
+    # 联合主键：按 (user_id, day) 前缀做范围查询
+    user_id = Column(Integer, primary_key=True)  # 用户ID
+    day = Column(Date, primary_key=True)  # 日期
+    emotion = Column(String, primary_key=True)  # 情绪标签
+
+    # 统计字段
+    count = Column(Integer, nullable=False, default=0)  # 日记篇数，不可为空
@@ -0,0 +1,31 @@
+# File: database_models/journal_image.py
+# 功能：日记-图片关联数据模型定义
+# 实现：使用SQLAlchemy ORM，替代 journals.images 逗号分隔字段，支持按页批量 JOIN 读取图片
+
+from sqlalchemy import Column, Integer, ForeignKey, Index
+from .database import Base
+
+# ==================== 日记图片关联模型 ====================
+class JournalImage(Base):
+    """
+    日记图片关联模型
+    功能：记录日记引用的图片及其顺序，一篇日记可关联多张图片
+
+    字段说明：
+        - journal_id: 主键之一，关联 journals.id
+        - position: 主键之一，图片在日记中的顺序，从0开始（主键顺序即读取顺序，无需额外排序）
+        - image_id: 外键，关联 images.id
+    """
+    __tablename__ = "journal_images"  # 数据库表名
+
+    # 联合主键字段
+    journal_id = Column(Integer, ForeignKey("journals.id"), primary_key=True)  # 日记ID
+    position = Column(Integer, primary_key=True, default=0)  # 图片顺序
+
+    # 外键字段
+    image_id = Column(Integer, ForeignKey("images.id"), nullable=False)  # 图片ID，不可为空
+
+    # 索引：按图片反查引用（清理未引用图片、删除图片时使用）
+    __table_args__ = (
+        Index("ix_journal_images_image_id", "image_id"),
+    )
@@ -0,0 +1,366 @@
+# File: database_models/migrations.py
+# 功能：轻量数据库迁移
+# 实现：create_all 只会创建缺失的表，这里补齐已有表上新增的列、索引，并执行一次性数据回填
+
+import json
+import logging
+from typing import Callable, List
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+from .database import Base
+
+logger = logging.getLogger(__name__)
+
+# 回填时每批处理的行数
+BACKFILL_BATCH_SIZE = 500
+
+
+def _add_missing_columns(conn: Connection) -> None:
+    """
+    为已存在的表补齐模型中新增的列（ALTER TABLE ... ADD COLUMN）
+    """
+    inspector = inspect(conn)
+    existing_tables = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {col["name"] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'))
+            logger.info(f"🔧 数据库迁移：{table.name} 新增列 {column.name} {column_type}")
+
+
+def _create_missing_indexes(conn: Connection) -> None:
+    """
+    为已存在的表创建模型中声明但数据库中缺失的索引
+    新建索引后执行 ANALYZE 收集统计信息，使查询规划器能在同列索引与部分索引之间做出正确选择
+    """
+    inspector = inspect(conn)
+    existing_tables = set(inspector.get_table_names())
+    created = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            index.create(bind=conn)
+            created.append(index.name)
+            logger.info(f"🔧 数据库迁移：{table.name} 新增索引 {index.name}")
+    if created:
+        conn.execute(text("ANALYZE"))
+
+
+def _backfill_chat_session_summary(conn: Connection) -> None:
+    """
+    回填 chat_sessions 的列表摘要字段（message_count / last_role / last_message_preview）
+    仅处理 message_count 为空的历史数据，分批执行
+    """
+    from .chat_session import summarize_history
+
+    total = 0
+    while True:
+        rows = conn.execute(text(
+            "SELECT id, state_data FROM chat_sessions WHERE message_count IS NULL LIMIT :limit"
+        ), {"limit": BACKFILL_BATCH_SIZE}).fetchall()
+        if not rows:
+            break
+        for row_id, state_data in rows:
+            history = []
+            if state_data:
+                try:
+                    history = json.loads(state_data).get("history", [])
+                except Exception:
+                    history = []
+            message_count, last_role, preview = summarize_history(history)
+            conn.execute(text(
+                "UPDATE chat_sessions SET message_count = :count, last_role = :role, "
+                "last_message_preview = :preview WHERE id = :id"
+            ), {"count": message_count, "role": last_role, "preview": preview, "id": row_id})
+        total += len(rows)
+    if total:
+        logger.info(f"🔧 数据库迁移：已回填 {total} 个会话的列表摘要字段")
+
+
+def _backfill_chat_messages(conn: Connection) -> None:
+    """
+    将历史会话 state_data 中的消息拆分写入 chat_messages
+    仅处理尚无任何消息记录的会话，按 id 游标分批执行
+    """
+    total = 0
+    last_id = 0
+    while True:
+        rows = conn.execute(text(
+            "SELECT id, user_id, state_data FROM chat_sessions "
+            "WHERE id > :last_id AND message_count > 0 AND is_archived IS NOT 1 AND NOT EXISTS "
+            "(SELECT 1 FROM chat_messages m WHERE m.chat_session_id = chat_sessions.id) "
+            "ORDER BY id LIMIT :limit"
+        ), {"last_id": last_id, "limit": BACKFILL_BATCH_SIZE}).fetchall()
+        if not rows:
+            break
+        for row_id, user_id, state_data in rows:
+            last_id = row_id
+            try:
+                data = json.loads(state_data) if state_data else {}
+            except Exception:
+                continue
+            offset = data.get("history_offset", 0)
+            messages = []
+            for index, item in enumerate(data.get("history", [])):
+                if isinstance(item, (list, tuple)) and len(item) >= 2:
+                    role, content = item[0], item[1]
+                elif isinstance(item, dict):
+                    role, content = item.get("role"), item.get("content")
+                else:
+                    continue
+                messages.append({
+                    "chat_session_id": row_id,
+                    "user_id": user_id,
+                    "seq": offset + index,
+                    "role": str(role or ""),
+                    "content": str(content or ""),
+                })
+            if messages:
+                conn.execute(text(
+                    "INSERT INTO chat_messages (chat_session_id, user_id, seq, role, content) "
+                    "VALUES (:chat_session_id, :user_id, :seq, :role, :content)"
+                ), messages)
+                total += 1
+    if total:
+        logger.info(f"🔧 数据库迁移：已为 {total} 个会话回填 chat_messages")
+
+
+def _backfill_journal_images(conn: Connection) -> None:
+    """
+    将 journals.images 逗号分隔字段中的图片ID迁移到 journal_images
+    仅处理尚无关联记录的日记，按 id 游标分批执行；已不存在的图片ID直接跳过
+    """
+    total = 0
+    last_id = 0
+    while True:
+        rows = conn.execute(text(
+            "SELECT id, images FROM journals "
+            "WHERE id > :last_id AND images IS NOT NULL AND images != '' AND NOT EXISTS "
+            "(SELECT 1 FROM journal_images ji WHERE ji.journal_id = journals.id) "
+            "ORDER BY id LIMIT :limit"
+        ), {"last_id": last_id, "limit": BACKFILL_BATCH_SIZE}).fetchall()
+        if not rows:
+            break
+        for journal_id, images in rows:
+            last_id = journal_id
+            links = []
+            seen = set()
+            for part in images.split(","):
+                try:
+                    image_id = int(part.strip())
+                except ValueError:
+                    continue
+                if image_id in seen:
+                    continue
+                seen.add(image_id)
+                links.append({"journal_id": journal_id, "image_id": image_id, "position": len(links)})
+            if links:
+                conn.execute(text(
+                    "INSERT OR IGNORE INTO journal_images (journal_id, image_id, position) "
+                    "SELECT :journal_id, :image_id, :position "
+                    "WHERE EXISTS (SELECT 1 FROM images WHERE images.id = :image_id)"
+                ), links)
+                total += 1
+    if total:
+        logger.info(f"🔧 数据库迁移：已为 {total} 篇日记迁移图片关联")
+
+
+# 日记全文检索：外部内容 FTS5 表（只存索引不存原文），trigram 分词支持中文任意子串匹配，由触发器与 journals 保持同步
+JOURNAL_FTS_TABLE = "journals_fts"
+JOURNAL_FTS_DDL = [
+    f"CREATE VIRTUAL TABLE {JOURNAL_FTS_TABLE} USING fts5("
+    f"content, memory_point, title, content='journals', content_rowid='id', tokenize='trigram')",
+    f"CREATE TRIGGER IF NOT EXISTS journals_fts_ai AFTER INSERT ON journals BEGIN "
+    f"INSERT INTO {JOURNAL_FTS_TABLE}(rowid, content, memory_point, title) "
+    f"VALUES (new.id, new.content, new.memory_point, new.title); END",
+    f"CREATE TRIGGER IF NOT EXISTS journals_fts_ad AFTER DELETE ON journals BEGIN "
+    f"INSERT INTO {JOURNAL_FTS_TABLE}({JOURNAL_FTS_TABLE}, rowid, content, memory_point, title) "
+    f"VALUES ('delete', old.id, old.content, old.memory_point, old.title); END",
+    f"CREATE TRIGGER IF NOT EXISTS journals_fts_au AFTER UPDATE OF content, memory_point, title ON journals BEGIN "
+    f"INSERT INTO {JOURNAL_FTS_TABLE}({JOURNAL_FTS_TABLE}, rowid, content, memory_point, title) "
+    f"VALUES ('delete', old.id, old.content, old.memory_point, old.title); "
+    f"INSERT INTO {JOURNAL_FTS_TABLE}(rowid, content, memory_point, title) "
+    f"VALUES (new.id, new.content, new.memory_point, new.title); END",
+]
+
+
+def _create_journal_fts(conn: Connection) -> None:
+    """
+    创建日记全文检索表与同步触发器，首次创建时从 journals 重建索引
+    仅 SQLite 且支持 FTS5 trigram 分词（3.34+）时创建；不支持时检索接口退回 LIKE 匹配
+    """
+    if conn.dialect.name != "sqlite":
+        return
+    exists = conn.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+    ), {"name": JOURNAL_FTS_TABLE}).first()
+    if exists:
+        return
+    try:
+        with conn.begin_nested():
+            for ddl in JOURNAL_FTS_DDL:
+                conn.execute(text(ddl))
+            conn.execute(text(f"INSERT INTO {JOURNAL_FTS_TABLE}({JOURNAL_FTS_TABLE}) VALUES ('rebuild')"))
+    except Exception as e:
+        logger.warning(f"⚠️ 创建日记全文检索表失败（需要 SQLite 3.34+ 的 FTS5 trigram 分词），检索将退回 LIKE 匹配: {e}")
+        return
+    logger.info(f"🔧 数据库迁移：创建日记全文检索表 {JOURNAL_FTS_TABLE} 并重建索引")
+
+
+# 增量同步：journals / chat_sessions / images 的每次增删改由触发器写入 change_log（每条数据只保留最近一次变更）
+CHANGE_LOG_TABLE = "change_log"
+_CHANGE_LOG_NOW = "datetime('now', '+8 hours')"
+
+
+def _change_log_trigger(name: str, event: str, table: str, entity: str, op: str, row: str, when: str = "") -> str:
+    return (
+        f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table} {when}BEGIN "
+        f"REPLACE INTO {CHANGE_LOG_TABLE} (user_id, entity, entity_id, op, changed_at) "
+        f"VALUES ({row}.user_id, '{entity}', {row}.id, '{op}', {_CHANGE_LOG_NOW}); END"
+    )
+
+
+CHANGE_LOG_DDL = [
+    _change_log_trigger("change_log_journals_ai", "INSERT", "journals", "journal", "upsert", "new"),
+    _change_log_trigger("change_log_journals_au", "UPDATE", "journals", "journal", "upsert", "new"),
+    _change_log_trigger("change_log_journals_ad", "DELETE", "journals", "journal", "delete", "old"),
+    _change_log_trigger("change_log_images_ai", "INSERT", "images", "image", "upsert", "new"),
+    _change_log_trigger("change_log_images_au", "UPDATE", "images", "image", "upsert", "new"),
+    _change_log_trigger("change_log_images_ad", "DELETE", "images", "image", "delete", "old"),
+    _change_log_trigger("change_log_sessions_ai", "INSERT", "chat_sessions", "session", "upsert", "new"),
+    # 只有列表可见的字段变化才记录（归档/恢复会话只改写状态数据，不产生变更）
+    _change_log_trigger("change_log_sessions_au", "UPDATE", "chat_sessions", "session", "upsert", "new",
+                        when="WHEN new.updated_at IS NOT old.updated_at OR new.is_active IS NOT old.is_active "
+                             "OR new.message_count IS NOT old.message_count "
+                             "OR new.last_message_preview IS NOT old.last_message_preview "),
+    _change_log_trigger("change_log_sessions_ad", "DELETE", "chat_sessions", "session", "delete", "old"),
+] + [
+    # 日记的图片列表变化记为日记变更；日记本身已删除时不写入（避免覆盖墓碑）
+    f"CREATE TRIGGER IF NOT EXISTS change_log_journal_images_{suffix} AFTER {event} ON journal_images BEGIN "
+    f"REPLACE INTO {CHANGE_LOG_TABLE} (user_id, entity, entity_id, op, changed_at) "
+    f"SELECT user_id, 'journal', id, 'upsert', {_CHANGE_LOG_NOW} FROM journals WHERE id = {row}.journal_id; END"
+    for suffix, event, row in (("ai", "INSERT", "new"), ("ad", "DELETE", "old"))
+]
+
+# 首次创建触发器时为已有数据补一条 upsert 记录，使从零开始的同步能拿到全部数据
+_CHANGE_LOG_BACKFILL = [
+    f"INSERT OR IGNORE INTO {CHANGE_LOG_TABLE} (user_id, entity, entity_id, op, changed_at) "
+    f"SELECT user_id, '{entity}', id, 'upsert', {_CHANGE_LOG_NOW} FROM {table} ORDER BY id"
+    for table, entity in (("journals", "journal"), ("chat_sessions", "session"), ("images", "image"))
+]
+
+
+def _create_change_log_triggers(conn: Connection) -> None:
+    """
+    创建增量同步的变更日志触发器，首次创建时回填已有数据
+    仅 SQLite；其他数据库的触发器语法不同，暂不支持增量同步
+    """
+    if conn.dialect.name != "sqlite":
+        return
+    exists = conn.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'change_log_journals_ai'"
+    )).first()
+    if exists:
+        return
+    with conn.begin_nested():
+        for ddl in CHANGE_LOG_DDL:
+            conn.execute(text(ddl))
+        for backfill in _CHANGE_LOG_BACKFILL:
+            conn.execute(text(backfill))
+    total = conn.execute(text(f"SELECT COUNT(*) FROM {CHANGE_LOG_TABLE}")).scalar()
+    logger.info(f"🔧 数据库迁移：创建变更日志触发器，回填 {total} 条记录")
+
+
+# 每日情绪统计：由 journals 上的触发器增量维护（新建 +1，删除 -1，修改情绪或日期时从旧桶移到新桶）
+EMOTION_ROLLUP_TABLE = "journal_emotion_daily"
+_ROLLUP_DAY = "substr({row}.created_at, 1, 10)"
+_ROLLUP_EMOTION = "COALESCE({row}.emotion, '')"
+
+
+def _rollup_increment(row: str) -> str:
+    return (
+        f"INSERT INTO {EMOTION_ROLLUP_TABLE} (user_id, day, emotion, count) "
+        f"SELECT {row}.user_id, {_ROLLUP_DAY.format(row=row)}, {_ROLLUP_EMOTION.format(row=row)}, 1 "
+        f"WHERE {row}.created_at IS NOT NULL "
+        f"ON CONFLICT (user_id, day, emotion) DO UPDATE SET count = count + 1;"
+    )
+
+
+def _rollup_decrement(row: str) -> str:
+    match = (f"user_id = {row}.user_id AND day = {_ROLLUP_DAY.format(row=row)} "
+             f"AND emotion = {_ROLLUP_EMOTION.format(row=row)}")
+    return (
+        f"UPDATE {EMOTION_ROLLUP_TABLE} SET count = count - 1 WHERE {match}; "
+        f"DELETE FROM {EMOTION_ROLLUP_TABLE} WHERE {match} AND count <= 0;"
+    )
+
+
+EMOTION_ROLLUP_DDL = [
+    f"CREATE TRIGGER IF NOT EXISTS emotion_rollup_ai AFTER INSERT ON journals BEGIN "
+    f"{_rollup_increment('new')} END",
+    f"CREATE TRIGGER IF NOT EXISTS emotion_rollup_ad AFTER DELETE ON journals BEGIN "
+    f"{_rollup_decrement('old')} END",
+    f"CREATE TRIGGER IF NOT EXISTS emotion_rollup_au AFTER UPDATE OF user_id, emotion, created_at ON journals "
+    f"WHEN new.user_id IS NOT old.user_id OR new.emotion IS NOT old.emotion "
+    f"OR {_ROLLUP_DAY.format(row='new')} IS NOT {_ROLLUP_DAY.format(row='old')} BEGIN "
+    f"{_rollup_decrement('old')} {_rollup_increment('new')} END",
+]
+
+
+def _create_emotion_rollup(conn: Connection) -> None:
+    """
+    创建每日情绪统计触发器，首次创建时从 journals 汇总已有数据
+    仅 SQLite（UPSERT 需要 3.24+）
+    """
+    if conn.dialect.name != "sqlite":
+        return
+    exists = conn.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'emotion_rollup_ai'"
+    )).first()
+    if exists:
+        return
+    with conn.begin_nested():
+        conn.execute(text(f"DELETE FROM {EMOTION_ROLLUP_TABLE}"))
+        conn.execute(text(
+            f"INSERT INTO {EMOTION_ROLLUP_TABLE} (user_id, day, emotion, count) "
+            f"SELECT user_id, substr(created_at, 1, 10), COALESCE(emotion, ''), COUNT(*) FROM journals "
+            f"WHERE created_at IS NOT NULL GROUP BY 1, 2, 3"
+        ))
+        for ddl in EMOTION_ROLLUP_DDL:
+            conn.execute(text(ddl))
+    total = conn.execute(text(f"SELECT COUNT(*) FROM {EMOTION_ROLLUP_TABLE}")).scalar()
+    logger.info(f"🔧 数据库迁移：创建每日情绪统计触发器，汇总 {total} 行")
+
+
+# 数据回填步骤（必须幂等，每次启动都会执行）
+DATA_MIGRATIONS: List[Callable[[Connection], None]] = [
+    _backfill_chat_session_summary,
+    _backfill_chat_messages,
+    _backfill_journal_images,
+]
+
+
+def run_migrations(engine: Engine) -> None:
+    """
+    执行所有迁移步骤
+    说明：在 create_all 之后调用，各步骤均为幂等操作
+    """
+    with engine.begin() as conn:
+        _add_missing_columns(conn)
+        _create_missing_indexes(conn)
+        _create_journal_fts(conn)
+        _create_change_log_triggers(conn)
+        _create_emotion_rollup(conn)
+        for migration in DATA_MIGRATIONS:
+            migration(conn)
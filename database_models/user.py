@@ -18,6 +18,7 @@ class User(Base):
         - email: 用户邮箱（可选）
         - name: 用户姓名（可选）
         - heart: 用户心数值，初始值为100
+        - heart_reset_date: 心数最后一次按日重置的日期（北京时间），不是今天时按订阅状态视为当日额度
         - birthday: 用户生日，可为空
         - subscription_status: 订阅状态（active/expired/cancelled/inactive）
         - subscription_product_id: 订阅产品ID
@@ -38,9 +39,10 @@ class User(Base):
     apple_user_id = Column(String, unique=True, index=True)  # Apple用户ID，唯一，建立索引
     
     # 用户基本信息字段
-    email = Column(String, nullable=True)  # 用户邮箱，可为空
+    email = Column(String, nullable=True, index=True)  # 用户邮箱，可为空，建立索引（测试/QA 登录按邮箱查找）
     name = Column(String, nullable=True)  # 用户姓名，可为空
     heart = Column(Integer, default=10, nullable=False)  # 用户心数值，默认10，不可为空
+    heart_reset_date = Column(Date, nullable=True)  # 心数最后一次按日重置的日期，为空表示从未重置
     
     # 用户信息字段
     birthday = Column(Date, nullable=True)  # 用户生日，可为空
@@ -49,7 +51,7 @@ class User(Base):
     subscription_status = Column(String, default="inactive", nullable=False)  # 订阅状态：active, expired, cancelled, inactive
     subscription_product_id = Column(String, nullable=True)  # 订阅产品ID
     subscription_expires_at = Column(DateTime, nullable=True)  # 订阅到期时间
-    original_transaction_id = Column(String, nullable=True)  # 原始交易ID
+    original_transaction_id = Column(String, nullable=True, index=True)  # 原始交易ID，建立索引（订阅通知按此查找用户）
     latest_receipt = Column(String, nullable=True)  # 最新收据数据
     auto_renew_status = Column(Boolean, default=False, nullable=False)  # 自动续费状态
     subscription_environment = Column(String, default="sandbox", nullable=False)  # 订阅环境：sandbox, production
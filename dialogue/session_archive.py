@@ -0,0 +1,268 @@
+# File: dialogue/session_archive.py
+# 功能：冷会话压缩归档
+# 实现：把长期未访问的会话状态与消息压缩后移入 chat_session_archives，访问时透明恢复
+
+import json
+import logging
+import os
+import zlib
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database_models import SessionLocal, write_session, ChatSession, ChatMessage
+from database_models.chat_session_archive import ChatSessionArchive
+from services.metrics import metrics
+from . import state_codec
+
+# zstandard 已在 requirements.txt 中声明；未安装时新归档使用 zlib，但无法读取 zstd 归档
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# 会话超过多少天未更新即视为冷会话
+ARCHIVE_AFTER_DAYS = int(os.getenv("SESSION_ARCHIVE_AFTER_DAYS", "30"))
+# 每次压缩任务最多处理的会话数
+ARCHIVE_BATCH_SIZE = int(os.getenv("SESSION_ARCHIVE_BATCH_SIZE", "200"))
+
+
+def _compress(data: bytes) -> tuple:
+    """
+    压缩数据，优先使用 zstd
+    :return: (codec, 压缩后数据)
+    """
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=10).compress(data)
+    return "zlib", zlib.compress(data, 9)
+
+
+def _decompress(codec: str, payload: bytes) -> bytes:
+    """
+    按归档时记录的算法解压数据
+    """
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("归档使用 zstd 压缩，但当前环境未安装 zstandard")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    if codec == "zlib":
+        return zlib.decompress(payload)
+    raise ValueError(f"未知的归档压缩算法: {codec}")
+
+
+class SessionArchiver:
+    """
+    冷会话归档器
+    功能：压缩归档冷会话、透明恢复被重新访问的会话，并统计节省的存储空间
+    """
+
+    def archive_session(self, db: Session, chat_session: ChatSession) -> Optional[int]:
+        """
+        归档单个会话（不提交事务）
+        :param db: 数据库会话
+        :param chat_session: 会话记录
+        :return: 节省的字节数；压缩后不比原数据小时不归档，返回 None
+        """
+        messages = db.query(ChatMessage.seq, ChatMessage.role, ChatMessage.content, ChatMessage.created_at).filter(
+            ChatMessage.chat_session_id == chat_session.id
+        ).order_by(ChatMessage.seq).all()
+
+        raw_state = chat_session.state_blob or chat_session.state_data
+        state = state_codec.decode(raw_state)
+        # 消息已完整保存在 messages 中，归档时不重复保存 history
+        state.pop("history", None)
+        raw = json.dumps({
+            "state": state,
+            "messages": [[m.seq, m.role, m.content, m.created_at.isoformat() if m.created_at else None]
+                         for m in messages],
+        }, ensure_ascii=False).encode("utf-8")
+        codec, payload = _compress(raw)
+
+        # 压缩前大小按热表中实际占用的会话状态 + 消息内容计算
+        state_size = len(raw_state.encode("utf-8")) if isinstance(raw_state, str) else len(raw_state or b"")
+        raw_size = state_size + sum(
+            len((m.content or "").encode("utf-8")) for m in messages
+        )
+        # 很短的会话压缩后反而更大（JSON 结构与压缩头的开销），保留在热表
+        if len(payload) >= raw_size:
+            metrics.incr("session_archive.skipped_small")
+            return None
+
+        db.merge(ChatSessionArchive(
+            chat_session_id=chat_session.id,
+            user_id=chat_session.user_id,
+            codec=codec,
+            payload=payload,
+            raw_size=raw_size,
+            compressed_size=len(payload),
+        ))
+        db.query(ChatMessage).filter(
+            ChatMessage.chat_session_id == chat_session.id
+        ).delete(synchronize_session=False)
+        # 显式保留 updated_at，避免归档操作改变会话列表排序
+        db.query(ChatSession).filter(ChatSession.id == chat_session.id).update({
+            ChatSession.state_data: None,
+            ChatSession.state_blob: None,
+            ChatSession.is_archived: True,
+            ChatSession.updated_at: ChatSession.updated_at,
+        }, synchronize_session=False)
+
+        return raw_size - len(payload)
+
+    @staticmethod
+    def _unpack_messages(data: Dict[str, Any]) -> List[tuple]:
+        """
+        解析归档中的消息列表
+        :return: 按序号排列的 (seq, role, content, created_at) 列表；
+                 早期归档未保存消息时间，created_at 为 None
+        """
+        messages = []
+        for message in data.get("messages", []):
+            seq, role, content = message[:3]
+            created_at = message[3] if len(message) > 3 else None
+            messages.append((seq, role, content, datetime.fromisoformat(created_at) if created_at else None))
+        return messages
+
+    def read_messages(self, archive: ChatSessionArchive) -> List[tuple]:
+        """
+        只读解压归档中的消息（不恢复会话，用于数据导出）
+        :param archive: 归档记录
+        :return: 按序号排列的 (seq, role, content, created_at) 列表
+        """
+        data = json.loads(_decompress(archive.codec, archive.payload).decode("utf-8"))
+        return self._unpack_messages(data)
+
+    def rehydrate(self, db: Session, chat_session_id: int) -> Optional[bytes]:
+        """
+        恢复已归档的会话（不提交事务）
+        :param db: 数据库会话
+        :param chat_session_id: 会话记录ID
+        :return: 恢复后的会话状态编码数据；归档不存在时返回 None
+        """
+        archive = db.query(ChatSessionArchive).filter(
+            ChatSessionArchive.chat_session_id == chat_session_id
+        ).first()
+        if not archive:
+            logger.warning(f"⚠️ 会话 {chat_session_id} 标记为已归档，但归档数据不存在")
+            db.query(ChatSession).filter(ChatSession.id == chat_session_id).update({
+                ChatSession.is_archived: False,
+                ChatSession.updated_at: ChatSession.updated_at,
+            }, synchronize_session=False)
+            return None
+
+        data = json.loads(_decompress(archive.codec, archive.payload).decode("utf-8"))
+        state = data.get("state", {})
+        messages = self._unpack_messages(data)
+        offset = state.get("history_offset", 0)
+        state["history"] = [[role, content] for seq, role, content, _ in messages if seq >= offset]
+        state_blob = state_codec.encode(state)
+
+        db.add_all([
+            ChatMessage(
+                chat_session_id=chat_session_id,
+                user_id=archive.user_id,
+                seq=seq,
+                role=role,
+                content=content,
+                # 早期归档没有消息时间，沿用默认值（恢复时间）
+                **({"created_at": created_at} if created_at else {}),
+            )
+            for seq, role, content, created_at in messages
+        ])
+        db.query(ChatSession).filter(ChatSession.id == chat_session_id).update({
+            ChatSession.state_blob: state_blob,
+            ChatSession.is_archived: False,
+            ChatSession.updated_at: ChatSession.updated_at,
+        }, synchronize_session=False)
+        db.delete(archive)
+        db.flush()
+
+        metrics.incr("session_archive.rehydrated")
+        logger.info(f"📦 已恢复归档会话: chat_session_id={chat_session_id}")
+        return state_blob
+
+    def compact_cold_sessions(self, days: int = ARCHIVE_AFTER_DAYS, batch_size: int = ARCHIVE_BATCH_SIZE,
+                              skip_keys: Iterable[str] = ()) -> Dict[str, Any]:
+        """
+        压缩归档冷会话：非活跃会话，或超过 days 天未更新的会话
+        :param days: 冷会话阈值（天）
+        :param batch_size: 每次读取的候选会话数
+        :param skip_keys: 需跳过的会话缓存键（内存中仍在使用的会话）
+        :return: 本次归档统计
+        说明：每个会话在各自的短写事务中归档，避免长时间持有写锁阻塞对话写入；单个会话失败不影响其余会话
+        """
+        cutoff = datetime.now(timezone(timedelta(hours=8))) - timedelta(days=days)
+        is_cold = (ChatSession.is_archived.isnot(True)
+                   & ((ChatSession.is_active == False) | (ChatSession.updated_at < cutoff)))
+        skip_keys = set(skip_keys)
+        archived = 0
+        failed = 0
+        bytes_saved = 0
+        last_id = 0
+
+        while True:
+            db: Session = SessionLocal()
+            try:
+                candidates = db.query(ChatSession.id, ChatSession.user_id, ChatSession.session_id).filter(
+                    ChatSession.id > last_id, is_cold
+                ).order_by(ChatSession.id).limit(batch_size).all()
+            finally:
+                db.close()
+            if not candidates:
+                break
+
+            for candidate in candidates:
+                last_id = candidate.id
+                if f"user_{candidate.user_id}_{candidate.session_id}" in skip_keys:
+                    continue
+                try:
+                    with write_session() as db:
+                        # 读取候选后会话可能已被更新或归档，在写事务内重新确认
+                        chat_session = db.query(ChatSession).filter(ChatSession.id == candidate.id, is_cold).first()
+                        saved = self.archive_session(db, chat_session) if chat_session else None
+                except Exception as e:
+                    failed += 1
+                    logger.error(f"❌ 冷会话归档失败: chat_session_id={candidate.id}, error={e}")
+                    continue
+                if saved is not None:
+                    bytes_saved += saved
+                    archived += 1
+
+        metrics.incr("session_archive.runs")
+        metrics.incr("session_archive.archived", archived)
+        metrics.incr("session_archive.failed", failed)
+        metrics.incr("session_archive.bytes_saved", bytes_saved)
+        storage = self.storage_stats()
+        metrics.set_gauge("session_archive.total_sessions", storage["sessions"])
+        metrics.set_gauge("session_archive.total_bytes_saved", storage["bytes_saved"])
+
+        logger.info(f"📦 冷会话归档完成: 归档 {archived} 个会话，失败 {failed} 个，节省 {bytes_saved / 1024:.1f} KB")
+        return {"archived": archived, "failed": failed, "bytes_saved": bytes_saved, **{f"total_{k}": v for k, v in storage.items()}}
+
+    def storage_stats(self) -> Dict[str, int]:
+        """
+        统计归档表的累计存储情况
+        """
+        db: Session = SessionLocal()
+        try:
+            count, raw_size, compressed_size = db.query(
+                func.count(ChatSessionArchive.chat_session_id),
+                func.coalesce(func.sum(ChatSessionArchive.raw_size), 0),
+                func.coalesce(func.sum(ChatSessionArchive.compressed_size), 0),
+            ).one()
+            return {
+                "sessions": count,
+                "raw_bytes": raw_size,
+                "compressed_bytes": compressed_size,
+                "bytes_saved": raw_size - compressed_size,
+            }
+        finally:
+            db.close()
+
+
+# 全局会话归档器实例
+session_archiver = SessionArchiver()
@@ -2,15 +2,28 @@
 # 功能：聊天会话管理服务
 # 实现：管理用户聊天会话的创建、获取、更新和存储
 
-import json
+import asyncio
 import logging
-from typing import Optional
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from database_models import SessionLocal, ChatSession
+from database_models import SessionLocal, AsyncSessionLocal, ChatSession, ChatMessage, write_session
+from database_models.chat_session import summarize_history
 from .state_tracker import StateTracker
+from .session_archive import session_archiver
+from services.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
+# 内存中最多缓存的会话数，超出时淘汰最久未访问的会话（会话状态每轮对话后均已写库，淘汰后按需从数据库恢复）
+SESSION_CACHE_MAX_SESSIONS = int(os.getenv("SESSION_CACHE_MAX_SESSIONS", "2000"))
+# 会话超过该时长（秒）未访问时由缓存清理任务淘汰
+SESSION_CACHE_IDLE_SECONDS = float(os.getenv("SESSION_CACHE_IDLE_SECONDS", "7200"))
+
 class SessionManager:
     """
     聊天会话管理器
@@ -18,7 +31,58 @@ class SessionManager:
     """
     
     def __init__(self):
-        self.memory_cache = {}  # 内存缓存，提高性能
+        self.memory_cache: "OrderedDict[str, StateTracker]" = OrderedDict()  # 内存缓存，按最近访问排序（LRU）
+        self._last_access: Dict[str, float] = {}  # 会话键最近一次访问时间
+        self._user_keys: Dict[int, Set[str]] = {}  # 每个用户在内存缓存中的会话键，按用户清理时无需扫描全部缓存
+        self._cache_lock = threading.Lock()
+    
+    def _cache_session(self, user_id: int, session_key: str, state: StateTracker, overwrite: bool = True) -> StateTracker:
+        """
+        写入内存缓存并登记到用户的会话键集合；超出 SESSION_CACHE_MAX_SESSIONS 时淘汰最久未访问的会话
+        :param overwrite: 为 False 时已有缓存优先（并发加载以先写入的实例为准）
+        :return: 缓存中的实例
+        """
+        with self._cache_lock:
+            self._user_keys.setdefault(user_id, set()).add(session_key)
+            if overwrite:
+                self.memory_cache[session_key] = state
+            else:
+                state = self.memory_cache.setdefault(session_key, state)
+            self._touch(session_key)
+            evicted = 0
+            while len(self.memory_cache) > SESSION_CACHE_MAX_SESSIONS:
+                self._drop(next(iter(self.memory_cache)))
+                evicted += 1
+        if evicted:
+            metrics.incr("session_cache.evicted", evicted)
+        return state
+    
+    def _touch(self, session_key: str) -> None:
+        """
+        记录访问（调用方持有锁）
+        """
+        self.memory_cache.move_to_end(session_key)
+        self._last_access[session_key] = time.monotonic()
+    
+    def _drop(self, session_key: str) -> None:
+        """
+        移除单个会话缓存并同步用户的会话键集合（调用方持有锁）
+        """
+        self.memory_cache.pop(session_key, None)
+        self._last_access.pop(session_key, None)
+        user_id = int(session_key.split("_", 2)[1])
+        keys = self._user_keys.get(user_id)
+        if keys is not None:
+            keys.discard(session_key)
+            if not keys:
+                self._user_keys.pop(user_id, None)
+    
+    def cached_session_keys(self) -> List[str]:
+        """
+        获取内存缓存中的全部会话键（快照）
+        """
+        with self._cache_lock:
+            return list(self.memory_cache)
     
     def get_or_create_session(self, user_id: int, session_id: str) -> StateTracker:
         """
@@ -30,9 +94,13 @@ class SessionManager:
         session_key = f"user_{user_id}_{session_id}"
         
         # 先从内存缓存获取
-        if session_key in self.memory_cache:
+        with self._cache_lock:
+            state = self.memory_cache.get(session_key)
+            if state is not None:
+                self._touch(session_key)
+        if state is not None:
             logger.debug(f"从内存缓存获取会话: {session_key}")
-            return self.memory_cache[session_key]
+            return state
         
         # 从数据库获取
         db: Session = SessionLocal()
@@ -44,22 +112,38 @@ class SessionManager:
             ).first()
             
             if chat_session:
-                # 从数据库恢复会话状态
-                state_data = json.loads(chat_session.state_data) if chat_session.state_data else {}
-                state = StateTracker.from_dict(state_data)
+                # 已归档的会话先透明恢复
+                raw_state = chat_session.state_blob or chat_session.state_data
+                if chat_session.is_archived:
+                    raw_state = self._rehydrate(chat_session.id)
+                # 从数据库恢复会话状态（兼容旧版 JSON 文本）
+                state = StateTracker.from_bytes(raw_state)
                 logger.debug(f"从数据库恢复会话: {session_key}")
             else:
                 # 创建新会话
                 state = StateTracker()
                 logger.debug(f"创建新会话: {session_key}")
             
-            # 存储到内存缓存
-            self.memory_cache[session_key] = state
-            return state
+            # 存储到内存缓存；并发加载（如后台预热）时以先写入缓存的实例为准
+            return self._cache_session(user_id, session_key, state, overwrite=False)
             
         finally:
             db.close()
     
+    @staticmethod
+    def _rehydrate(chat_session_id: int) -> Optional[bytes]:
+        """
+        在写会话中恢复已归档的会话；重新读取会话行，已被其他请求恢复时直接返回当前状态
+        :return: 会话状态编码数据
+        """
+        with write_session() as db:
+            chat_session = db.query(ChatSession).filter(ChatSession.id == chat_session_id).first()
+            if chat_session is None:
+                return None
+            if not chat_session.is_archived:
+                return chat_session.state_blob or chat_session.state_data
+            return session_archiver.rehydrate(db, chat_session_id)
+    
     def save_session(self, user_id: int, session_id: str, state: StateTracker) -> None:
         """
         保存聊天会话状态
@@ -70,45 +154,193 @@ class SessionManager:
         session_key = f"user_{user_id}_{session_id}"
         
         # 更新内存缓存
-        self.memory_cache[session_key] = state
+        self._cache_session(user_id, session_key, state)
+        
+        # 保存到数据库（串行写入，事务开始即持有写锁；编码在获取锁之前完成）
+        state_blob = state.to_bytes()
+        _, last_role, last_message_preview = summarize_history(state.history)
+        message_count = state.total_messages()
+        try:
+            with write_session() as db:
+                chat_session = db.query(ChatSession).filter(
+                    ChatSession.user_id == user_id,
+                    ChatSession.session_id == session_id,
+                    ChatSession.is_active == True
+                ).first()
+                
+                # 归档期间被写入的会话，先恢复消息再追加
+                if chat_session and chat_session.is_archived:
+                    session_archiver.rehydrate(db, chat_session.id)
+                
+                persisted_count = (chat_session.message_count or 0) if chat_session else 0
+                
+                if chat_session:
+                    # 更新现有会话
+                    chat_session.state_blob = state_blob
+                    chat_session.state_data = None  # 旧版 JSON 文本不再保留
+                    chat_session.message_count = message_count
+                    chat_session.last_role = last_role
+                    chat_session.last_message_preview = last_message_preview
+                    chat_session.updated_at = db.query(ChatSession).filter(
+                        ChatSession.id == chat_session.id
+                    ).first().updated_at
+                    logger.debug(f"更新会话状态: {session_key}")
+                else:
+                    # 创建新会话记录
+                    chat_session = ChatSession(
+                        user_id=user_id,
+                        session_id=session_id,
+                        state_blob=state_blob,
+                        message_count=message_count,
+                        last_role=last_role,
+                        last_message_preview=last_message_preview
+                    )
+                    db.add(chat_session)
+                    db.flush()  # 获取 chat_session.id
+                    logger.debug(f"创建新会话记录: {session_key}")
+                
+                # 追加尚未落库的消息（按绝对序号）
+                self._append_messages(db, chat_session, state, persisted_count)
+        except Exception as e:
+            logger.error(f"保存会话状态失败: {session_key}, 错误: {e}")
+            raise
+    
+    @staticmethod
+    def _append_messages(db: Session, chat_session: ChatSession, state: StateTracker, start_seq: int) -> None:
+        """
+        将序号 >= start_seq 的消息写入 chat_messages
+        :param db: 数据库会话
+        :param chat_session: 会话记录
+        :param state: StateTracker实例
+        :param start_seq: 已落库的消息条数
+        """
+        first_seq = max(start_seq, state.history_offset)
+        for seq in range(first_seq, state.total_messages()):
+            role, content = state.history[seq - state.history_offset][:2]
+            db.add(ChatMessage(
+                chat_session_id=chat_session.id,
+                user_id=chat_session.user_id,
+                seq=seq,
+                role=str(role or ""),
+                content=str(content or "")
+            ))
+    
+    @staticmethod
+    def _history_session_statement(user_id: int, session_id: str):
+        """
+        构造历史分页所需的会话摘要查询（同步与异步查询共用）
+        """
+        return select(
+            ChatSession.id,
+            ChatSession.message_count,
+            ChatSession.is_archived,
+            ChatSession.created_at,
+            ChatSession.updated_at,
+        ).where(
+            ChatSession.user_id == user_id,
+            ChatSession.session_id == session_id,
+            ChatSession.is_active == True
+        )
+    
+    @staticmethod
+    def _history_messages_statement(chat_session_id: int, before_seq: Optional[int], limit: int):
+        """
+        构造按序号倒序读取一页消息的查询（多取一条用于判断是否还有更早的消息）
+        """
+        statement = select(ChatMessage.seq, ChatMessage.role, ChatMessage.content).where(
+            ChatMessage.chat_session_id == chat_session_id
+        )
+        if before_seq is not None:
+            statement = statement.where(ChatMessage.seq < before_seq)
+        return statement.order_by(ChatMessage.seq.desc()).limit(limit + 1)
+    
+    @staticmethod
+    def _build_history_page(chat_session, rows, limit: int) -> Dict[str, Any]:
+        """
+        由会话摘要与消息查询结果组装分页结果
+        """
+        has_more = len(rows) > limit
+        rows = list(reversed(rows[:limit]))
+        messages: List[Dict[str, Any]] = [
+            {"seq": row.seq, "role": row.role, "content": row.content or ""} for row in rows
+        ]
         
-        # 保存到数据库
+        return {
+            "total_messages": chat_session.message_count or 0,
+            "messages": messages,
+            "has_more": has_more,
+            "next_before_seq": messages[0]["seq"] if has_more and messages else None,
+            "created_at": chat_session.created_at,
+            "updated_at": chat_session.updated_at,
+        }
+    
+    def get_history_page(self, user_id: int, session_id: str, before_seq: Optional[int] = None,
+                         limit: int = 50) -> Optional[Dict[str, Any]]:
+        """
+        按游标分页读取会话历史（直接读取 chat_messages，不写入内存缓存）
+        :param user_id: 用户ID
+        :param session_id: 会话ID
+        :param before_seq: 只返回序号小于该值的消息；为空时从最新消息开始
+        :param limit: 本页最多返回的消息条数
+        :return: 分页结果；会话不存在时返回 None
+        """
         db: Session = SessionLocal()
         try:
-            chat_session = db.query(ChatSession).filter(
-                ChatSession.user_id == user_id,
-                ChatSession.session_id == session_id,
-                ChatSession.is_active == True
-            ).first()
-            
-            state_data = json.dumps(state.to_dict(), ensure_ascii=False)
+            chat_session = db.execute(self._history_session_statement(user_id, session_id)).first()
             
-            if chat_session:
-                # 更新现有会话
-                chat_session.state_data = state_data
-                chat_session.updated_at = db.query(ChatSession).filter(
-                    ChatSession.id == chat_session.id
-                ).first().updated_at
-                logger.debug(f"更新会话状态: {session_key}")
-            else:
-                # 创建新会话记录
-                chat_session = ChatSession(
-                    user_id=user_id,
-                    session_id=session_id,
-                    state_data=state_data
-                )
-                db.add(chat_session)
-                logger.debug(f"创建新会话记录: {session_key}")
+            if not chat_session:
+                return None
             
-            db.commit()
+            # 已归档的会话先透明恢复（在写会话中完成，读取会话结束当前事务后再读取恢复的消息）
+            if chat_session.is_archived:
+                self._rehydrate(chat_session.id)
+                db.rollback()
             
-        except Exception as e:
-            db.rollback()
-            logger.error(f"保存会话状态失败: {session_key}, 错误: {e}")
-            raise
+            rows = db.execute(self._history_messages_statement(chat_session.id, before_seq, limit)).all()
+            return self._build_history_page(chat_session, rows, limit)
         finally:
             db.close()
     
+    async def get_history_page_async(self, user_id: int, session_id: str, before_seq: Optional[int] = None,
+                                     limit: int = 50) -> Optional[Dict[str, Any]]:
+        """
+        按游标分页读取会话历史（异步版本，参数与返回值同 get_history_page）
+        已归档的会话需要恢复写入，交给线程池中的同步版本处理
+        """
+        async with AsyncSessionLocal() as db:
+            chat_session = (await db.execute(self._history_session_statement(user_id, session_id))).first()
+            
+            if not chat_session:
+                return None
+            if chat_session.is_archived:
+                return await asyncio.to_thread(self.get_history_page, user_id, session_id, before_seq, limit)
+            
+            rows = (await db.execute(self._history_messages_statement(chat_session.id, before_seq, limit))).all()
+            return self._build_history_page(chat_session, rows, limit)
+
+    def warm_latest_session(self, user_id: int) -> Optional[str]:
+        """
+        将用户最近更新的活跃会话预加载到内存缓存（不创建新会话）
+        已归档的会话不预加载：恢复需要写库，且只应在真正对话或查看历史时发生
+        :param user_id: 用户ID
+        :return: 预加载的会话ID；用户没有活跃会话或最近的会话已归档时返回 None
+        """
+        db: Session = SessionLocal()
+        try:
+            latest = db.query(ChatSession.session_id, ChatSession.is_archived).filter(
+                ChatSession.user_id == user_id,
+                ChatSession.is_active == True
+            ).order_by(ChatSession.updated_at.desc()).first()
+        finally:
+            db.close()
+
+        if not latest or latest.is_archived:
+            return None
+        if f"user_{user_id}_{latest.session_id}" not in self.memory_cache:
+            self.get_or_create_session(user_id, latest.session_id)
+            logger.debug(f"预加载会话: user_{user_id}_{latest.session_id}")
+        return latest.session_id
+
     def clear_session(self, user_id: int, session_id: str) -> None:
         """
         清除聊天会话（标记为非活跃）
@@ -118,35 +350,76 @@ class SessionManager:
         session_key = f"user_{user_id}_{session_id}"
         
         # 清除内存缓存
-        if session_key in self.memory_cache:
-            del self.memory_cache[session_key]
+        self.evict_session(user_id, session_id)
         
-        # 标记数据库中的会话为非活跃
-        db: Session = SessionLocal()
+        # 标记数据库中的会话为非活跃（串行写入，事务开始即持有写锁）
         try:
-            chat_session = db.query(ChatSession).filter(
-                ChatSession.user_id == user_id,
-                ChatSession.session_id == session_id,
-                ChatSession.is_active == True
-            ).first()
-            
-            if chat_session:
-                chat_session.is_active = False
-                db.commit()
-                logger.debug(f"清除会话: {session_key}")
+            with write_session() as db:
+                chat_session = db.query(ChatSession).filter(
+                    ChatSession.user_id == user_id,
+                    ChatSession.session_id == session_id,
+                    ChatSession.is_active == True
+                ).first()
+                
+                if chat_session:
+                    chat_session.is_active = False
+                    logger.debug(f"清除会话: {session_key}")
             
         except Exception as e:
-            db.rollback()
             logger.error(f"清除会话失败: {session_key}, 错误: {e}")
             raise
-        finally:
-            db.close()
+    
+    def evict_session(self, user_id: int, session_id: str) -> None:
+        """
+        从内存缓存中移除单个会话（不修改数据库）
+        :param user_id: 用户ID
+        :param session_id: 会话ID
+        """
+        with self._cache_lock:
+            self._drop(f"user_{user_id}_{session_id}")
+    
+    def evict_user(self, user_id: int) -> int:
+        """
+        从内存缓存中移除用户的全部会话（注销账号时调用，不修改数据库）
+        :param user_id: 用户ID
+        :return: 移除的会话数
+        """
+        with self._cache_lock:
+            keys = self._user_keys.pop(user_id, set())
+            for session_key in keys:
+                self.memory_cache.pop(session_key, None)
+                self._last_access.pop(session_key, None)
+        return len(keys)
+    
+    def evict_idle(self, max_idle_seconds: float = SESSION_CACHE_IDLE_SECONDS) -> int:
+        """
+        淘汰长时间未访问的会话（由缓存清理任务定期调用）
+        :param max_idle_seconds: 最长空闲时间（秒）
+        :return: 淘汰的会话数
+        """
+        cutoff = time.monotonic() - max_idle_seconds
+        evicted = 0
+        with self._cache_lock:
+            # 缓存按最近访问排序，从最久未访问的一端开始检查
+            while self.memory_cache:
+                session_key = next(iter(self.memory_cache))
+                if self._last_access.get(session_key, 0) > cutoff:
+                    break
+                self._drop(session_key)
+                evicted += 1
+            size = len(self.memory_cache)
+        metrics.incr("session_cache.evicted", evicted)
+        metrics.set_gauge("session_cache.size", size)
+        return evicted
     
     def clear_memory_cache(self) -> None:
         """
         清除内存缓存（用于内存管理）
         """
-        self.memory_cache.clear()
+        with self._cache_lock:
+            self.memory_cache.clear()
+            self._last_access.clear()
+            self._user_keys.clear()
         logger.debug("清除会话内存缓存")
 
 # 全局会话管理器实例
@@ -0,0 +1,119 @@
+# File: dialogue/state_codec.py
+# 功能：会话状态编解码
+# 实现：带版本头的可插拔序列化格式（orjson / msgpack / json，可选 zlib 压缩），兼容读取旧版 JSON 文本
+
+import json
+import os
+import zlib
+from typing import Any, Dict, Optional, Union
+
+# orjson / msgpack 已在 requirements.txt 中声明；导入失败时仍可回退到标准库 json，
+# 但 msgpack 编码的数据只能在安装了 msgpack 的环境中读取
+try:
+    import orjson
+except ImportError:  # 未安装时回退到标准库 json
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # 未安装时编码回退到 JSON，读取 msgpack 数据会失败
+    msgpack = None
+
+# ==================== 格式定义 ====================
+# 头部：MAGIC(3字节) + 版本(1字节) + 序列化方式(1字节) + 压缩方式(1字节)
+MAGIC = b"EFS"
+FORMAT_VERSION = 1
+HEADER_SIZE = len(MAGIC) + 3
+
+SERIALIZER_JSON = 1  # JSON 文本（orjson 或标准库 json 编码，二者可互相解码）
+SERIALIZER_MSGPACK = 2
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+
+_SERIALIZER_NAMES = {"json": SERIALIZER_JSON, "orjson": SERIALIZER_JSON, "msgpack": SERIALIZER_MSGPACK}
+
+# 序列化方式：orjson / msgpack / json；默认优先使用已安装的 orjson
+DEFAULT_SERIALIZER = os.getenv("SESSION_STATE_CODEC", "orjson")
+# 编码结果超过该字节数时使用 zlib 压缩；0 表示不压缩
+COMPRESS_MIN_BYTES = int(os.getenv("SESSION_STATE_COMPRESS_MIN_BYTES", "8192"))
+
+
+class StateCodecError(ValueError):
+    """会话状态编解码异常"""
+    pass
+
+
+def _dumps_json(data: Dict[str, Any]) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _loads_json(payload: Union[bytes, str]) -> Dict[str, Any]:
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(payload)
+
+
+def encode(data: Dict[str, Any], serializer: Optional[str] = None,
+           compress_min_bytes: Optional[int] = None) -> bytes:
+    """
+    编码会话状态
+    :param data: StateTracker.to_dict() 的结果
+    :param serializer: 序列化方式（orjson/msgpack/json），默认取 SESSION_STATE_CODEC
+    :param compress_min_bytes: 压缩阈值，默认取 SESSION_STATE_COMPRESS_MIN_BYTES
+    :return: 带版本头的字节串
+    """
+    serializer_id = _SERIALIZER_NAMES.get((serializer or DEFAULT_SERIALIZER).lower())
+    if serializer_id is None:
+        raise StateCodecError(f"未知的会话状态序列化方式: {serializer}")
+    if serializer_id == SERIALIZER_MSGPACK and msgpack is None:
+        serializer_id = SERIALIZER_JSON  # 未安装 msgpack 时回退
+
+    if serializer_id == SERIALIZER_MSGPACK:
+        payload = msgpack.packb(data, use_bin_type=True)
+    else:
+        payload = _dumps_json(data)
+
+    threshold = COMPRESS_MIN_BYTES if compress_min_bytes is None else compress_min_bytes
+    compression = COMPRESSION_NONE
+    if threshold and len(payload) >= threshold:
+        payload = zlib.compress(payload, 1)
+        compression = COMPRESSION_ZLIB
+
+    return MAGIC + bytes((FORMAT_VERSION, serializer_id, compression)) + payload
+
+
+def decode(raw: Union[bytes, str, None]) -> Dict[str, Any]:
+    """
+    解码会话状态，兼容旧版 JSON 文本
+    :param raw: encode() 的结果，或旧版 json.dumps 的字符串
+    :return: 可传给 StateTracker.from_dict() 的字典
+    """
+    if not raw:
+        return {}
+    if isinstance(raw, str):
+        return _loads_json(raw)
+    if not raw.startswith(MAGIC):
+        return _loads_json(raw)  # 旧版 JSON 以字节形式读出
+    if len(raw) < HEADER_SIZE:
+        raise StateCodecError("会话状态数据头不完整")
+
+    version, serializer_id, compression = raw[len(MAGIC):HEADER_SIZE]
+    if version != FORMAT_VERSION:
+        raise StateCodecError(f"不支持的会话状态格式版本: {version}")
+
+    payload = raw[HEADER_SIZE:]
+    if compression == COMPRESSION_ZLIB:
+        payload = zlib.decompress(payload)
+    elif compression != COMPRESSION_NONE:
+        raise StateCodecError(f"未知的会话状态压缩方式: {compression}")
+
+    if serializer_id == SERIALIZER_JSON:
+        return _loads_json(payload)
+    if serializer_id == SERIALIZER_MSGPACK:
+        if msgpack is None:
+            raise StateCodecError("会话状态使用 msgpack 编码，但当前环境未安装 msgpack")
+        return msgpack.unpackb(payload, raw=False)
+    raise StateCodecError(f"未知的会话状态序列化方式: {serializer_id}")
@@ -4,7 +4,8 @@
 # 额外：提供按轮次的 stage 兜底推断（warmup/mid/wrap）
 
 from __future__ import annotations
-from typing import List, Tuple, Optional, Dict
+from typing import List, Tuple, Optional, Dict, Union
+from . import state_codec
 
 class StateTracker:
     """
@@ -22,6 +23,7 @@ class StateTracker:
         """
         self._max_history = max_history
         self.history: List[Tuple[str, str]] = []  # [(role, content)]
+        self.history_offset = 0  # 因超出上限被丢弃的消息条数（history[0] 的绝对序号）
 
     # ========== 基础 API ==========
 
@@ -36,6 +38,13 @@ class StateTracker:
         overflow = len(self.history) - self._max_history
         if overflow > 0:
             self.history = self.history[overflow:]
+            self.history_offset += overflow
+
+    def total_messages(self) -> int:
+        """
+        获取会话累计消息条数（包含因上限被丢弃的消息）
+        """
+        return self.history_offset + len(self.history)
 
     def get_round_count(self) -> int:
         """
@@ -124,6 +133,7 @@ class StateTracker:
             "rounds": self.get_round_count(),
             "stage_by_round": self.get_stage_by_round(),
             "history_len": len(self.history),
+            "history_offset": self.history_offset,
         }
     
     @classmethod
@@ -133,5 +143,20 @@ class StateTracker:
         """
         instance = cls()
         if 'history' in data:
-            instance.history = data['history']
-        return instance
\ No newline at end of file
+            # JSON / msgpack 往返后元组会变成列表，这里统一还原为 (role, content)
+            instance.history = [(item[0], item[1]) for item in data['history']]
+        instance.history_offset = data.get('history_offset', 0)
+        return instance
+
+    def to_bytes(self) -> bytes:
+        """
+        编码完整状态（带版本头，格式见 state_codec）
+        """
+        return state_codec.encode(self.to_dict())
+
+    @classmethod
+    def from_bytes(cls, raw: Union[bytes, str, None]) -> 'StateTracker':
+        """
+        从编码数据恢复实例，兼容旧版 JSON 文本
+        """
+        return cls.from_dict(state_codec.decode(raw))
\ No newline at end of file
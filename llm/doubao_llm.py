@@ -2,11 +2,14 @@
 
 import logging
 import os
+import time
 from typing import Any, Dict, List
 
 import requests
 from langchain_core.messages import BaseMessage
 
+from services.metrics import metrics
+
 
 logger = logging.getLogger(__name__)
 
@@ -27,7 +30,9 @@ class DoubaoLLM:
         self.timeout = float(os.getenv("DOUBAO_TIMEOUT", "30"))
 
     def _call(self, messages: List[BaseMessage]) -> str:
+        started = time.perf_counter()
         response = self._make_request(self._format_messages(messages))
+        self._record_usage(response, (time.perf_counter() - started) * 1000)
         try:
             content = response["choices"][0]["message"]["content"]
         except (KeyError, IndexError, TypeError) as exc:
@@ -36,6 +41,16 @@ class DoubaoLLM:
             raise ValueError("豆包 API 返回了空回复")
         return content
 
+    @staticmethod
+    def _record_usage(response: Dict[str, Any], elapsed_ms: float) -> None:
+        """记录调用次数、耗时与 token 用量，用于评估合并调用等优化的收益。"""
+        metrics.incr("llm.doubao.calls")
+        metrics.incr("llm.doubao.time_ms", round(elapsed_ms, 1))
+        usage = response.get("usage") if isinstance(response, dict) else None
+        if isinstance(usage, dict):
+            metrics.incr("llm.doubao.prompt_tokens", usage.get("prompt_tokens") or 0)
+            metrics.incr("llm.doubao.completion_tokens", usage.get("completion_tokens") or 0)
+
     @staticmethod
     def _format_messages(messages: List[BaseMessage]) -> List[Dict[str, str]]:
         roles = {"human": "user", "ai": "assistant", "system": "system"}
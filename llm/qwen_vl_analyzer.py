@@ -1,11 +1,12 @@
 # File: llm/qwen_vl_analyzer.py
 # 功能：qwen-vl-plus图片分析服务
-# 实现：使用qwen-vl-plus模型分析图片内容，生成文字描述
+# 实现：使用qwen-vl-plus模型分析图片内容，生成文字描述；多张图片可合并为一次请求批量分析，失败时逐张重试
 
 import os
+import re
 import json
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 from PIL import Image
 import io
 import base64
@@ -16,6 +17,15 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# 单次请求最多合并分析的图片数
+VL_BATCH_SIZE = int(os.getenv("VL_BATCH_SIZE", "4"))
+# 单张图片请求超时（秒）；批量请求每多一张图片增加 VL_BATCH_EXTRA_TIMEOUT 秒
+VL_TIMEOUT_SECONDS = 30
+VL_BATCH_EXTRA_TIMEOUT = 10
+# 输出 token 上限：单张图片 / 批量时每张图片
+VL_MAX_TOKENS = 2000
+VL_BATCH_TOKENS_PER_IMAGE = 600
+
 class QwenVLAnalyzer:
     """
     qwen-vl-plus图片分析器
@@ -64,6 +74,46 @@ class QwenVLAnalyzer:
                 "error": str(e)
             }
     
+    def analyze_images(self, images: List[bytes], user_message: str = "") -> List[Dict[str, Any]]:
+        """
+        批量分析多张图片：每 VL_BATCH_SIZE 张合并为一次请求，模型按顺序返回每张图片的分析结果
+        :param images: 图片数据列表（字节）
+        :param user_message: 用户消息（可选）
+        :return: 与 images 一一对应的分析结果列表（格式同 analyze_image）
+        说明：整批请求失败或返回无法解析时，对该批图片逐张调用 analyze_image；
+             批量结果中个别图片缺失或格式错误时，只对这些图片单独重试
+        """
+        from services.metrics import metrics
+        
+        results: List[Dict[str, Any]] = []
+        for start in range(0, len(images), VL_BATCH_SIZE):
+            batch = images[start:start + VL_BATCH_SIZE]
+            if len(batch) == 1:
+                results.append(self.analyze_image(batch[0], user_message))
+                continue
+            
+            parsed: List[Optional[Dict[str, Any]]] = [None] * len(batch)
+            try:
+                api_result = self._call_qwen_vl_api_batch(
+                    [base64.b64encode(image_data).decode('utf-8') for image_data in batch],
+                    self._build_batch_prompt(len(batch), user_message)
+                )
+                parsed = self._parse_batch_result(api_result, len(batch))
+                metrics.incr("vl_batch.requests")
+                metrics.incr("vl_batch.images", len(batch))
+            except Exception as e:
+                logger.warning(f"⚠️ 批量图片分析失败，改为逐张分析: {e}")
+                metrics.incr("vl_batch.failed")
+            
+            for image_data, result in zip(batch, parsed):
+                if result is None:
+                    metrics.incr("vl_batch.fallback_images")
+                    result = self.analyze_image(image_data, user_message)
+                results.append(result)
+        
+        logger.info(f"✅ 批量图片分析完成: {len(images)} 张")
+        return results
+    
     def _build_analysis_prompt(self, user_message: str = "") -> str:
         """
         构造图片分析提示词
@@ -85,6 +135,37 @@ class QwenVLAnalyzer:
     "scene": "场景类型",
     "mood": "整体氛围"
 }
+"""
+        
+        if user_message:
+            base_prompt += f"\n\n用户说：{user_message}\n请结合用户的描述来分析图片。"
+        
+        return base_prompt
+    
+    def _build_batch_prompt(self, count: int, user_message: str = "") -> str:
+        """
+        构造批量图片分析提示词：要求按图片顺序返回 JSON 数组
+        """
+        base_prompt = f"""
+以上共有 {count} 张图片，请按顺序分别分析每一张图片，每张图片提供以下信息：
+
+1. 图片内容描述（详细描述，包含：主体对象、背景环境、光线条件、色彩搭配等，150字左右）
+2. 主要情绪（开心、悲伤、愤怒、焦虑、平静、兴奋等）
+3. 主要对象（人物、物品、场景等）
+4. 场景类型（室内、室外、自然、城市等）
+5. 整体氛围（温馨、紧张、轻松、严肃等）
+
+请只返回一个包含 {count} 个元素的JSON数组，index 为图片序号（从1开始），顺序与图片顺序一致：
+[
+    {{
+        "index": 1,
+        "summary": "图片内容描述",
+        "emotion": "主要情绪",
+        "objects": ["对象1", "对象2"],
+        "scene": "场景类型",
+        "mood": "整体氛围"
+    }}
+]
 """
         
         if user_message:
@@ -97,7 +178,32 @@ class QwenVLAnalyzer:
         调用qwen-vl-plus API
         根据阿里云百炼API文档：https://bailian.console.aliyun.com/
         """
+        return self._post_messages([
+            {
+                "type": "image",
+                "image": f"data:image/jpeg;base64,{image_base64}"
+            },
+            {
+                "type": "text",
+                "text": prompt
+            }
+        ], timeout=VL_TIMEOUT_SECONDS, max_tokens=VL_MAX_TOKENS)
+    
+    def _call_qwen_vl_api_batch(self, images_base64: List[str], prompt: str) -> Dict[str, Any]:
+        """
+        在一次请求中发送多张图片（按顺序排列在提示词之前）
+        """
+        content = [{"type": "image", "image": f"data:image/jpeg;base64,{image_base64}"} for image_base64 in images_base64]
+        content.append({"type": "text", "text": prompt})
+        return self._post_messages(content, timeout=VL_TIMEOUT_SECONDS + VL_BATCH_EXTRA_TIMEOUT * (len(images_base64) - 1),
+                                   max_tokens=max(VL_MAX_TOKENS, VL_BATCH_TOKENS_PER_IMAGE * len(images_base64)))
+    
+    def _post_messages(self, content: List[Dict[str, Any]], timeout: float, max_tokens: int) -> Dict[str, Any]:
+        """
+        发送单轮多模态消息
+        """
         import requests
+        from services.metrics import metrics
         
         headers = {
             "Authorization": f"Bearer {self.api_key}",
@@ -111,33 +217,24 @@ class QwenVLAnalyzer:
                 "messages": [
                     {
                         "role": "user",
-                        "content": [
-                            {
-                                "type": "image",
-                                "image": f"data:image/jpeg;base64,{image_base64}"
-                            },
-                            {
-                                "type": "text",
-                                "text": prompt
-                            }
-                        ]
+                        "content": content
                     }
                 ]
             },
             "parameters": {
                 "temperature": 0.7,
-                "max_tokens": 2000
+                "max_tokens": max_tokens
             }
         }
         
-        logger.info(f"🔍 调用qwen-vl-plus API: {self.model_name}")
-        logger.debug(f"请求数据: {json.dumps(data, ensure_ascii=False, indent=2)}")
+        logger.info(f"🔍 调用qwen-vl-plus API: {self.model_name}, 图片 {len(content) - 1} 张")
+        metrics.incr("llm.qwen_vl.calls")
         
         response = requests.post(
-            "https://dashscope.aliyuncs.com/api/v1/services/aigc/multimodal-generation/generation",
+            self.base_url,
             headers=headers,
             json=data,
-            timeout=30
+            timeout=timeout
         )
         
         logger.info(f"API响应状态: {response.status_code}")
@@ -155,42 +252,14 @@ class QwenVLAnalyzer:
         解析API返回结果
         """
         try:
-            # 提取文本内容
-            content = ""
-            if "output" in api_result and "choices" in api_result["output"]:
-                choices = api_result["output"]["choices"]
-                if choices and len(choices) > 0:
-                    message_content = choices[0].get("message", {}).get("content", "")
-                    # 处理content可能是字符串或列表的情况
-                    if isinstance(message_content, list):
-                        # 如果是列表，提取文本部分
-                        content = " ".join([item.get("text", "") for item in message_content if isinstance(item, dict) and "text" in item])
-                    else:
-                        content = str(message_content)
-            
+            content = self._extract_content(api_result)
             logger.info(f"提取到的内容: {content}")
-            
-            # 清理内容，移除markdown代码块标记
-            cleaned_content = content.strip()
-            if cleaned_content.startswith("```json"):
-                cleaned_content = cleaned_content[7:]  # 移除 ```json
-            if cleaned_content.startswith("```"):
-                cleaned_content = cleaned_content[3:]  # 移除 ```
-            if cleaned_content.endswith("```"):
-                cleaned_content = cleaned_content[:-3]  # 移除结尾的 ```
-            cleaned_content = cleaned_content.strip()
+            cleaned_content = self._strip_code_fence(content)
             
             # 尝试解析JSON
             try:
                 parsed = json.loads(cleaned_content)
-                return {
-                    "summary": parsed.get("summary", "无法识别图片内容"),
-                    "emotion": parsed.get("emotion", "未知"),
-                    "objects": parsed.get("objects", []),
-                    "scene": parsed.get("scene", "未知"),
-                    "mood": parsed.get("mood", "未知"),
-                    "raw_content": content
-                }
+                return self._normalize_result(parsed, content)
             except json.JSONDecodeError:
                 # 如果不是JSON格式，直接使用原始内容
                 return {
@@ -213,5 +282,73 @@ class QwenVLAnalyzer:
                 "error": str(e)
             }
 
+    @staticmethod
+    def _extract_content(api_result: Dict[str, Any]) -> str:
+        """
+        提取API返回的文本内容
+        """
+        content = ""
+        if "output" in api_result and "choices" in api_result["output"]:
+            choices = api_result["output"]["choices"]
+            if choices and len(choices) > 0:
+                message_content = choices[0].get("message", {}).get("content", "")
+                # 处理content可能是字符串或列表的情况
+                if isinstance(message_content, list):
+                    # 如果是列表，提取文本部分
+                    content = " ".join([item.get("text", "") for item in message_content if isinstance(item, dict) and "text" in item])
+                else:
+                    content = str(message_content)
+        return content
+    
+    @staticmethod
+    def _strip_code_fence(content: str) -> str:
+        """
+        清理内容，移除markdown代码块标记
+        """
+        cleaned_content = content.strip()
+        if cleaned_content.startswith("```json"):
+            cleaned_content = cleaned_content[7:]  # 移除 ```json
+        if cleaned_content.startswith("```"):
+            cleaned_content = cleaned_content[3:]  # 移除 ```
+        if cleaned_content.endswith("```"):
+            cleaned_content = cleaned_content[:-3]  # 移除结尾的 ```
+        return cleaned_content.strip()
+    
+    @staticmethod
+    def _normalize_result(parsed: Dict[str, Any], raw_content: str) -> Dict[str, Any]:
+        return {
+            "summary": parsed.get("summary", "无法识别图片内容"),
+            "emotion": parsed.get("emotion", "未知"),
+            "objects": parsed.get("objects", []),
+            "scene": parsed.get("scene", "未知"),
+            "mood": parsed.get("mood", "未知"),
+            "raw_content": raw_content
+        }
+    
+    def _parse_batch_result(self, api_result: Dict[str, Any], count: int) -> List[Optional[Dict[str, Any]]]:
+        """
+        解析批量分析结果
+        :return: 长度为 count 的列表，无法对应到图片或缺少描述的位置为 None（由调用方单独重试）
+        :raises ValueError: 返回内容中没有JSON数组
+        """
+        content = self._extract_content(api_result)
+        match = re.search(r"\[.*\]", self._strip_code_fence(content), re.S)
+        if not match:
+            raise ValueError(f"批量分析结果不是JSON数组: {content[:200]}")
+        items = json.loads(match.group(0))
+        if not isinstance(items, list):
+            raise ValueError("批量分析结果不是JSON数组")
+        
+        results: List[Optional[Dict[str, Any]]] = [None] * count
+        for position, item in enumerate(items):
+            if not isinstance(item, dict):
+                continue
+            # 优先按模型返回的序号对应，没有序号时按数组顺序
+            index = item.get("index")
+            index = index - 1 if isinstance(index, int) else position
+            if 0 <= index < count and results[index] is None and str(item.get("summary") or "").strip():
+                results[index] = self._normalize_result(item, json.dumps(item, ensure_ascii=False))
+        return results
+
 # 全局分析器实例
 qwen_vl_analyzer = QwenVLAnalyzer()
@@ -6,25 +6,42 @@ import os
 import logging
 import requests
 import json
-from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from jose import jwt, jwk
 from jose.utils import base64url_decode
-from datetime import datetime, timedelta, timezone
+from datetime import date, datetime, timedelta, timezone
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 
 # —— 新编排：分析→（可选检索）→生成
 from prompts.prompt_flow_controller import chat_once
 from prompts.chat_analysis import analyze_turn
 from dialogue.state_tracker import StateTracker
 from dialogue.session_manager import session_manager
+from dialogue.session_archive import session_archiver
 from services.image_service import image_service
+from services.journal_service import journal_service, InvalidCursorError
+from services.journal_generation_service import journal_generation_service
+from services.journal_search_service import journal_search_service
+from services.journal_stats_service import journal_stats_service
+from services.export_service import export_service
+from services.etag_service import etag_service
+from services.sync_service import sync_service, InvalidSyncTokenError, SYNC_DEFAULT_LIMIT, SYNC_MAX_LIMIT
 from services.voice_service import voice_service
-from database_models import init_db, SessionLocal, User, Journal, ChatSession, Image
+from services.metrics import metrics
+from services.prefetch_service import prefetch_service
+from services.user_cache import user_cache
+from services.query_profiler import query_profiler
+from services.heart_service import consume_heart, effective_heart, heart_today, set_heart
+from database_models import init_db, SessionLocal, AsyncSessionLocal, get_db, write_session, User, Journal, ChatSession, ChatMessage, ChatSessionArchive, Image, JournalImage
+from database_models.database import engine, async_engine
 from database_models.schemas import UpdateProfileRequest, SubscriptionVerifyRequest, SubscriptionStatusResponse, AppleWebhookNotification, TestLoginRequest, QALoginRequest, QAMemoryWriteRequest, DeleteAccountRequest, DeleteAccountResponse
 from subscription.apple_subscription import (
     verify_receipt_with_apple, parse_subscription_info, update_user_subscription, 
@@ -75,6 +92,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ==================== 数据库查询统计 ====================
+query_profiler.install(engine, async_engine.sync_engine)
+
+@app.middleware("http")
+async def profile_db_queries(request: Request, call_next):
+    """
+    统计每个请求的查询次数与数据库耗时，通过 Server-Timing 响应头返回，并检查疑似 N+1 查询
+    """
+    stats, token = query_profiler.start_request()
+    try:
+        response = await call_next(request)
+    finally:
+        query_profiler.finish_request(stats, token, f"{request.method} {request.url.path}")
+    response.headers.append("Server-Timing", stats.server_timing())
+    return response
+
 # ==================== 全局状态 & 定时任务 ====================
 session_states: Dict[str, StateTracker] = {}
 scheduler = BackgroundScheduler()
@@ -82,6 +115,7 @@ scheduler = BackgroundScheduler()
 @app.on_event("startup")
 def on_startup():
     init_db()
+    image_service.purge_trash()
     global apple_keys
     apple_keys = requests.get(APPLE_PUBLIC_KEYS_URL).json()["keys"]
 
@@ -93,56 +127,10 @@ def on_startup():
         logging.warning(f"⚠️ Embedding模型初始化失败: {e}")
         logging.warning("⚠️ 检索功能可能不可用（不影响聊天主流程）")
 
-    start_heart_reset_scheduler()
     start_cache_cleanup_scheduler()
     start_image_cleanup_scheduler()
-
-def reset_all_users_heart():
-    try:
-        logging.info("🕛 开始执行：重置所有用户heart值")
-        db: Session = SessionLocal()
-        try:
-            # 获取所有用户
-            users = db.query(User).all()
-            total = len(users)
-            
-            inactive_count = 0
-            active_count = 0
-            
-            for user in users:
-                if is_qa_test_user(user):
-                    continue
-                if user.subscription_status == "active":
-                    user.heart = 100
-                    active_count += 1
-                else:
-                    user.heart = 10
-                    inactive_count += 1
-            
-            db.commit()
-            logging.info(f"✅ 已重置 {total} 个用户: {active_count}个会员重置为100, {inactive_count}个普通用户重置为10")
-        except Exception as e:
-            db.rollback()
-            logging.error(f"❌ 定时任务失败：{e}")
-            raise
-        finally:
-            db.close()
-    except Exception as e:
-        logging.error(f"❌ 定时任务异常：{e}")
-
-def start_heart_reset_scheduler():
-    try:
-        scheduler.add_job(
-            func=reset_all_users_heart,
-            trigger=CronTrigger(hour=0, minute=0),
-            id="heart_reset_job",
-            name="每日重置用户heart值",
-            replace_existing=True,
-        )
-        scheduler.start()
-        logging.info("✅ Heart重置任务已启动：每天00:00执行")
-    except Exception as e:
-        logging.error(f"❌ 启动定时任务失败：{e}")
+    start_session_compaction_scheduler()
+    start_sync_tombstone_scheduler()
 
 def clear_search_cache():
     """清空搜索缓存目录"""
@@ -165,6 +153,19 @@ def clear_search_cache():
     except Exception as e:
         logging.error(f"❌ 缓存清理失败：{e}")
 
+def cleanup_memory_caches():
+    """淘汰长时间未访问的会话缓存，清理过期的预热记录、用户资料与记忆点缓存"""
+    try:
+        evicted = session_manager.evict_idle()
+        pruned = prefetch_service.prune_expired()
+        profiles = user_cache.prune_expired()
+        from memory import prune_expired_memories
+        memories = prune_expired_memories()
+        logging.info(f"🧹 内存缓存清理完成：淘汰会话 {evicted} 个，清理预热记录 {pruned} 条，"
+                     f"用户资料 {profiles} 条，记忆点 {memories} 条")
+    except Exception as e:
+        logging.error(f"❌ 内存缓存清理失败：{e}")
+
 def start_cache_cleanup_scheduler():
     """启动缓存清理定时任务"""
     try:
@@ -175,7 +176,16 @@ def start_cache_cleanup_scheduler():
             name="每日清理搜索缓存",
             replace_existing=True,
         )
-        logging.info("✅ 缓存清理任务已启动：每天00:00执行")
+        scheduler.add_job(
+            func=cleanup_memory_caches,
+            trigger=IntervalTrigger(minutes=10),
+            id="memory_cache_cleanup_job",
+            name="定期清理内存缓存",
+            replace_existing=True,
+        )
+        if not scheduler.running:
+            scheduler.start()
+        logging.info("✅ 缓存清理任务已启动：搜索缓存每天00:00清理，内存缓存每10分钟清理")
     except Exception as e:
         logging.error(f"❌ 启动缓存清理任务失败：{e}")
 
@@ -187,27 +197,14 @@ def cleanup_unreferenced_images():
         # 获取被日记引用的图片文件名
         db: Session = SessionLocal()
         try:
-            # 查询所有日记中的图片ID
-            journals = db.query(Journal).filter(Journal.images.isnot(None)).all()
-            
-            referenced_image_ids = set()
-            for journal in journals:
-                if journal.images:
-                    # 解析逗号分隔的图片ID
-                    image_ids = journal.images.split(",")
-                    for image_id in image_ids:
-                        try:
-                            referenced_image_ids.add(int(image_id.strip()))
-                        except ValueError:
-                            logging.warning(f"⚠️ 无效的图片ID: {image_id}")
-            
-            # 根据图片ID查询文件名
-            if referenced_image_ids:
-                images = db.query(Image.filename).filter(Image.id.in_(referenced_image_ids)).all()
-                referenced_filenames = {img.filename for img in images}
+            # 通过日记图片关联表查询被引用的图片文件名
+            images = db.query(Image.filename).join(
+                JournalImage, JournalImage.image_id == Image.id
+            ).distinct().all()
+            referenced_filenames = {img.filename for img in images}
+            if referenced_filenames:
                 logging.info(f"📊 找到 {len(referenced_filenames)} 个被引用的图片文件名")
             else:
-                referenced_filenames = set()
                 logging.info("📊 没有图片被日记引用")
             
         finally:
@@ -296,17 +293,87 @@ def start_image_cleanup_scheduler():
     except Exception as e:
         logging.error(f"❌ 启动图片清理任务失败：{e}")
 
+def compact_cold_sessions():
+    """压缩归档冷会话（跳过内存缓存中仍在使用的会话）"""
+    try:
+        logging.info("🕛 开始执行：冷会话压缩归档")
+        result = session_archiver.compact_cold_sessions(skip_keys=session_manager.cached_session_keys())
+        logging.info(f"✅ 冷会话压缩归档完成: {result}")
+    except Exception as e:
+        logging.error(f"❌ 冷会话压缩归档任务异常：{e}")
+
+def start_session_compaction_scheduler():
+    """启动冷会话压缩归档定时任务"""
+    try:
+        scheduler.add_job(
+            func=compact_cold_sessions,
+            trigger=CronTrigger(hour=4, minute=0),
+            id="session_compaction_job",
+            name="每日压缩归档冷会话",
+            replace_existing=True,
+        )
+        if not scheduler.running:
+            scheduler.start()
+        logging.info("✅ 冷会话压缩归档任务已启动：每天04:00执行")
+    except Exception as e:
+        logging.error(f"❌ 启动冷会话压缩归档任务失败：{e}")
+
+def prune_sync_tombstones():
+    """清理超过保留期的增量同步墓碑"""
+    try:
+        deleted = sync_service.prune_tombstones()
+        logging.info(f"✅ 增量同步墓碑清理完成: 删除 {deleted} 条")
+    except Exception as e:
+        logging.error(f"❌ 增量同步墓碑清理任务异常：{e}")
+
+def start_sync_tombstone_scheduler():
+    """启动增量同步墓碑清理定时任务"""
+    try:
+        scheduler.add_job(
+            func=prune_sync_tombstones,
+            trigger=CronTrigger(hour=4, minute=30),
+            id="sync_tombstone_job",
+            name="每日清理增量同步墓碑",
+            replace_existing=True,
+        )
+        if not scheduler.running:
+            scheduler.start()
+        logging.info("✅ 增量同步墓碑清理任务已启动：每天04:30执行")
+    except Exception as e:
+        logging.error(f"❌ 启动增量同步墓碑清理任务失败：{e}")
+
 @app.on_event("shutdown")
 def on_shutdown():
+    prefetch_service.shutdown()
+    image_service.shutdown()
+    journal_generation_service.shutdown()
     if scheduler.running:
         scheduler.shutdown()
         logging.info("✅ 定时任务调度器已关闭")
 
+@app.on_event("shutdown")
+async def dispose_async_engine():
+    from database_models.database import async_engine
+    await async_engine.dispose()
+
 # ==================== 健康检查 ====================
 @app.get("/")
 def read_root():
     return {"message": "EmoFlow 服务运行中"}
 
+# ==================== 运行指标 ====================
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+@app.get("/metrics")
+def get_metrics(x_metrics_token: Optional[str] = Header(None)) -> Dict[str, Any]:
+    """
+    导出进程内运行指标
+    配置了 METRICS_TOKEN 时需通过 X-Metrics-Token 请求头访问
+    """
+    if METRICS_TOKEN and x_metrics_token != METRICS_TOKEN:
+        raise HTTPException(status_code=403, detail="无权限访问运行指标")
+    return {"status": "success", "metrics": metrics.snapshot()}
+
 # ==================== Apple 登录 ====================
 class AppleLoginRequest(BaseModel):
     identity_token: str
@@ -314,7 +381,7 @@ class AppleLoginRequest(BaseModel):
     email: Optional[str] = None
 
 @app.post("/auth/apple")
-def login_with_apple(req: AppleLoginRequest):
+def login_with_apple(req: AppleLoginRequest, db: Session = Depends(get_db)):
     try:
         logging.info(f"🔍 Apple 登录: token_len={len(req.identity_token)}, name='{req.full_name}', email='{req.email}'")
         import base64
@@ -348,7 +415,6 @@ def login_with_apple(req: AppleLoginRequest):
         email = req.email or decoded.get("email")
         name = req.full_name
 
-        db: Session = SessionLocal()
         user = db.query(User).filter(User.apple_user_id == apple_user_id).first()
         if not user:
             user = User(apple_user_id=apple_user_id, email=email, name=name)
@@ -361,11 +427,14 @@ def login_with_apple(req: AppleLoginRequest):
                 user.name = req.full_name; updated = True
             if updated:
                 db.commit(); db.refresh(user)
+                user_cache.invalidate(user.id)
 
         token_data = {"sub": str(user.id), "apple_user_id": user.apple_user_id,
                       "exp": datetime.utcnow() + timedelta(minutes=JWT_EXPIRE_MINUTES)}
         token = jwt.encode(token_data, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
 
+        # 登录后后台预热最近会话，首轮对话直接命中缓存
+        prefetch_service.schedule(user.id)
         return {"status": "ok", "token": token, "user_id": user.id, "email": user.email, "name": user.name}
     except Exception as e:
         logging.error(f"❌ Apple 登录失败: {e}")
@@ -373,7 +442,7 @@ def login_with_apple(req: AppleLoginRequest):
 
 # ==================== 测试登录 ====================
 @app.post("/auth/test")
-def test_login(request: TestLoginRequest):
+def test_login(request: TestLoginRequest, db: Session = Depends(get_db)):
     """
     测试登录接口
     专门为Apple测试人员提供的测试账号登录
@@ -387,61 +456,59 @@ def test_login(request: TestLoginRequest):
             raise HTTPException(status_code=401, detail="无效的测试账号")
         
         # 查找或创建测试用户
-        db: Session = SessionLocal()
-        try:
-            user = db.query(User).filter(User.email == "review@test.com").first()
-            
-            if not user:
-                # 创建测试用户
-                user = User(
-                    name="Apple Reviewer",
-                    email="review@test.com",
-                    heart=100,  # 给测试用户充足的心数
-                    subscription_status="inactive",  # 普通会员，无订阅状态
-                    subscription_product_id=None,
-                    subscription_expires_at=None,
-                    auto_renew_status=False,
-                    subscription_environment="sandbox"
-                )
-                db.add(user)
-                db.commit()
-                db.refresh(user)
-                logging.info(f"✅ 创建测试用户: user_id={user.id}")
-            else:
-                # 更新现有测试用户为普通会员状态
-                user.subscription_status = "inactive"
-                user.subscription_product_id = None
-                user.subscription_expires_at = None
-                user.auto_renew_status = False
-                user.heart = 100  # 确保有足够的心数
-                db.commit()
-                db.refresh(user)
-                logging.info(f"✅ 更新测试用户为普通会员: user_id={user.id}")
-            
-            # 生成JWT令牌
-            expire = datetime.utcnow() + timedelta(minutes=JWT_EXPIRE_MINUTES)
-            to_encode = {"sub": str(user.id), "exp": expire}
-            jwt_token = jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
-            
-            logging.info(f"✅ 测试登录成功: user_id={user.id}")
-            
-            return {
-                "status": "success",
-                "message": "测试登录成功",
-                "jwt": jwt_token,
-                "user": {
-                    "id": user.id,
-                    "name": user.name,
-                    "email": user.email,
-                    "heart": user.heart,
-                    "subscription_status": user.subscription_status,
-                    "subscription_expires_at": user.subscription_expires_at.isoformat() if user.subscription_expires_at else None,
-                    "is_member": user.subscription_status == "active"
-                }
+        user = db.query(User).filter(User.email == "review@test.com").first()
+        
+        if not user:
+            # 创建测试用户
+            user = User(
+                name="Apple Reviewer",
+                email="review@test.com",
+                heart=100,  # 给测试用户充足的心数
+                heart_reset_date=heart_today(),
+                subscription_status="inactive",  # 普通会员，无订阅状态
+                subscription_product_id=None,
+                subscription_expires_at=None,
+                auto_renew_status=False,
+                subscription_environment="sandbox"
+            )
+            db.add(user)
+            db.commit()
+            db.refresh(user)
+            logging.info(f"✅ 创建测试用户: user_id={user.id}")
+        else:
+            # 更新现有测试用户为普通会员状态
+            user.subscription_status = "inactive"
+            user.subscription_product_id = None
+            user.subscription_expires_at = None
+            user.auto_renew_status = False
+            set_heart(user, 100)  # 确保有足够的心数
+            db.commit()
+            db.refresh(user)
+            user_cache.invalidate(user.id)
+            logging.info(f"✅ 更新测试用户为普通会员: user_id={user.id}")
+        
+        # 生成JWT令牌
+        expire = datetime.utcnow() + timedelta(minutes=JWT_EXPIRE_MINUTES)
+        to_encode = {"sub": str(user.id), "exp": expire}
+        jwt_token = jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
+        
+        logging.info(f"✅ 测试登录成功: user_id={user.id}")
+        prefetch_service.schedule(user.id)
+        
+        return {
+            "status": "success",
+            "message": "测试登录成功",
+            "jwt": jwt_token,
+            "user": {
+                "id": user.id,
+                "name": user.name,
+                "email": user.email,
+                "heart": effective_heart(user.heart, user.subscription_status, user.heart_reset_date, user.email),
+                "subscription_status": user.subscription_status,
+                "subscription_expires_at": user.subscription_expires_at.isoformat() if user.subscription_expires_at else None,
+                "is_member": user.subscription_status == "active"
             }
-            
-        finally:
-            db.close()
+        }
             
     except HTTPException:
         raise
@@ -449,25 +516,18 @@ def test_login(request: TestLoginRequest):
         logging.error(f"❌ 测试登录异常: {e}")
         raise HTTPException(status_code=500, detail="测试登录失败，请稍后再试")
 
-def get_current_user(token: str = Header(...)) -> int:
+async def get_current_user(token: str = Header(...)) -> int:
     try:
         payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
         return int(payload["sub"])
     except Exception:
         raise HTTPException(status_code=401, detail="无效或过期的 Token")
 
-def is_qa_test_user(user: User) -> bool:
-    return user.email == QA_TEST_EMAIL
-
 def get_qa_test_user(user_id: int = Depends(get_current_user)) -> int:
-    db: Session = SessionLocal()
-    try:
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user or not is_qa_test_user(user):
-            raise HTTPException(status_code=403, detail="仅 QA 测试账号可访问此接口")
-        return user_id
-    finally:
-        db.close()
+    profile = user_cache.get(user_id)
+    if not profile or profile["email"] != QA_TEST_EMAIL:
+        raise HTTPException(status_code=403, detail="仅 QA 测试账号可访问此接口")
+    return user_id
 
 def _issue_jwt_for_user(user_id: int) -> str:
     expire = datetime.utcnow() + timedelta(minutes=JWT_EXPIRE_MINUTES)
@@ -491,6 +551,7 @@ def _get_or_create_qa_test_user(db: Session) -> User:
     user.heart = 999999
     db.commit()
     db.refresh(user)
+    user_cache.invalidate(user.id)
     logging.info(f"✅ 更新 QA 测试用户: user_id={user.id}")
     return user
 
@@ -500,6 +561,9 @@ def _clear_qa_user_memories(db: Session, user_id: int) -> int:
         Journal.content == QA_TEST_MEMORY_MARKER,
     ).delete(synchronize_session=False)
     db.commit()
+    from memory import invalidate_user_memories
+    invalidate_user_memories(user_id)
+    journal_service.invalidate_count(user_id)
     return deleted
 
 def _write_qa_user_memories(db: Session, user_id: int, memories: List[str]) -> int:
@@ -516,6 +580,9 @@ def _write_qa_user_memories(db: Session, user_id: int, memories: List[str]) -> i
         ))
         created += 1
     db.commit()
+    from memory import invalidate_user_memories
+    invalidate_user_memories(user_id)
+    journal_service.invalidate_count(user_id)
     return created
 
 def _clear_qa_user_sessions(db: Session, user_id: int) -> int:
@@ -525,37 +592,32 @@ def _clear_qa_user_sessions(db: Session, user_id: int) -> int:
     ).all()
     for session in sessions:
         session.is_active = False
-        session_key = f"user_{user_id}_{session.session_id}"
-        if session_key in session_manager.memory_cache:
-            del session_manager.memory_cache[session_key]
+        session_manager.evict_session(user_id, session.session_id)
     db.commit()
     return len(sessions)
 
 # ==================== QA 对话质量测试 ====================
 @app.post("/auth/qa")
-def qa_test_login(request: QALoginRequest):
+def qa_test_login(request: QALoginRequest, db: Session = Depends(get_db)):
     """对话质量测试专用登录，返回无限聊天额度的测试账号 JWT"""
     if request.username != QA_TEST_EMAIL or request.password != QA_TEST_PASSWORD:
         raise HTTPException(status_code=401, detail="无效的 QA 测试账号")
 
-    db: Session = SessionLocal()
-    try:
-        user = _get_or_create_qa_test_user(db)
-        jwt_token = _issue_jwt_for_user(user.id)
-        return {
-            "status": "success",
-            "message": "QA 测试登录成功",
-            "jwt": jwt_token,
-            "user": {
-                "id": user.id,
-                "name": user.name,
-                "email": user.email,
-                "heart": user.heart,
-                "unlimited_chat": True,
-            },
-        }
-    finally:
-        db.close()
+    user = _get_or_create_qa_test_user(db)
+    jwt_token = _issue_jwt_for_user(user.id)
+    prefetch_service.schedule(user.id)
+    return {
+        "status": "success",
+        "message": "QA 测试登录成功",
+        "jwt": jwt_token,
+        "user": {
+            "id": user.id,
+            "name": user.name,
+            "email": user.email,
+            "heart": user.heart,
+            "unlimited_chat": True,
+        },
+    }
 
 @app.get("/test/memory")
 def get_qa_test_memories(user_id: int = Depends(get_qa_test_user)) -> Dict[str, Any]:
@@ -566,52 +628,40 @@ def get_qa_test_memories(user_id: int = Depends(get_qa_test_user)) -> Dict[str,
 @app.put("/test/memory")
 def write_qa_test_memories(
     request: QAMemoryWriteRequest,
+    db: Session = Depends(get_db),
     user_id: int = Depends(get_qa_test_user),
 ) -> Dict[str, Any]:
     if not request.memories:
         raise HTTPException(status_code=400, detail="memories 不能为空")
 
-    db: Session = SessionLocal()
-    try:
-        cleared = 0
-        if request.replace:
-            cleared = _clear_qa_user_memories(db, user_id)
-        created = _write_qa_user_memories(db, user_id, request.memories)
-        return {
-            "status": "success",
-            "cleared": cleared,
-            "created": created,
-            "memories": request.memories,
-        }
-    finally:
-        db.close()
+    cleared = 0
+    if request.replace:
+        cleared = _clear_qa_user_memories(db, user_id)
+    created = _write_qa_user_memories(db, user_id, request.memories)
+    return {
+        "status": "success",
+        "cleared": cleared,
+        "created": created,
+        "memories": request.memories,
+    }
 
 @app.delete("/test/memory")
-def clear_qa_test_memories(user_id: int = Depends(get_qa_test_user)) -> Dict[str, Any]:
-    db: Session = SessionLocal()
-    try:
-        deleted = _clear_qa_user_memories(db, user_id)
-        return {"status": "success", "deleted": deleted}
-    finally:
-        db.close()
+def clear_qa_test_memories(db: Session = Depends(get_db), user_id: int = Depends(get_qa_test_user)) -> Dict[str, Any]:
+    deleted = _clear_qa_user_memories(db, user_id)
+    return {"status": "success", "deleted": deleted}
 
 @app.delete("/test/sessions")
-def clear_qa_test_sessions(user_id: int = Depends(get_qa_test_user)) -> Dict[str, Any]:
-    db: Session = SessionLocal()
-    try:
-        cleared = _clear_qa_user_sessions(db, user_id)
-        return {"status": "success", "cleared": cleared}
-    finally:
-        db.close()
+def clear_qa_test_sessions(db: Session = Depends(get_db), user_id: int = Depends(get_qa_test_user)) -> Dict[str, Any]:
+    cleared = _clear_qa_user_sessions(db, user_id)
+    return {"status": "success", "cleared": cleared}
 
 # ==================== 用户资料 ====================
 # 使用database_models.schemas中的UpdateProfileRequest
 
 @app.put("/user/profile")
-def update_user_profile(request: UpdateProfileRequest, user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
+def update_user_profile(request: UpdateProfileRequest, db: Session = Depends(get_db), user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
     try:
         logging.info(f"🔧 更新资料: user_id={user_id}, name='{request.name}', email='{request.email}', birthday={request.birthday}")
-        db: Session = SessionLocal()
         user = db.query(User).filter(User.id == user_id).first()
         if not user:
             raise HTTPException(status_code=404, detail="用户不存在")
@@ -626,10 +676,11 @@ def update_user_profile(request: UpdateProfileRequest, user_id: int = Depends(ge
 
         if updated:
             db.commit(); db.refresh(user)
+            user_cache.invalidate(user_id)
 
         return {"status": "ok",
                 "message": "用户资料更新成功" if updated else "用户资料无变化",
-                "user": {"id": user.id, "name": user.name, "email": user.email, "heart": user.heart, "birthday": user.birthday, "subscription_status": user.subscription_status, "subscription_expires_at": user.subscription_expires_at}}
+                "user": {"id": user.id, "name": user.name, "email": user.email, "heart": effective_heart(user.heart, user.subscription_status, user.heart_reset_date, user.email), "birthday": user.birthday, "subscription_status": user.subscription_status, "subscription_expires_at": user.subscription_expires_at}}
     except HTTPException:
         raise
     except Exception as e:
@@ -637,14 +688,22 @@ def update_user_profile(request: UpdateProfileRequest, user_id: int = Depends(ge
         raise HTTPException(status_code=500, detail="用户资料更新失败")
 
 @app.get("/user/profile")
-def get_user_profile(user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
+async def get_user_profile(response: Response, user_id: int = Depends(get_current_user),
+                           if_none_match: Optional[str] = Header(None)):
     try:
-        db: Session = SessionLocal()
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
+        profile = await user_cache.get_async(user_id)
+        if not profile:
             raise HTTPException(status_code=404, detail="用户不存在")
-        return {"status": "ok",
-                "user": {"id": user.id, "name": user.name, "email": user.email, "heart": user.heart, "birthday": user.birthday, "subscription_status": user.subscription_status, "subscription_expires_at": user.subscription_expires_at}}
+        # 用户打开应用时会先拉取资料，借此后台预热最近会话
+        prefetch_service.schedule(user_id)
+        user = {key: profile[key] for key in ("id", "name", "email", "heart", "birthday", "subscription_status", "subscription_expires_at")}
+        # 资料来自缓存，直接以返回的字段（含当日实际可用心数）计算版本
+        etag = etag_service.make("profile", user)
+        not_modified = etag_service.check(if_none_match, etag, "profile")
+        if not_modified:
+            return not_modified
+        etag_service.tag(response, etag)
+        return {"status": "ok", "user": user}
     except HTTPException:
         raise
     except Exception as e:
@@ -656,17 +715,17 @@ class UpdateHeartRequest(BaseModel):
     heart: int
 
 @app.put("/user/heart")
-def update_user_heart(request: UpdateHeartRequest, user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
+def update_user_heart(request: UpdateHeartRequest, db: Session = Depends(get_db), user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
     try:
         logging.info(f"🔧 更新heart: user_id={user_id}, heart={request.heart}")
         if request.heart < 0:
             raise HTTPException(status_code=400, detail="心数值不能为负数")
-        db: Session = SessionLocal()
         user = db.query(User).filter(User.id == user_id).first()
         if not user:
             raise HTTPException(status_code=404, detail="用户不存在")
-        user.heart = request.heart
+        set_heart(user, request.heart)
         db.commit(); db.refresh(user)
+        user_cache.invalidate(user_id)
         return {"status": "ok", "message": "心数更新成功", "user": {"id": user.id, "heart": user.heart}}
     except HTTPException:
         raise
@@ -675,19 +734,68 @@ def update_user_heart(request: UpdateHeartRequest, user_id: int = Depends(get_cu
         raise HTTPException(status_code=500, detail="更新用户心数失败")
 
 @app.get("/user/heart")
-def get_user_heart(user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
+async def get_user_heart(user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
     try:
-        db: Session = SessionLocal()
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
+        profile = await user_cache.get_async(user_id)
+        if not profile:
             raise HTTPException(status_code=404, detail="用户不存在")
-        return {"status": "ok", "user": {"id": user.id, "heart": user.heart}}
+        return {"status": "ok", "user": {"id": profile["id"], "heart": profile["heart"]}}
     except HTTPException:
         raise
     except Exception as e:
         logging.error(f"❌ 获取用户心数失败: {e}")
         raise HTTPException(status_code=500, detail="获取用户心数失败")
 
+# ==================== 数据导出 ====================
+@app.get("/user/export")
+def export_user_data(request: Request, user_id: int = Depends(get_current_user)):
+    """
+    导出账户数据（zip：profile.json、journals/chat_sessions/chat_messages/images.ndjson 与图片原文件）
+    功能：边读数据库边输出，内存占用与账户大小无关；支持 Range（配合 If-Range）断点续传
+    """
+    export = None
+    try:
+        export = export_service.open(SessionLocal(), user_id)
+        total_size = export.total_size
+        headers = {
+            "Accept-Ranges": "bytes",
+            "ETag": export.etag,
+            "Content-Disposition": f'attachment; filename="emoflow_export_{user_id}.zip"',
+            "Cache-Control": "private, no-cache",
+        }
+
+        byte_range = None
+        if_range = request.headers.get("if-range")
+        if if_range is None or if_range == export.etag:
+            try:
+                byte_range = export_service.parse_range(request.headers.get("range"), total_size)
+            except ValueError:
+                export.close()
+                return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{total_size}"})
+
+        start, end = byte_range or (0, total_size - 1)
+        headers["Content-Length"] = str(end - start + 1)
+        if byte_range:
+            headers["Content-Range"] = f"bytes {start}-{end}/{total_size}"
+
+        def body():
+            try:
+                yield from export.iter_bytes(start, end)
+            except Exception as e:
+                logging.error(f"❌ 导出数据中断: user_id={user_id}, {e}")
+                raise
+            finally:
+                export.close()
+
+        logging.info(f"📦 导出数据: user_id={user_id}, 字节 {start}-{end}/{total_size}")
+        return StreamingResponse(body(), status_code=206 if byte_range else 200,
+                                 media_type="application/zip", headers=headers)
+    except Exception as e:
+        if export is not None:
+            export.close()
+        logging.error(f"❌ 导出数据失败: {e}")
+        raise HTTPException(status_code=500, detail="导出数据失败")
+
 @app.delete("/user/account")
 def delete_user_account(request: DeleteAccountRequest, user_id: int = Depends(get_current_user)) -> DeleteAccountResponse:
     """
@@ -701,80 +809,91 @@ def delete_user_account(request: DeleteAccountRequest, user_id: int = Depends(ge
         if not request.confirm_deletion:
             raise HTTPException(status_code=400, detail="必须确认删除操作")
         
-        db: Session = SessionLocal()
         try:
-            # 查找用户
-            user = db.query(User).filter(User.id == user_id).first()
-            if not user:
-                raise HTTPException(status_code=404, detail="用户不存在")
-            
-            # 统计要删除的数据
-            deleted_data = {
-                "journals": 0,
-                "chat_sessions": 0,
-                "images": 0,
-                "user_id": user_id
-            }
-            
-            # 删除用户的日记
-            journals = db.query(Journal).filter(Journal.user_id == user_id).all()
-            deleted_data["journals"] = len(journals)
-            for journal in journals:
-                db.delete(journal)
-            
-            # 删除用户的聊天会话
-            chat_sessions = db.query(ChatSession).filter(ChatSession.user_id == user_id).all()
-            deleted_data["chat_sessions"] = len(chat_sessions)
-            for session in chat_sessions:
-                db.delete(session)
-            
-            # 删除用户的图片记录
-            images = db.query(Image).filter(Image.user_id == user_id).all()
-            deleted_data["images"] = len(images)
-            for image in images:
-                db.delete(image)
-            
-            # 删除用户上传的图片文件
-            user_upload_dir = f"uploads/images/user_{user_id}"
-            if os.path.exists(user_upload_dir):
-                import shutil
-                shutil.rmtree(user_upload_dir)
-                logging.info(f"🗑️ 已删除用户图片目录: {user_upload_dir}")
-            
-            # 清理用户的内存会话缓存
-            from dialogue.session_manager import session_manager
-            user_session_keys = [key for key in session_manager.memory_cache.keys() if key.startswith(f"user_{user_id}_")]
-            for key in user_session_keys:
-                del session_manager.memory_cache[key]
-            logging.info(f"🗑️ 已清理用户内存会话缓存: {len(user_session_keys)}个会话")
-            
-            # 最后删除用户记录
-            db.delete(user)
-            
-            # 提交所有更改
-            db.commit()
-            
-            logging.info(f"✅ 账户删除成功: user_id={user_id}, 删除数据={deleted_data}")
-            
-            return DeleteAccountResponse(
-                success=True,
-                message="账户及其所有数据已成功删除",
-                deleted_data=deleted_data
-            )
-            
+            # 所有记录在一个写事务内按 user_id 批量删除，不把数据加载到 ORM
+            with write_session() as db:
+                if not db.query(User.id).filter(User.id == user_id).first():
+                    raise HTTPException(status_code=404, detail="用户不存在")
+                
+                # 删除用户日记的图片关联
+                db.query(JournalImage).filter(
+                    JournalImage.journal_id.in_(db.query(Journal.id).filter(Journal.user_id == user_id))
+                ).delete(synchronize_session=False)
+                
+                # 统计并删除要删除的数据（子表先于父表）
+                deleted_data = {
+                    "journals": db.query(Journal).filter(Journal.user_id == user_id).delete(synchronize_session=False),
+                    "chat_sessions": 0,
+                    "images": 0,
+                    "user_id": user_id
+                }
+                db.query(ChatMessage).filter(ChatMessage.user_id == user_id).delete(synchronize_session=False)
+                db.query(ChatSessionArchive).filter(ChatSessionArchive.user_id == user_id).delete(synchronize_session=False)
+                deleted_data["chat_sessions"] = db.query(ChatSession).filter(ChatSession.user_id == user_id).delete(synchronize_session=False)
+                deleted_data["images"] = db.query(Image).filter(Image.user_id == user_id).delete(synchronize_session=False)
+                # 触发器为上面删除的数据写入的墓碑一并清理
+                sync_service.forget_user(db, user_id)
+                
+                # 最后删除用户记录
+                db.query(User).filter(User.id == user_id).delete(synchronize_session=False)
+        except HTTPException:
+            raise
         except Exception as e:
-            db.rollback()
             logging.error(f"❌ 删除账户时数据库操作失败: {e}")
             raise HTTPException(status_code=500, detail="删除账户失败")
-        finally:
-            db.close()
-            
+        
+        # 删除用户上传的图片文件（目录先重命名移出，由后台线程递归删除）
+        try:
+            if image_service.remove_user_files(user_id):
+                logging.info(f"🗑️ 已提交后台删除用户图片目录: user_id={user_id}")
+        except Exception as e:
+            logging.warning(f"⚠️ 删除用户图片目录失败，留待图片清理任务处理: {e}")
+        
+        # 清理用户的内存缓存
+        evicted = session_manager.evict_user(user_id)
+        logging.info(f"🗑️ 已清理用户内存会话缓存: {evicted}个会话")
+        from memory import invalidate_user_memories
+        invalidate_user_memories(user_id)
+        prefetch_service.forget_user(user_id)
+        journal_generation_service.forget_user(user_id)
+        user_cache.invalidate(user_id)
+        journal_service.invalidate_count(user_id)
+        
+        logging.info(f"✅ 账户删除成功: user_id={user_id}, 删除数据={deleted_data}")
+        
+        return DeleteAccountResponse(
+            success=True,
+            message="账户及其所有数据已成功删除",
+            deleted_data=deleted_data
+        )
+
     except HTTPException:
         raise
     except Exception as e:
         logging.error(f"❌ 删除账户失败: {e}")
         raise HTTPException(status_code=500, detail="删除账户失败")
 
+# ==================== 增量同步 ====================
+@app.get("/sync")
+async def sync_changes(token: Optional[str] = None, limit: int = SYNC_DEFAULT_LIMIT,
+                       user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
+    """
+    增量同步日记、会话与图片
+    功能：返回上次同步（token）之后新建、修改或删除的数据，按变更顺序排列；首次同步不传 token
+         has_more 为 True 时用 next_token 继续拉取；reset 为 True 时令牌已过期，客户端应清空本地数据后重新同步
+    """
+    limit = max(1, min(limit, SYNC_MAX_LIMIT))
+    try:
+        async with AsyncSessionLocal() as db:
+            data = await sync_service.changes(db, user_id, token, limit)
+    except InvalidSyncTokenError:
+        raise HTTPException(status_code=400, detail="无效的同步令牌")
+    except Exception as e:
+        logging.error(f"❌ 增量同步失败: user_id={user_id}, error={e}")
+        raise HTTPException(status_code=500, detail="增量同步失败")
+
+    return {"status": "success", "data": data}
+
 # ==================== 聊天 ====================
 class Message(BaseModel):
     role: str
@@ -793,6 +912,7 @@ class ChatRequest(BaseModel):
 class GenerateJournalRequest(BaseModel):
     session_id: str
     emotion: Optional[str] = None
+    background: bool = False  # 是否以任务模式生成（立即返回任务ID）
 
 class ManualJournalRequest(BaseModel):
     content: str
@@ -818,25 +938,22 @@ def chat_with_user(request: ChatRequest, user_id: int = Depends(get_current_user
         logging.debug(f"会话ID: {request.session_id}")
         logging.debug(f"情绪标签: {request.emotion}")
         
-        # 1) Heart 扣减
-        db: Session = SessionLocal()
+        # 1) Heart 扣减（当天首次聊天时先按日重置，重置与扣减在同一条条件 UPDATE 内完成）
         try:
-            user = db.query(User).filter(User.id == user_id).first()
-            if not user:
+            profile = user_cache.get(user_id)
+            if not profile:
                 raise HTTPException(status_code=404, detail="用户不存在")
-            if not is_qa_test_user(user):
-                if user.heart < 1:
+            if profile["email"] != QA_TEST_EMAIL:
+                with write_session() as db:
+                    consumed = consume_heart(db, user_id)
+                user_cache.invalidate(user_id)
+                if not consumed:
                     raise HTTPException(status_code=403, detail="心数不足，无法继续聊天，请等待明天重置或充值")
-                user.heart -= 1
-                db.commit(); db.refresh(user)
         except HTTPException:
             raise
         except Exception as e:
-            db.rollback()
             logging.error(f"❌ 更新用户heart值失败: {e}")
             raise HTTPException(status_code=500, detail="系统错误，请稍后再试")
-        finally:
-            db.close()
 
         # 2) 获取或创建会话状态
         state = session_manager.get_or_create_session(user_id, request.session_id)
@@ -920,11 +1037,9 @@ def chat_with_user(request: ChatRequest, user_id: int = Depends(get_current_user
             user_query = f"{user_query}\n\n{image_summary}" if user_query else image_summary
 
         # 获取用户信息并打印
-        db: Session = SessionLocal()
-        u = db.query(User).filter(User.id == user_id).first()
-        db.close()
+        u = user_cache.get(user_id)
         
-        logging.debug(f"用户昵称: {u.name}")
+        logging.debug(f"用户昵称: {u['name'] if u else None}")
         logging.debug(f"用户输入: {user_query}")
         logging.debug("=" * 60)
 
@@ -960,10 +1075,10 @@ def chat_with_user(request: ChatRequest, user_id: int = Depends(get_current_user
         # 7) 生成：分析→（可选RAG）→生成
         # 构造用户信息字典
         user_info = {
-            "name": u.name,
-            "birthday": u.birthday,
-            "heart": u.heart,
-            "is_member": u.subscription_status == "active"  # 使用订阅状态判断是否为会员
+            "name": u["name"],
+            "birthday": u["birthday"],
+            "heart": u["heart"],
+            "is_member": u["subscription_status"] == "active"  # 使用订阅状态判断是否为会员
         } if u else {}
         
         # 获取当前时间（包含周几）
@@ -996,16 +1111,20 @@ def chat_with_user(request: ChatRequest, user_id: int = Depends(get_current_user
         except Exception as e:
             logging.error(f"❌ 保存会话状态失败: {e}")
 
+        # 9.5) 对话即将结束：后台预生成日记草稿，用户点击生成日记时可直接使用
+        if analysis.get("should_end_conversation"):
+            try:
+                journal_generation_service.schedule_draft(user_id, request.session_id, request.emotion)
+            except Exception as e:
+                logging.warning(f"⚠️ 提交日记草稿预生成失败: {e}")
+
         # 10) 返回当前heart
-        db: Session = SessionLocal()
         try:
-            cur = db.query(User).filter(User.id == user_id).first()
-            current_heart = cur.heart if cur else 0
+            cur = user_cache.get(user_id)
+            current_heart = cur["heart"] if cur else 0
         except Exception as e:
             logging.error(f"❌ 获取用户heart值失败: {e}")
             current_heart = 0
-        finally:
-            db.close()
 
         # 调试输出
         try:
@@ -1066,60 +1185,57 @@ def chat_with_user(request: ChatRequest, user_id: int = Depends(get_current_user
         return {"response": {"answer": "抱歉，系统暂时无法处理您的请求，请稍后再试。", "references": []}}
 
 @app.get("/chat/history/list")
-def get_chat_history_list(
+async def get_chat_history_list(
+    response: Response,
     limit: int = 50,
-    user_id: int = Depends(get_current_user)
-) -> Dict[str, Any]:
+    user_id: int = Depends(get_current_user),
+    if_none_match: Optional[str] = Header(None)
+):
     """
     获取当前用户的历史会话列表（按最近更新时间倒序）
+    支持 If-None-Match：会话列表未变化时返回 304
     """
     try:
         limit = max(1, min(limit, 200))
-
-        db: Session = SessionLocal()
-        try:
-            sessions = db.query(ChatSession).filter(
+        prefetch_service.schedule(user_id)
+
+        async with AsyncSessionLocal() as db:
+            version = await etag_service.chat_session_list_version(db, user_id)
+            etag = etag_service.make("chat_sessions", user_id, limit, version)
+            not_modified = etag_service.check(if_none_match, etag, "chat_history_list")
+            if not_modified:
+                return not_modified
+
+            # 只查询列表所需的冗余摘要字段，不解析 state_data
+            sessions = (await db.execute(select(
+                ChatSession.session_id,
+                ChatSession.message_count,
+                ChatSession.last_role,
+                ChatSession.last_message_preview,
+                ChatSession.created_at,
+                ChatSession.updated_at,
+            ).where(
                 ChatSession.user_id == user_id,
                 ChatSession.is_active == True
-            ).order_by(ChatSession.updated_at.desc()).limit(limit).all()
+            ).order_by(ChatSession.updated_at.desc()).limit(limit))).all()
 
             items = []
             for s in sessions:
-                raw_history = []
-                if s.state_data:
-                    try:
-                        state_data = json.loads(s.state_data)
-                        raw_history = state_data.get("history", [])
-                    except Exception:
-                        raw_history = []
-
-                last_message = ""
-                last_role = None
-                if raw_history:
-                    last_item = raw_history[-1]
-                    if isinstance(last_item, (list, tuple)) and len(last_item) >= 2:
-                        last_role = str(last_item[0])
-                        last_message = str(last_item[1] or "")
-                    elif isinstance(last_item, dict):
-                        last_role = str(last_item.get("role") or "")
-                        last_message = str(last_item.get("content") or "")
-
                 items.append({
                     "session_id": s.session_id,
-                    "message_count": len(raw_history),
-                    "last_role": last_role,
-                    "last_message_preview": last_message[:120],
+                    "message_count": s.message_count or 0,
+                    "last_role": s.last_role,
+                    "last_message_preview": s.last_message_preview or "",
                     "created_at": s.created_at.isoformat() if s.created_at else None,
                     "updated_at": s.updated_at.isoformat() if s.updated_at else None,
                 })
 
+            etag_service.tag(response, etag)
             return {
                 "status": "success",
                 "count": len(items),
                 "sessions": items
             }
-        finally:
-            db.close()
     except HTTPException:
         raise
     except Exception as e:
@@ -1127,13 +1243,15 @@ def get_chat_history_list(
         raise HTTPException(status_code=500, detail="获取历史会话列表失败")
 
 @app.get("/chat/history/{session_id}")
-def get_chat_history_detail(
+async def get_chat_history_detail(
     session_id: str,
     limit: int = 1000,
+    before_seq: Optional[int] = None,
     user_id: int = Depends(get_current_user)
 ) -> Dict[str, Any]:
     """
     获取当前用户某个历史会话的详细消息内容
+    分页：按消息序号倒序取一页，before_seq 为上一页返回的 next_before_seq
     """
     try:
         session_id = (session_id or "").strip()
@@ -1142,50 +1260,21 @@ def get_chat_history_detail(
 
         limit = max(1, min(limit, 5000))
 
-        db: Session = SessionLocal()
-        try:
-            chat_session = db.query(ChatSession).filter(
-                ChatSession.user_id == user_id,
-                ChatSession.session_id == session_id,
-                ChatSession.is_active == True
-            ).first()
-
-            if not chat_session:
-                raise HTTPException(status_code=404, detail="会话不存在")
-
-            raw_history = []
-            if chat_session.state_data:
-                try:
-                    state_data = json.loads(chat_session.state_data)
-                    raw_history = state_data.get("history", [])
-                except Exception:
-                    raw_history = []
-
-            history: List[Dict[str, str]] = []
-            for item in raw_history:
-                if isinstance(item, (list, tuple)) and len(item) >= 2:
-                    role = str(item[0] or "")
-                    content = str(item[1] or "")
-                elif isinstance(item, dict):
-                    role = str(item.get("role") or "")
-                    content = str(item.get("content") or "")
-                else:
-                    continue
-                history.append({"role": role, "content": content})
-
-            history = history[-limit:]
+        page = await session_manager.get_history_page_async(user_id, session_id, before_seq=before_seq, limit=limit)
+        if page is None:
+            raise HTTPException(status_code=404, detail="会话不存在")
 
-            return {
-                "status": "success",
-                "session_id": session_id,
-                "total_messages": len(raw_history),
-                "returned_messages": len(history),
-                "created_at": chat_session.created_at.isoformat() if chat_session.created_at else None,
-                "updated_at": chat_session.updated_at.isoformat() if chat_session.updated_at else None,
-                "history": history
-            }
-        finally:
-            db.close()
+        return {
+            "status": "success",
+            "session_id": session_id,
+            "total_messages": page["total_messages"],
+            "returned_messages": len(page["messages"]),
+            "has_more": page["has_more"],
+            "next_before_seq": page["next_before_seq"],
+            "created_at": page["created_at"].isoformat() if page["created_at"] else None,
+            "updated_at": page["updated_at"].isoformat() if page["updated_at"] else None,
+            "history": page["messages"]
+        }
     except HTTPException:
         raise
     except Exception as e:
@@ -1245,104 +1334,37 @@ def get_image(user_id: int, filename: str, current_user_id: int = Depends(get_cu
 
 # ==================== 日记生成 ====================
 @app.post("/journal/generate")
-def generate_journal(request: GenerateJournalRequest, user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
+def generate_journal(request: GenerateJournalRequest, response: Response, user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
+    """
+    生成日记
+    功能：默认同步生成并返回日记；background=true 时立即返回任务ID（202），
+         客户端通过 GET /journal/jobs/{job_id} 轮询或 GET /journal/jobs/{job_id}/events 订阅结果
+    """
     try:
-        logging.info(f"\n📝 生成日记：user={user_id}")
+        logging.info(f"\n📝 生成日记：user={user_id}, background={request.background}")
         
         # 获取用户信息（不消耗心心）
-        db: Session = SessionLocal()
         try:
-            user = db.query(User).filter(User.id == user_id).first()
+            user = user_cache.get(user_id)
             if not user:
                 raise HTTPException(status_code=404, detail="用户不存在")
             # 日记生成不消耗心心，只获取用户信息
         except HTTPException:
             raise
         except Exception as e:
-            db.rollback()
             logging.error(f"❌ 获取用户信息失败: {e}")
             raise HTTPException(status_code=500, detail="系统错误，请稍后再试")
-        finally:
-            db.close()
 
-        # 获取会话历史
-        state = session_manager.get_or_create_session(user_id, request.session_id)
-        context_summary = state.summary(last_n=1000)  # 获取完整对话历史
+        if request.background:
+            job = journal_generation_service.submit(user_id, request.session_id, request.emotion)
+            response.status_code = 202
+            return journal_generation_service.get_job(job.id, user_id)
 
-        # 收集会话中的图片ID
-        session_images = []
-        try:
-            db: Session = SessionLocal()
-            images = db.query(Image).filter(
-                Image.user_id == user_id,
-                Image.session_id == request.session_id
-            ).all()
-            session_images = [str(img.id) for img in images]
-            db.close()
-            logging.info(f"📷 会话中的图片ID: {session_images}")
-        except Exception as e:
-            logging.warning(f"⚠️ 获取会话图片失败: {e}")
-
-        from prompts.journal_prompts import get_journal_generation_prompt
-        user_emotion = request.emotion or "平和"
-        journal_system_prompt = get_journal_generation_prompt(emotion=user_emotion, chat_history=context_summary)
-
-        from llm.llm_factory import chat_with_doubao_llm
-        journal_result = chat_with_doubao_llm(journal_system_prompt)
-        journal_text = journal_result.get("answer", "今天的心情有点复杂，暂时说不清楚。")
-
-        # 入库
-        db: Session = SessionLocal()
-        try:
-            journal_entry = Journal(
-                user_id=user_id,
-                content=journal_text,
-                session_id=request.session_id,  # 使用请求中的会话ID
-                emotion=request.emotion,
-                images=",".join(session_images) if session_images else None,
-            )
-            db.add(journal_entry); db.commit(); db.refresh(journal_entry)
-            logging.info(f"✅ 日记已保存 ID={journal_entry.id}")
-            
-            # 同步生成记忆点
-            try:
-                from memory import generate_memory_point_for_journal
-                success = generate_memory_point_for_journal(journal_entry.id)
-                if success:
-                    logging.info(f"✅ 日记 {journal_entry.id} 记忆点生成成功")
-                else:
-                    logging.warning(f"⚠️ 日记 {journal_entry.id} 记忆点生成失败")
-            except Exception as memory_e:
-                logging.warning(f"⚠️ 记忆点生成失败: {memory_e}")
-                
-        except Exception as e:
-            logging.error(f"❌ 保存日记失败：{e}")
-            db.rollback(); raise
-        finally:
-            db.close()
-
-        # 生成图片URL列表
-        image_urls = []
-        if session_images:
-            for image_id in session_images:
-                try:
-                    db: Session = SessionLocal()
-                    image = db.query(Image).filter(Image.id == int(image_id)).first()
-                    if image:
-                        image_urls.append(f"/api/images/user_{image.user_id}/{image.filename}")
-                    db.close()
-                except Exception as e:
-                    logging.warning(f"⚠️ 获取图片URL失败: {e}")
-
-        return {
-            "journal_id": journal_entry.id,
-            "content": journal_text,
-            "emotion": request.emotion,
-            "images": session_images if session_images else [],
-            "image_urls": image_urls if image_urls else [],
-            "status": "success",
-        }
+        result = journal_generation_service.generate(user_id, request.session_id, request.emotion)
+        return {**result, "status": "success"}
 
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"[❌ ERROR] 生成日记失败: {e}")
         return {
@@ -1354,60 +1376,93 @@ def generate_journal(request: GenerateJournalRequest, user_id: int = Depends(get
             "status": "error",
         }
 
+@app.get("/journal/jobs/{job_id}")
+def get_journal_job(job_id: str, user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
+    """
+    查询日记生成任务状态；成功后 journal 字段为生成的日记
+    """
+    job = journal_generation_service.get_job(job_id, user_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    return job
+
+@app.get("/journal/jobs/{job_id}/events")
+async def stream_journal_job(job_id: str, user_id: int = Depends(get_current_user)):
+    """
+    通过 SSE 推送日记生成任务状态：状态变化时发送 event: status，任务结束后关闭连接
+    """
+    if journal_generation_service.get_job(job_id, user_id) is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+
+    async def events():
+        async for snapshot in journal_generation_service.watch(job_id, user_id):
+            if snapshot is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: status\ndata: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # ==================== 日记管理 ====================
 @app.get("/journal/list")
-def get_journal_list(page: int = 1, limit: int = 10, user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
+async def get_journal_list(response: Response, page: int = 1, limit: int = 10, cursor: Optional[str] = None,
+                           user_id: int = Depends(get_current_user), if_none_match: Optional[str] = Header(None)):
     """
     获取用户日记列表
+    翻页优先使用上一页返回的 next_cursor（按 created_at, id 定位，深页与首页代价相同）；
+    未传 cursor 时兼容旧版按 page 翻页
+    支持 If-None-Match：日记未变化时返回 304
     """
     try:
-        db: Session = SessionLocal()
-        
-        # 计算偏移量
-        offset = (page - 1) * limit
-        
-        # 获取日记总数
-        total = db.query(Journal).filter(Journal.user_id == user_id).count()
-        
-        # 获取日记列表
-        journals = db.query(Journal).filter(Journal.user_id == user_id)\
-            .order_by(Journal.created_at.desc())\
-            .offset(offset)\
-            .limit(limit)\
-            .all()
+        position = journal_service.decode_cursor(cursor) if cursor else None
+    except InvalidCursorError:
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+
+    try:
+        async with AsyncSessionLocal() as db:
+            version = await etag_service.journal_list_version(db, user_id)
+            etag = etag_service.make("journals", user_id, page, limit, cursor, version)
+            not_modified = etag_service.check(if_none_match, etag, "journal_list")
+            if not_modified:
+                return not_modified
+
+            # 获取日记总数（缓存）
+            total = await journal_service.count_async(db, user_id)
+            
+            # 获取日记列表（多取一条判断是否还有下一页）
+            rows = (await db.execute(journal_service.list_statement(
+                user_id, limit, cursor=position, offset=0 if position else (page - 1) * limit
+            ))).all()
+            has_more = len(rows) > limit
+            journals = rows[:limit]
+            
+            # 一次查询取出本页所有日记的图片
+            journal_images = await image_service.get_journal_images_async(db, [journal.id for journal in journals])
         
-        # 处理每篇日记的图片信息
         journal_list = []
         for journal in journals:
-            image_urls = []
-            if journal.images:
-                image_ids = journal.images.split(",")
-                for image_id in image_ids:
-                    try:
-                        image = db.query(Image).filter(Image.id == int(image_id)).first()
-                        if image:
-                            image_urls.append(f"/api/images/user_{image.user_id}/{image.filename}")
-                    except Exception as e:
-                        logging.warning(f"⚠️ 获取图片URL失败: {e}")
-            
+            images = journal_images.get(journal.id, [])
             journal_list.append({
                 "journal_id": journal.id,
                 "content": journal.content,
+                "title": journal.title,
                 "emotion": journal.emotion,
-                "images": journal.images.split(",") if journal.images else [],
-                "image_urls": image_urls if image_urls else [],
+                "images": [str(image["image_id"]) for image in images],
+                "image_urls": [image["url"] for image in images],
                 "created_at": journal.created_at.isoformat()
             })
         
-        db.close()
-        
+        etag_service.tag(response, etag)
         return {
             "status": "success",
             "data": {
                 "journals": journal_list,
                 "total": total,
                 "page": page,
-                "limit": limit
+                "limit": limit,
+                "has_more": has_more,
+                "next_cursor": journal_service.encode_cursor(journals[-1].created_at, journals[-1].id) if has_more else None
             }
         }
         
@@ -1418,46 +1473,102 @@ def get_journal_list(page: int = 1, limit: int = 10, user_id: int = Depends(get_
             "message": "获取日记列表失败"
         }
 
+@app.get("/journal/search")
+async def search_journals(q: str, limit: int = 20, cursor: Optional[str] = None,
+                          user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
+    """
+    全文检索日记（正文、记忆点、标题）
+    功能：多个关键词用空格分隔；关键词均不少于 3 个字时按相关度排序，否则按时间倒序；
+         摘要中命中的关键词用 <mark></mark> 标出；翻页时传入上一页返回的 next_cursor
+    """
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="检索内容不能为空")
+    limit = max(1, min(limit, 50))
+    try:
+        async with AsyncSessionLocal() as db:
+            data = await journal_search_service.search(db, user_id, q, limit, cursor)
+    except InvalidCursorError:
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+    except Exception as e:
+        logging.error(f"❌ 检索日记失败: {e}")
+        return {
+            "status": "error",
+            "message": "检索日记失败"
+        }
+
+    return {
+        "status": "success",
+        "data": {**data, "query": q, "limit": limit}
+    }
+
+@app.get("/journal/stats")
+async def get_journal_stats(bucket: str = "day", start: Optional[date] = None, end: Optional[date] = None,
+                            user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
+    """
+    情绪日历与趋势统计
+    功能：按日（day）、周（week，从周一开始）或月（month）汇总区间内每种情绪的日记篇数；
+         start / end 为 YYYY-MM-DD（含），默认截止今天：按日统计最近 30 天、按周最近 12 周、按月最近一年
+    """
+    try:
+        start, end = journal_stats_service.resolve_range(bucket, start, end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        async with AsyncSessionLocal() as db:
+            data = await journal_stats_service.stats(db, user_id, bucket, start, end)
+    except Exception as e:
+        logging.error(f"❌ 获取情绪统计失败: {e}")
+        return {
+            "status": "error",
+            "message": "获取情绪统计失败"
+        }
+
+    return {
+        "status": "success",
+        "data": {**data, "bucket": bucket, "start": start.isoformat(), "end": end.isoformat()}
+    }
+
 @app.get("/journal/{journal_id}")
-def get_journal_detail(journal_id: int, user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
+async def get_journal_detail(journal_id: int, response: Response, user_id: int = Depends(get_current_user),
+                             if_none_match: Optional[str] = Header(None)):
     """
     获取单篇日记详情
+    支持 If-None-Match：日记未修改时返回 304
     """
     try:
-        db: Session = SessionLocal()
-        
-        # 获取日记
-        journal = db.query(Journal).filter(
-            Journal.id == journal_id,
-            Journal.user_id == user_id
-        ).first()
-        
-        if not journal:
-            db.close()
-            raise HTTPException(status_code=404, detail="日记不存在")
-        
-        # 处理图片信息
-        image_urls = []
-        if journal.images:
-            image_ids = journal.images.split(",")
-            for image_id in image_ids:
-                try:
-                    image = db.query(Image).filter(Image.id == int(image_id)).first()
-                    if image:
-                        image_urls.append(f"/api/images/user_{image.user_id}/{image.filename}")
-                except Exception as e:
-                    logging.warning(f"⚠️ 获取图片URL失败: {e}")
-        
-        db.close()
+        async with AsyncSessionLocal() as db:
+            version = await etag_service.journal_version(db, user_id, journal_id)
+            if version is None:
+                raise HTTPException(status_code=404, detail="日记不存在")
+            etag = etag_service.make("journal", user_id, version)
+            not_modified = etag_service.check(if_none_match, etag, "journal_detail")
+            if not_modified:
+                return not_modified
+
+            # 获取日记
+            journal = (await db.execute(
+                select(Journal.id, Journal.content, Journal.title, Journal.emotion, Journal.created_at).where(
+                    Journal.id == journal_id,
+                    Journal.user_id == user_id
+                )
+            )).first()
+            
+            if not journal:
+                raise HTTPException(status_code=404, detail="日记不存在")
+            
+            # 处理图片信息
+            images = (await image_service.get_journal_images_async(db, [journal.id])).get(journal.id, [])
         
+        etag_service.tag(response, etag)
         return {
             "status": "success",
             "data": {
                 "journal_id": journal.id,
                 "content": journal.content,
+                "title": journal.title,
                 "emotion": journal.emotion,
-                "images": journal.images.split(",") if journal.images else [],
-                "image_urls": image_urls if image_urls else [],
+                "images": [str(image["image_id"]) for image in images],
+                "image_urls": [image["url"] for image in images],
                 "created_at": journal.created_at.isoformat()
             }
         }
@@ -1472,13 +1583,11 @@ def get_journal_detail(journal_id: int, user_id: int = Depends(get_current_user)
         }
 
 @app.delete("/journal/{journal_id}")
-def delete_journal(journal_id: int, user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
+def delete_journal(journal_id: int, db: Session = Depends(get_db), user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
     """
     删除日记
     """
     try:
-        db: Session = SessionLocal()
-        
         # 获取日记
         journal = db.query(Journal).filter(
             Journal.id == journal_id,
@@ -1486,29 +1595,20 @@ def delete_journal(journal_id: int, user_id: int = Depends(get_current_user)) ->
         ).first()
         
         if not journal:
-            db.close()
             raise HTTPException(status_code=404, detail="日记不存在")
         
-        # 删除关联的图片文件
-        if journal.images:
-            image_ids = journal.images.split(",")
-            for image_id in image_ids:
-                try:
-                    image = db.query(Image).filter(Image.id == int(image_id)).first()
-                    if image:
-                        # 删除图片文件
-                        import os
-                        if os.path.exists(image.file_path):
-                            os.remove(image.file_path)
-                        # 删除图片记录
-                        db.delete(image)
-                except Exception as e:
-                    logging.warning(f"⚠️ 删除图片失败: {e}")
+        # 删除关联的图片文件、图片记录与关联关系
+        image_ids = [row.image_id for row in db.query(JournalImage.image_id).filter(JournalImage.journal_id == journal.id)]
+        image_service.delete_images(db, image_ids)
         
         # 删除日记记录
+        had_memory_point = bool(journal.memory_point)
         db.delete(journal)
         db.commit()
-        db.close()
+        journal_service.adjust_count(user_id, -1)
+        if had_memory_point:
+            from memory import invalidate_user_memories
+            invalidate_user_memories(user_id)
         
         return {
             "status": "success",
@@ -1526,88 +1626,50 @@ def delete_journal(journal_id: int, user_id: int = Depends(get_current_user)) ->
 
 # ==================== 手动日记 ====================
 @app.post("/journal/create")
-def create_manual_journal(request: ManualJournalRequest, user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
+def create_manual_journal(request: ManualJournalRequest, db: Session = Depends(get_db), user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
     try:
         logging.info(f"\n📝 手动日记：user={user_id}")
         
-        # 处理图片上传（如果有）
+        # 处理图片上传（如果有）：多张图片并行保存并分析，按上传顺序关联
         session_images = []
+        image_urls = []
+        failed_images = []
         if request.has_image and request.image_data:
             try:
                 logging.info(f"📷 开始处理手动日记图片上传，共{len(request.image_data)}张图片...")
-                
-                for i, image_data_b64 in enumerate(request.image_data):
-                    try:
-                        # 解码Base64图片数据
-                        import base64
-                        image_data = base64.b64decode(image_data_b64.split(',')[1] if ',' in image_data_b64 else image_data_b64)
-                        logging.info(f"📷 图片{i+1}数据解码成功，大小: {len(image_data)} bytes")
-                        
-                        # 保存并分析图片
-                        result = image_service.save_image(
-                            image_data=image_data,
-                            user_id=user_id,
-                            session_id="manual",  # 手动日记使用固定的session_id
-                            original_filename=f"manual_journal_image_{i+1}.jpg"
-                        )
-                        
-                        if result["success"]:
-                            session_images.append(str(result["image_id"]))
-                            logging.info(f"✅ 手动日记图片{i+1}保存成功: {result['image_id']}")
-                        else:
-                            logging.error(f"❌ 手动日记图片{i+1}处理失败: {result.get('error', '未知错误')}")
-                            
-                    except Exception as e:
-                        logging.error(f"❌ 手动日记图片{i+1}处理异常: {e}")
-                        import traceback
-                        traceback.print_exc()
+                saved, failed_images = image_service.save_images(
+                    request.image_data, user_id, "manual",  # 手动日记使用固定的session_id
+                    filename_prefix="manual_journal_image"
+                )
+                for result in saved:
+                    session_images.append(str(result["image_id"]))
+                    image_urls.append(image_service.image_url(user_id, result["filename"]))
+                logging.info(f"✅ 手动日记图片保存完成: 成功 {len(saved)} 张, 失败 {len(failed_images)} 张")
                         
             except Exception as e:
                 logging.error(f"❌ 手动日记图片处理异常: {e}")
                 import traceback
                 traceback.print_exc()
 
-        db: Session = SessionLocal()
         try:
             journal_entry = Journal(
                 user_id=user_id,
                 content=request.content,
                 session_id="manual",
                 emotion=request.emotion,
-                images=",".join(session_images) if session_images else None,
             )
-            db.add(journal_entry); db.commit(); db.refresh(journal_entry)
+            db.add(journal_entry); db.flush()
+            image_service.set_journal_images(db, journal_entry.id, session_images)
+            db.commit(); db.refresh(journal_entry)
+            journal_service.adjust_count(user_id, 1)
             logging.info(f"✅ 手动日记已保存 ID={journal_entry.id}")
             
-            # 同步生成记忆点
-            try:
-                from memory import generate_memory_point_for_journal
-                success = generate_memory_point_for_journal(journal_entry.id)
-                if success:
-                    logging.info(f"✅ 手动日记 {journal_entry.id} 记忆点生成成功")
-                else:
-                    logging.warning(f"⚠️ 手动日记 {journal_entry.id} 记忆点生成失败")
-            except Exception as memory_e:
-                logging.warning(f"⚠️ 记忆点生成失败: {memory_e}")
+            # 后台生成记忆点
+            journal_generation_service.schedule_memory_point(journal_entry.id)
                 
         except Exception as e:
             logging.error(f"❌ 保存手动日记失败：{e}")
             db.rollback(); raise
-        finally:
-            db.close()
-
-        # 生成图片URL列表
-        image_urls = []
-        if session_images:
-            for image_id in session_images:
-                try:
-                    db: Session = SessionLocal()
-                    image = db.query(Image).filter(Image.id == int(image_id)).first()
-                    if image:
-                        image_urls.append(f"/api/images/user_{image.user_id}/{image.filename}")
-                    db.close()
-                except Exception as e:
-                    logging.warning(f"⚠️ 获取图片URL失败: {e}")
 
         return {
             "journal_id": journal_entry.id,
@@ -1615,6 +1677,7 @@ def create_manual_journal(request: ManualJournalRequest, user_id: int = Depends(
             "emotion": request.emotion,
             "images": session_images if session_images else [],
             "image_urls": image_urls if image_urls else [],
+            "failed_images": failed_images,
             "status": "success",
         }
 
@@ -1632,17 +1695,32 @@ def create_manual_journal(request: ManualJournalRequest, user_id: int = Depends(
 # ==================== 日记更新 ====================
 
 @app.put("/journal/{journal_id}")
-def update_journal(journal_id: int, request: UpdateJournalRequest, user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
+def update_journal(journal_id: int, request: UpdateJournalRequest, db: Session = Depends(get_db), user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
     try:
         logging.info(f"\n📝 更新日记：user={user_id}, journal={journal_id}")
-        db: Session = SessionLocal()
         j = db.query(Journal).filter(Journal.id == journal_id, Journal.user_id == user_id).first()
         if not j:
-            db.close()
             raise HTTPException(status_code=404, detail="日记不存在")
 
         updated_fields = []
         
+        # 先并行保存新增图片：图片分析耗时较长，放在本请求的任何数据库写入之前，
+        # 避免持有写锁等待分析，也不阻塞图片记录的写入
+        new_image_ids = []
+        failed_images = []
+        if request.has_image and request.add_image_data:
+            try:
+                logging.info(f"📷 开始添加 {len(request.add_image_data)} 张新图片...")
+                saved, failed_images = image_service.save_images(
+                    request.add_image_data, user_id, j.session_id or "manual",
+                    filename_prefix="updated_journal_image"
+                )
+                new_image_ids = [result["image_id"] for result in saved]
+            except Exception as e:
+                logging.error(f"❌ 新图片处理异常: {e}")
+                import traceback
+                traceback.print_exc()
+        
         # 更新内容
         if request.content is not None:
             j.content = request.content
@@ -1659,69 +1737,29 @@ def update_journal(journal_id: int, request: UpdateJournalRequest, user_id: int
                 logging.info(f"📷 开始处理日记图片增量更新...")
                 
                 # 获取当前图片ID列表
-                current_image_ids = []
-                if j.images:
-                    current_image_ids = [int(id) for id in j.images.split(",")]
+                current_image_ids = [
+                    row.image_id for row in db.query(JournalImage.image_id)
+                    .filter(JournalImage.journal_id == j.id)
+                    .order_by(JournalImage.position)
+                ]
                 
-                # 1. 删除不在保留列表中的图片
+                # 1. 删除不在保留列表中的图片（保留列表只对本日记已有的图片生效）
                 keep_ids = set(request.keep_image_ids or [])
-                deleted_count = 0
-                
-                for image_id in current_image_ids:
-                    if image_id not in keep_ids:
-                        try:
-                            old_image = db.query(Image).filter(Image.id == image_id).first()
-                            if old_image:
-                                # 删除图片文件
-                                import os
-                                if os.path.exists(old_image.file_path):
-                                    os.remove(old_image.file_path)
-                                # 删除图片记录
-                                db.delete(old_image)
-                                deleted_count += 1
-                                logging.info(f"🗑️ 删除图片: {image_id}")
-                        except Exception as e:
-                            logging.warning(f"⚠️ 删除图片 {image_id} 失败: {e}")
-                
-                # 2. 添加新图片
-                new_image_ids = []
-                if request.add_image_data:
-                    logging.info(f"📷 开始添加 {len(request.add_image_data)} 张新图片...")
-                    for i, image_data_b64 in enumerate(request.add_image_data):
-                        try:
-                            # 解码Base64图片数据
-                            import base64
-                            image_data = base64.b64decode(image_data_b64.split(',')[1] if ',' in image_data_b64 else image_data_b64)
-                            logging.info(f"📷 新图片{i+1}数据解码成功，大小: {len(image_data)} bytes")
-                            
-                            # 保存并分析图片
-                            result = image_service.save_image(
-                                image_data=image_data,
-                                user_id=user_id,
-                                session_id=j.session_id or "manual",
-                                original_filename=f"updated_journal_image_{i+1}.jpg"
-                            )
-                            
-                            if result["success"]:
-                                new_image_ids.append(result["image_id"])
-                                logging.info(f"✅ 新图片{i+1}保存成功: {result['image_id']}")
-                            else:
-                                logging.error(f"❌ 新图片{i+1}处理失败: {result.get('error', '未知错误')}")
-                                
-                        except Exception as e:
-                            logging.error(f"❌ 新图片{i+1}处理异常: {e}")
-                            import traceback
-                            traceback.print_exc()
+                kept_image_ids = [image_id for image_id in current_image_ids if image_id in keep_ids]
+                removed_image_ids = [image_id for image_id in current_image_ids if image_id not in keep_ids]
+                deleted_count = image_service.delete_images(db, removed_image_ids)
+                if removed_image_ids:
+                    logging.info(f"🗑️ 删除图片: {removed_image_ids}")
                 
-                # 3. 更新图片字段：保留的图片 + 新增的图片
-                final_image_ids = list(keep_ids) + new_image_ids
-                j.images = ",".join(map(str, final_image_ids)) if final_image_ids else None
+                # 2. 更新图片关联：保留的图片 + 新增的图片（已在前面并行保存）
+                final_image_ids = kept_image_ids + new_image_ids
+                image_service.set_journal_images(db, j.id, final_image_ids)
                 updated_fields.append("images")
                 
                 logging.info(f"✅ 图片增量更新完成:")
                 logging.info(f"   - 删除图片: {deleted_count} 张")
-                logging.info(f"   - 保留图片: {len(keep_ids)} 张")
-                logging.info(f"   - 新增图片: {len(new_image_ids)} 张")
+                logging.info(f"   - 保留图片: {len(kept_image_ids)} 张")
+                logging.info(f"   - 新增图片: {len(new_image_ids)} 张（失败 {len(failed_images)} 张）")
                 logging.info(f"   - 最终图片: {len(final_image_ids)} 张")
                 
             except Exception as e:
@@ -1730,53 +1768,30 @@ def update_journal(journal_id: int, request: UpdateJournalRequest, user_id: int
                 traceback.print_exc()
         elif request.has_image is False:
             # 如果明确设置为没有图片，删除所有图片
-            if j.images:
-                old_image_ids = j.images.split(",")
-                for image_id in old_image_ids:
-                    try:
-                        old_image = db.query(Image).filter(Image.id == int(image_id)).first()
-                        if old_image:
-                            # 删除图片文件
-                            import os
-                            if os.path.exists(old_image.file_path):
-                                os.remove(old_image.file_path)
-                            # 删除图片记录
-                            db.delete(old_image)
-                    except Exception as e:
-                        logging.warning(f"⚠️ 删除图片失败: {e}")
-                
-                j.images = None
+            old_image_ids = [
+                row.image_id for row in db.query(JournalImage.image_id).filter(JournalImage.journal_id == j.id)
+            ]
+            if old_image_ids:
+                image_service.delete_images(db, old_image_ids)
                 updated_fields.append("images")
                 logging.info("✅ 已删除所有图片")
 
         from datetime import timezone, timedelta as _td
         j.updated_at = datetime.now(timezone(_td(hours=8)))
 
-        db.commit(); db.refresh(j); db.close()
+        db.commit(); db.refresh(j)
+        images = image_service.get_journal_images(db, [j.id]).get(j.id, [])
         logging.info(f"✅ 日记更新成功，字段: {updated_fields}")
 
-        # 生成图片URL列表
-        image_urls = []
-        if j.images:
-            image_ids = j.images.split(",")
-            for image_id in image_ids:
-                try:
-                    db: Session = SessionLocal()
-                    image = db.query(Image).filter(Image.id == int(image_id)).first()
-                    if image:
-                        image_urls.append(f"/api/images/user_{image.user_id}/{image.filename}")
-                    db.close()
-                except Exception as e:
-                    logging.warning(f"⚠️ 获取图片URL失败: {e}")
-
         return {
             "status": "success",
             "journal_id": j.id,
             "content": j.content,
             "emotion": j.emotion,
-            "images": j.images.split(",") if j.images else [],
-            "image_urls": image_urls,
+            "images": [str(image["image_id"]) for image in images],
+            "image_urls": [image["url"] for image in images],
             "updated_fields": updated_fields,
+            "failed_images": failed_images,
             "message": "日记更新成功",
         }
     except HTTPException:
@@ -1786,29 +1801,41 @@ def update_journal(journal_id: int, request: UpdateJournalRequest, user_id: int
         return {"status": "error", "message": "更新日记失败"}
 
 @app.get("/journal/{journal_id}/history")
-def get_journal_history(journal_id: int, user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
+def get_journal_history(
+    journal_id: int,
+    limit: int = 1000,
+    before_seq: Optional[int] = None,
+    db: Session = Depends(get_db),
+    user_id: int = Depends(get_current_user)
+) -> Dict[str, Any]:
     """
     获取日记关联的对话历史
+    分页：与 /chat/history/{session_id} 相同，按 before_seq 游标向前翻页
     """
     try:
-        db: Session = SessionLocal()
-        j = db.query(Journal).filter(Journal.id == journal_id, Journal.user_id == user_id).first()
+        limit = max(1, min(limit, 5000))
+        j = db.query(Journal.session_id).filter(Journal.id == journal_id, Journal.user_id == user_id).first()
         if not j:
-            db.close()
             raise HTTPException(status_code=404, detail="日记不存在")
         
-        # 获取对话历史
+        # 获取对话历史（直接分页读取，不加载到会话缓存）
         history = []
+        has_more = False
+        next_before_seq = None
         if j.session_id:
-            state = session_manager.get_or_create_session(user_id, j.session_id)
-            history = state.history
+            page = session_manager.get_history_page(user_id, j.session_id, before_seq=before_seq, limit=limit)
+            if page:
+                history = [[m["role"], m["content"]] for m in page["messages"]]
+                has_more = page["has_more"]
+                next_before_seq = page["next_before_seq"]
         
-        db.close()
         return {
             "status": "success", 
             "journal_id": journal_id,
             "session_id": j.session_id,
-            "history": history
+            "history": history,
+            "has_more": has_more,
+            "next_before_seq": next_before_seq
         }
     except HTTPException:
         raise
@@ -1820,7 +1847,7 @@ def get_journal_history(journal_id: int, user_id: int = Depends(get_current_user
 # ==================== Apple 订阅 ====================
 @app.post("/subscription/verify")
 @app.post("/iap/verify")
-def verify_subscription(request: SubscriptionVerifyRequest, user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
+def verify_subscription(request: SubscriptionVerifyRequest, db: Session = Depends(get_db), user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
     """
     验证 Apple 订阅收据
     """
@@ -1853,36 +1880,32 @@ def verify_subscription(request: SubscriptionVerifyRequest, user_id: int = Depen
         subscription_info = parse_subscription_info(apple_response)
         
         # 3. 更新用户订阅状态
-        db: Session = SessionLocal()
-        try:
-            environment = "production" if not apple_response.get("environment", "").lower() == "sandbox" else "sandbox"
-            user = update_user_subscription(
-                db=db,
-                user_id=user_id,
-                subscription_info=subscription_info,
-                receipt_data=request.receipt_data,
-                environment=environment
-            )
-            # 订阅验证成功后，重置心心为100
-            if user.subscription_status == "active":
-                user.heart = 100
-                db.commit(); db.refresh(user)
-            
-            return {
-                "status": "success",
-                "message": "订阅验证成功",
-                "subscription": {
-                    "status": user.subscription_status,
-                    "product_id": user.subscription_product_id,
-                    "expires_at": user.subscription_expires_at.isoformat() if user.subscription_expires_at else None,
-                    "auto_renew": user.auto_renew_status,
-                    "environment": user.subscription_environment,
-                    "is_member": user.subscription_status == "active"
-                }
+        environment = "production" if not apple_response.get("environment", "").lower() == "sandbox" else "sandbox"
+        user = update_user_subscription(
+            db=db,
+            user_id=user_id,
+            subscription_info=subscription_info,
+            receipt_data=request.receipt_data,
+            environment=environment
+        )
+        # 订阅验证成功后，重置心心为100
+        if user.subscription_status == "active":
+            set_heart(user, 100)
+            db.commit(); db.refresh(user)
+            user_cache.invalidate(user_id)
+        
+        return {
+            "status": "success",
+            "message": "订阅验证成功",
+            "subscription": {
+                "status": user.subscription_status,
+                "product_id": user.subscription_product_id,
+                "expires_at": user.subscription_expires_at.isoformat() if user.subscription_expires_at else None,
+                "auto_renew": user.auto_renew_status,
+                "environment": user.subscription_environment,
+                "is_member": user.subscription_status == "active"
             }
-            
-        finally:
-            db.close()
+        }
             
     except AppleSubscriptionError as e:
         logging.error(f"❌ 订阅验证失败: {e}")
@@ -1892,24 +1915,36 @@ def verify_subscription(request: SubscriptionVerifyRequest, user_id: int = Depen
         raise HTTPException(status_code=500, detail="订阅验证失败，请稍后再试")
 
 @app.get("/subscription/status")
-def get_subscription_status(user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
+def get_subscription_status(db: Session = Depends(get_db), user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
     """
     获取用户订阅状态
     """
     try:
         logging.info(f"📊 查询订阅状态: user_id={user_id}")
         
-        db: Session = SessionLocal()
-        try:
+        profile = user_cache.get(user_id)
+        if not profile:
+            raise AppleSubscriptionError("用户不存在")
+        expires_at = profile["subscription_expires_at"]
+        if expires_at and expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        if profile["subscription_status"] == "active" and expires_at and expires_at <= datetime.now(timezone.utc):
+            # 订阅已过期需要回写状态，走数据库路径
             subscription_info = get_user_subscription_status(db, user_id)
-            
-            return {
-                "status": "success",
-                "subscription": subscription_info
+        else:
+            subscription_info = {
+                "subscription_status": profile["subscription_status"],
+                "subscription_product_id": profile["subscription_product_id"],
+                "subscription_expires_at": profile["subscription_expires_at"],
+                "auto_renew_status": profile["auto_renew_status"],
+                "subscription_environment": profile["subscription_environment"],
+                "is_member": profile["subscription_status"] == "active"
             }
-            
-        finally:
-            db.close()
+        
+        return {
+            "status": "success",
+            "subscription": subscription_info
+        }
             
     except AppleSubscriptionError as e:
         logging.error(f"❌ 查询订阅状态失败: {e}")
@@ -1940,69 +1975,65 @@ def handle_subscription_webhook(notification: AppleWebhookNotification) -> Dict[
         raise HTTPException(status_code=500, detail="通知处理失败")
 
 @app.post("/subscription/refresh")
-def refresh_subscription_status(user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
+def refresh_subscription_status(db: Session = Depends(get_db), user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
     """
     刷新用户订阅状态（重新验证最新收据）
     """
     try:
         logging.info(f"🔄 刷新订阅状态: user_id={user_id}")
         
-        db: Session = SessionLocal()
+        user = db.query(User).filter(User.id == user_id).first()
+        if not user:
+            raise HTTPException(status_code=404, detail="用户不存在")
+        
+        if not user.latest_receipt:
+            raise HTTPException(status_code=400, detail="用户没有订阅记录")
+        
+        # 重新验证收据
         try:
-            user = db.query(User).filter(User.id == user_id).first()
-            if not user:
-                raise HTTPException(status_code=404, detail="用户不存在")
-            
-            if not user.latest_receipt:
-                raise HTTPException(status_code=400, detail="用户没有订阅记录")
-            
-            # 重新验证收据
-            try:
+            apple_response = verify_receipt_with_apple(
+                receipt_data=user.latest_receipt,
+                use_sandbox=(user.subscription_environment == "sandbox")
+            )
+        except AppleSubscriptionError as e:
+            if "收据是生产收据" in str(e) and user.subscription_environment == "sandbox":
+                # 尝试生产环境
                 apple_response = verify_receipt_with_apple(
                     receipt_data=user.latest_receipt,
-                    use_sandbox=(user.subscription_environment == "sandbox")
+                    use_sandbox=False
                 )
-            except AppleSubscriptionError as e:
-                if "收据是生产收据" in str(e) and user.subscription_environment == "sandbox":
-                    # 尝试生产环境
-                    apple_response = verify_receipt_with_apple(
-                        receipt_data=user.latest_receipt,
-                        use_sandbox=False
-                    )
-                else:
-                    raise e
-            
-            # 解析并更新订阅信息
-            subscription_info = parse_subscription_info(apple_response)
-            environment = "production" if not apple_response.get("environment", "").lower() == "sandbox" else "sandbox"
-            
-            user = update_user_subscription(
-                db=db,
-                user_id=user_id,
-                subscription_info=subscription_info,
-                receipt_data=user.latest_receipt,
-                environment=environment
-            )
-            # 刷新成功且为有效订阅，则重置心心为100
-            if user.subscription_status == "active":
-                user.heart = 100
-                db.commit(); db.refresh(user)
-            
-            return {
-                "status": "success",
-                "message": "订阅状态刷新成功",
-                "subscription": {
-                    "status": user.subscription_status,
-                    "product_id": user.subscription_product_id,
-                    "expires_at": user.subscription_expires_at.isoformat() if user.subscription_expires_at else None,
-                    "auto_renew": user.auto_renew_status,
-                    "environment": user.subscription_environment,
-                    "is_member": user.subscription_status == "active"
-                }
+            else:
+                raise e
+        
+        # 解析并更新订阅信息
+        subscription_info = parse_subscription_info(apple_response)
+        environment = "production" if not apple_response.get("environment", "").lower() == "sandbox" else "sandbox"
+        
+        user = update_user_subscription(
+            db=db,
+            user_id=user_id,
+            subscription_info=subscription_info,
+            receipt_data=user.latest_receipt,
+            environment=environment
+        )
+        # 刷新成功且为有效订阅，则重置心心为100
+        if user.subscription_status == "active":
+            set_heart(user, 100)
+            db.commit(); db.refresh(user)
+            user_cache.invalidate(user_id)
+        
+        return {
+            "status": "success",
+            "message": "订阅状态刷新成功",
+            "subscription": {
+                "status": user.subscription_status,
+                "product_id": user.subscription_product_id,
+                "expires_at": user.subscription_expires_at.isoformat() if user.subscription_expires_at else None,
+                "auto_renew": user.auto_renew_status,
+                "environment": user.subscription_environment,
+                "is_member": user.subscription_status == "active"
             }
-            
-        finally:
-            db.close()
+        }
             
     except HTTPException:
         raise
@@ -2065,7 +2096,7 @@ def get_subscription_products(user_id: int = Depends(get_current_user)) -> Dict[
         raise HTTPException(status_code=500, detail="获取产品列表失败")
 
 @app.post("/subscription/restore")
-def restore_subscription(request: SubscriptionVerifyRequest, user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
+def restore_subscription(request: SubscriptionVerifyRequest, db: Session = Depends(get_db), user_id: int = Depends(get_current_user)) -> Dict[str, Any]:
     """
     恢复订阅购买
     用于用户重新安装应用后恢复之前的订阅
@@ -2096,36 +2127,32 @@ def restore_subscription(request: SubscriptionVerifyRequest, user_id: int = Depe
         subscription_info = parse_subscription_info(apple_response)
         
         # 3. 更新用户订阅状态
-        db: Session = SessionLocal()
-        try:
-            environment = "production" if not apple_response.get("environment", "").lower() == "sandbox" else "sandbox"
-            user = update_user_subscription(
-                db=db,
-                user_id=user_id,
-                subscription_info=subscription_info,
-                receipt_data=request.receipt_data,
-                environment=environment
-            )
-            # 恢复购买成功且为有效订阅，则重置心心为100
-            if user.subscription_status == "active":
-                user.heart = 100
-                db.commit(); db.refresh(user)
-            
-            return {
-                "status": "success",
-                "message": "恢复购买成功",
-                "subscription": {
-                    "status": user.subscription_status,
-                    "expires_at": user.subscription_expires_at.isoformat() if user.subscription_expires_at else None,
-                    "product_id": user.subscription_product_id,
-                    "auto_renew": user.auto_renew_status,
-                    "environment": user.subscription_environment,
-                    "is_member": user.subscription_status == "active"
-                }
+        environment = "production" if not apple_response.get("environment", "").lower() == "sandbox" else "sandbox"
+        user = update_user_subscription(
+            db=db,
+            user_id=user_id,
+            subscription_info=subscription_info,
+            receipt_data=request.receipt_data,
+            environment=environment
+        )
+        # 恢复购买成功且为有效订阅，则重置心心为100
+        if user.subscription_status == "active":
+            set_heart(user, 100)
+            db.commit(); db.refresh(user)
+            user_cache.invalidate(user_id)
+        
+        return {
+            "status": "success",
+            "message": "恢复购买成功",
+            "subscription": {
+                "status": user.subscription_status,
+                "expires_at": user.subscription_expires_at.isoformat() if user.subscription_expires_at else None,
+                "product_id": user.subscription_product_id,
+                "auto_renew": user.auto_renew_status,
+                "environment": user.subscription_environment,
+                "is_member": user.subscription_status == "active"
             }
-            
-        finally:
-            db.close()
+        }
             
     except HTTPException:
         raise
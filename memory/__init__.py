@@ -4,7 +4,7 @@
 from .analyze_user_memory import UserMemoryAnalyzer
 from .async_memory_generator import AsyncMemoryGenerator, add_journal_for_memory_generation
 from .sync_memory_generator import generate_memory_point_for_journal
-from .memory_retriever import get_user_latest_memories, get_user_memories_by_emotion, get_user_memories_summary
+from .memory_retriever import get_user_latest_memories, get_user_memories_by_emotion, get_user_memories_summary, invalidate_user_memories, prune_expired_memories
 from . import config
 
 __all__ = [
@@ -15,5 +15,7 @@ __all__ = [
     'get_user_latest_memories',
     'get_user_memories_by_emotion',
     'get_user_memories_summary',
+    'invalidate_user_memories',
+    'prune_expired_memories',
     'config'
 ]
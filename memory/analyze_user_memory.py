@@ -21,6 +21,7 @@ load_dotenv()
 
 from database_models import SessionLocal, User, Journal
 from llm.llm_factory import chat_with_llm
+from memory.memory_retriever import invalidate_user_memories
 
 # 配置日志
 logging.basicConfig(
@@ -158,6 +159,7 @@ class UserMemoryAnalyzer:
             
             # 提交更改
             self.db.commit()
+            invalidate_user_memories(user.id)
             
             logger.info(f"✅ 成功更新用户 {user.name} 的 {updated_count} 篇日记记忆点")
             return True
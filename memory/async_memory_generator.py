@@ -23,6 +23,7 @@ load_dotenv()
 
 from database_models import SessionLocal, Journal
 from llm.llm_factory import chat_with_llm
+from memory.memory_retriever import invalidate_user_memories
 
 # 配置日志
 logging.basicConfig(
@@ -163,6 +164,7 @@ class AsyncMemoryGenerator:
                 # 更新日记的记忆点
                 journal.memory_point = memory_point
                 db.commit()
+                invalidate_user_memories(journal.user_id)
                 logger.info(f"✅ 日记 {journal_id} 记忆点生成成功: {memory_point[:50]}...")
             else:
                 logger.warning(f"⚠️  日记 {journal_id} 记忆点生成失败")
@@ -7,16 +7,60 @@
 
 import os
 import sys
-from typing import List, Optional
+import time
+import threading
+from typing import Dict, List, Optional, Tuple
 
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from database_models import SessionLocal, Journal
 
+# 最新记忆点缓存：user_id -> (写入时间, 查询条数, 记忆点列表)；较小 limit 的请求取缓存列表的前缀
+# 记忆点写入/删除时主动失效；TTL 兜底多进程部署下其他 worker 的写入，过期条目由内存缓存清理任务定期清理
+MEMORY_CACHE_TTL_SECONDS = float(os.getenv("MEMORY_CACHE_TTL_SECONDS", "300"))
+_memory_cache: Dict[int, Tuple[float, int, List[str]]] = {}
+# 每次失效递增用户的版本号；查询期间发生失效时结果不写入缓存，避免旧记忆点覆盖失效
+_memory_versions: Dict[int, int] = {}
+_memory_generation = 0  # 清理版本号时递增
+_memory_cache_lock = threading.Lock()
+
+def invalidate_user_memories(user_id: int) -> None:
+    """
+    使指定用户的记忆点缓存失效（记忆点写入或删除后调用）
+    
+    参数:
+        user_id: 用户ID
+    """
+    with _memory_cache_lock:
+        _memory_cache.pop(user_id, None)
+        _memory_versions[user_id] = _memory_versions.get(user_id, 0) + 1
+
+def prune_expired_memories() -> int:
+    """
+    清理过期的记忆点缓存，以及已没有缓存条目的用户版本号（由内存缓存清理任务定期调用）
+    版本号被清理后会从 0 重新计数，因此同时递增 generation，使查询中的旧结果不会写入
+    
+    返回:
+        int: 清理的缓存条目数
+    """
+    global _memory_generation
+    now = time.monotonic()
+    with _memory_cache_lock:
+        expired = [user_id for user_id, (stored_at, _, _) in _memory_cache.items()
+                   if now - stored_at >= MEMORY_CACHE_TTL_SECONDS]
+        for user_id in expired:
+            del _memory_cache[user_id]
+        stale_versions = [user_id for user_id in _memory_versions if user_id not in _memory_cache]
+        for user_id in stale_versions:
+            del _memory_versions[user_id]
+        if stale_versions:
+            _memory_generation += 1
+    return len(expired)
+
 def get_user_latest_memories(user_id: int, limit: int = 5) -> List[str]:
     """
-    获取用户最新的记忆点
+    获取用户最新的记忆点（优先读取缓存）
     
     参数:
         user_id: 用户ID
@@ -25,6 +69,24 @@ def get_user_latest_memories(user_id: int, limit: int = 5) -> List[str]:
     返回:
         List[str]: 记忆点列表，如果没有记忆点则返回空列表
     """
+    with _memory_cache_lock:
+        cached = _memory_cache.get(user_id)
+        token = (_memory_generation, _memory_versions.get(user_id, 0))
+    if cached and time.monotonic() - cached[0] < MEMORY_CACHE_TTL_SECONDS and cached[1] >= limit:
+        return list(cached[2][:limit])
+    
+    memories = _query_user_latest_memories(user_id, limit)
+    if memories is None:
+        return []
+    with _memory_cache_lock:
+        if token == (_memory_generation, _memory_versions.get(user_id, 0)):
+            _memory_cache[user_id] = (time.monotonic(), limit, memories)
+    return list(memories)
+
+def _query_user_latest_memories(user_id: int, limit: int) -> Optional[List[str]]:
+    """
+    从数据库查询用户最新的记忆点，查询失败时返回 None（不写入缓存）
+    """
     db = SessionLocal()
     try:
         # 查询用户最新的有记忆点的日记
@@ -50,7 +112,7 @@ def get_user_latest_memories(user_id: int, limit: int = 5) -> List[str]:
         
     except Exception as e:
         print(f"❌ 获取用户记忆点失败: {e}")
-        return []
+        return None
     finally:
         db.close()
 
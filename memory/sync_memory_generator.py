@@ -7,8 +7,10 @@
 
 import os
 import sys
+import json
 import logging
-from typing import Optional
+from datetime import datetime
+from typing import Iterable, Optional
 
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -17,8 +19,9 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from dotenv import load_dotenv
 load_dotenv()
 
-from database_models import SessionLocal, Journal
+from database_models import SessionLocal, write_session, Journal
 from llm.llm_factory import chat_with_llm
+from memory.memory_retriever import invalidate_user_memories
 
 # 配置日志
 logging.basicConfig(
@@ -35,6 +38,7 @@ def generate_memory_point_for_journal(journal_id: int) -> bool:
     """
     为指定日记同步生成记忆点
     功能：直接调用LLM生成记忆点，并更新数据库
+    说明：调用LLM期间不持有数据库连接；写回时只更新仍没有记忆点的日记（期间日记被删除或已生成时跳过）
     
     参数:
         journal_id: 日记ID
@@ -46,37 +50,47 @@ def generate_memory_point_for_journal(journal_id: int) -> bool:
     try:
         # 获取日记信息
         journal = db.query(Journal).filter(Journal.id == journal_id).first()
-        if not journal:
-            logger.warning(f"⚠️  日记 {journal_id} 不存在，跳过")
-            return False
-        
-        # 检查是否已有记忆点
-        if journal.memory_point:
-            logger.info(f"⏭️  日记 {journal_id} 已有记忆点，跳过")
-            return True
-        
-        logger.info(f"📝 开始为日记 {journal_id} 生成记忆点...")
-        
-        # 生成记忆点
-        memory_point = _generate_memory_point(journal)
-        
-        if memory_point:
-            # 更新日记的记忆点
-            journal.memory_point = memory_point
-            db.commit()
-            logger.info(f"✅ 日记 {journal_id} 记忆点生成成功: {memory_point[:50]}...")
-            return True
-        else:
-            logger.warning(f"⚠️  日记 {journal_id} 记忆点生成失败")
-            return False
-            
     except Exception as e:
-        logger.error(f"❌ 为日记 {journal_id} 生成记忆点失败: {e}")
-        db.rollback()
+        logger.error(f"❌ 读取日记 {journal_id} 失败: {e}")
         return False
     finally:
         db.close()
 
+    if not journal:
+        logger.warning(f"⚠️  日记 {journal_id} 不存在，跳过")
+        return False
+
+    # 检查是否已有记忆点
+    if journal.memory_point:
+        logger.info(f"⏭️  日记 {journal_id} 已有记忆点，跳过")
+        return True
+
+    logger.info(f"📝 开始为日记 {journal_id} 生成记忆点...")
+
+    # 生成记忆点
+    memory_point = _generate_memory_point(journal)
+    if not memory_point:
+        logger.warning(f"⚠️  日记 {journal_id} 记忆点生成失败")
+        return False
+
+    try:
+        # 更新日记的记忆点
+        with write_session() as db:
+            updated = db.query(Journal).filter(
+                Journal.id == journal_id,
+                Journal.memory_point.is_(None)
+            ).update({Journal.memory_point: memory_point}, synchronize_session=False)
+    except Exception as e:
+        logger.error(f"❌ 为日记 {journal_id} 保存记忆点失败: {e}")
+        return False
+
+    if not updated:
+        logger.info(f"⏭️  日记 {journal_id} 已删除或已有记忆点，跳过写入")
+        return True
+    invalidate_user_memories(journal.user_id)
+    logger.info(f"✅ 日记 {journal_id} 记忆点生成成功: {memory_point[:50]}...")
+    return True
+
 def _generate_memory_point(journal: Journal) -> Optional[str]:
     """
     为单篇日记生成记忆点
@@ -98,77 +112,86 @@ def _generate_memory_point(journal: Journal) -> Optional[str]:
         # 调用LLM进行分析
         response = chat_with_llm(prompt)
         
-        # 清理响应内容
-        memory_point = response.strip()
-        
-        # 移除可能的引号
-        if memory_point.startswith('"') and memory_point.endswith('"'):
-            memory_point = memory_point[1:-1]
-        elif memory_point.startswith('"') and memory_point.endswith('"'):
-            memory_point = memory_point[1:-1]
-        
-        # 添加时间前缀
-        if journal.created_at:
-            # 格式化为 "YYYY-MM-DD" 格式
-            time_str = journal.created_at.strftime("%Y-%m-%d")
-            memory_point = f"{time_str} {memory_point}"
-        
-        return memory_point
+        return clean_memory_point(response, journal.created_at)
         
     except Exception as e:
         logger.error(f"❌ 生成记忆点失败: {e}")
         return None
 
+def clean_memory_point(text: str, created_at: Optional[datetime] = None) -> str:
+    """
+    清理模型输出的记忆点：去掉首尾空白与引号，并加上日记日期前缀（"YYYY-MM-DD 记忆点"）
+    """
+    # 清理响应内容
+    memory_point = text.strip()
+    
+    # 移除可能的引号
+    if memory_point.startswith('"') and memory_point.endswith('"'):
+        memory_point = memory_point[1:-1]
+    elif memory_point.startswith('“') and memory_point.endswith('”'):
+        memory_point = memory_point[1:-1]
+    
+    # 添加时间前缀
+    if created_at:
+        # 格式化为 "YYYY-MM-DD" 格式
+        time_str = created_at.strftime("%Y-%m-%d")
+        memory_point = f"{time_str} {memory_point}"
+    
+    return memory_point
+
+def format_image_analysis(analysis_results: Iterable[Optional[str]]) -> str:
+    """
+    将图片分析结果（images.analysis_result）整理为记忆点提示词中的图片描述
+    """
+    analysis_parts = []
+    for analysis_result in analysis_results:
+        if not analysis_result:
+            continue
+        try:
+            # 解析JSON格式的分析结果
+            analysis_data = json.loads(analysis_result)
+            if isinstance(analysis_data, dict):
+                # 提取关键信息
+                summary = analysis_data.get('summary', '')
+                emotion = analysis_data.get('emotion', '')
+                objects = analysis_data.get('objects', [])
+                scene = analysis_data.get('scene', '')
+                
+                # 构建图片分析描述
+                img_desc = f"图片分析：{summary}"
+                if emotion:
+                    img_desc += f"，情绪：{emotion}"
+                if scene:
+                    img_desc += f"，场景：{scene}"
+                if objects:
+                    img_desc += f"，包含：{', '.join(objects)}"
+                
+                analysis_parts.append(img_desc)
+        except json.JSONDecodeError:
+            # 如果不是JSON格式，直接使用原始内容
+            analysis_parts.append(f"图片分析：{analysis_result}")
+    
+    return "；".join(analysis_parts)
+
 def _get_image_analysis_content(journal: Journal) -> str:
     """
     获取日记关联图片的分析内容
     """
     try:
-        if not journal.images:
-            return ""
-        
-        # 解析图片ID列表
-        image_ids = [int(id_str.strip()) for id_str in journal.images.split(",") if id_str.strip()]
-        if not image_ids:
-            return ""
-        
         # 获取图片分析结果
         from database_models.database import SessionLocal
         from database_models.image import Image
-        import json
+        from database_models.journal_image import JournalImage
         
         db = SessionLocal()
         try:
-            images = db.query(Image).filter(Image.id.in_(image_ids)).all()
-            
-            analysis_parts = []
-            for img in images:
-                if img.analysis_result:
-                    try:
-                        # 解析JSON格式的分析结果
-                        analysis_data = json.loads(img.analysis_result)
-                        if isinstance(analysis_data, dict):
-                            # 提取关键信息
-                            summary = analysis_data.get('summary', '')
-                            emotion = analysis_data.get('emotion', '')
-                            objects = analysis_data.get('objects', [])
-                            scene = analysis_data.get('scene', '')
-                            
-                            # 构建图片分析描述
-                            img_desc = f"图片分析：{summary}"
-                            if emotion:
-                                img_desc += f"，情绪：{emotion}"
-                            if scene:
-                                img_desc += f"，场景：{scene}"
-                            if objects:
-                                img_desc += f"，包含：{', '.join(objects)}"
-                            
-                            analysis_parts.append(img_desc)
-                    except json.JSONDecodeError:
-                        # 如果不是JSON格式，直接使用原始内容
-                        analysis_parts.append(f"图片分析：{img.analysis_result}")
+            images = db.query(Image).join(
+                JournalImage, JournalImage.image_id == Image.id
+            ).filter(
+                JournalImage.journal_id == journal.id
+            ).order_by(JournalImage.position).all()
             
-            return "；".join(analysis_parts) if analysis_parts else ""
+            return format_image_analysis(img.analysis_result for img in images)
             
         finally:
             db.close()
@@ -6,14 +6,12 @@
 生成更贴近真实日常记录的心情日记
 """
 
-def get_journal_generation_prompt(emotion: str, chat_history: str) -> str:
+def _journal_writing_rules(chat_history: str, final_step: str = "只输出最终的日记正文") -> str:
     """
-    根据情绪状态获取日记生成prompt（事件优先 · 防虚构）
+    日记正文的写作要求与对话内容（单独生成正文与合并生成共用）
     """
 
-    prompt = f"""# 心情日记生成任务（事件优先 · 防虚构 · 仅基于用户发言）
-
-## 任务目标
+    return f"""## 任务目标
 基于「对话内容参考」中 **user 的发言**，只写一篇贴近日常的心情日记。  
 assistant 的内容仅作语境参考，**不得当作事实引用**或加入日记中。  
 以**具体事件/动作/场景**为主，**情绪为辅**。禁止编造。
@@ -40,11 +38,21 @@ assistant 的内容仅作语境参考，**不得当作事实引用**或加入日
 - 用户发言的核心事件是什么？  
 - 用户此刻的情绪倾向？  
 - 哪种表达最自然？  
-然后只输出最终的日记正文。
+然后{final_step}。
 
 ## 对话内容参考
 {chat_history}
+"""
+
+
+def get_journal_generation_prompt(emotion: str, chat_history: str) -> str:
+    """
+    根据情绪状态获取日记生成prompt（事件优先 · 防虚构）
+    """
 
+    prompt = f"""# 心情日记生成任务（事件优先 · 防虚构 · 仅基于用户发言）
+
+{_journal_writing_rules(chat_history)}
 ## 输出格式
 只输出日记正文，不要标题、不要步骤、不要引用、不要代码块。
 """
@@ -52,6 +60,37 @@ assistant 的内容仅作语境参考，**不得当作事实引用**或加入日
     return prompt
 
 
+def get_journal_bundle_prompt(emotion: str, chat_history: str, image_analysis: str = "") -> str:
+    """
+    合并生成prompt：一次调用同时输出日记正文、标题与记忆点（JSON）
+    正文要求与 get_journal_generation_prompt 相同，标题要求与 get_journal_title_prompt 相同，
+    记忆点要求与 memory/sync_memory_generator 的记忆点提炼相同
+    """
+
+    prompt = f"""# 心情日记生成任务（事件优先 · 防虚构 · 仅基于用户发言）
+
+{_journal_writing_rules(chat_history, final_step='按「输出格式」输出结果')}
+## 图片分析
+{image_analysis or "无"}
+
+## 标题要求（title）
+- 为写好的日记正文起一个自然的标题
+- 不超过 10 个字，简洁口语化，避免书面化或套话
+- 不要使用《》符号
+
+## 记忆点要求（memory_point）
+- 从写好的日记正文（及图片分析）中提炼 **一句话核心记忆点**，描述「发生了什么事」
+- 保留关键信息（人物、事件、结果），客观简洁，不做主观评价
+- 长度 ≤ 25 字，不要带日期、引号或多余解释
+
+## 输出格式
+只输出一个 JSON 对象，不要代码块、不要任何其他文字：
+{{"content": "日记正文", "title": "日记标题", "memory_point": "一句话记忆点"}}
+"""
+
+    return prompt
+
+
 def get_journal_title_prompt(emotion: str, journal_content: str) -> str:
     """
     根据情绪状态获取日记标题生成prompt
@@ -1,17 +1,22 @@
 #!/usr/bin/env python3
 """
-重置所有用户心心为100的脚本
+立即重置所有用户心心的脚本（会员100，普通用户10）
+说明：服务端已在用户当天首次访问时按需重置，此脚本仅用于手动补偿等场景
 """
 
 import os
 import sys
 import logging
-from database_models import User, SessionLocal
 from dotenv import load_dotenv
 
-# 加载环境变量
+# 加载环境变量（需在导入数据库模块之前，DATABASE_URL 可能来自 .env）
 load_dotenv()
 
+from services.heart_service import reset_all_hearts
+
+# 与 main.py 保持一致：QA 测试账号不参与重置
+QA_TEST_EMAIL = os.getenv("QA_TEST_EMAIL", "qa-test@emoflow.internal")
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -20,44 +25,15 @@ logging.basicConfig(
 
 def reset_all_users_heart():
     """
-    重置所有用户的心心：会员用户重置为100，普通用户重置为10
+    重置所有用户的心心：会员用户重置为100，普通用户重置为10（QA 测试账号除外）
     """
     try:
         logging.info("🕛 开始执行：重置所有用户heart值")
         
-        db = SessionLocal()
-        try:
-            # 获取所有用户
-            users = db.query(User).all()
-            total_users = len(users)
-            logging.info(f"📊 当前共有 {total_users} 个用户")
-            
-            if total_users == 0:
-                logging.warning("⚠️ 没有找到任何用户")
-                return True
-            
-            inactive_count = 0
-            active_count = 0
-            
-            for user in users:
-                if user.subscription_status == "active":
-                    user.heart = 100
-                    active_count += 1
-                else:
-                    user.heart = 10
-                    inactive_count += 1
-            
-            db.commit()
-            
-            logging.info(f"✅ 成功重置 {total_users} 个用户: {active_count}个会员重置为100, {inactive_count}个普通用户重置为10")
-            return True
-            
-        except Exception as e:
-            db.rollback()
-            logging.error(f"❌ 数据库操作失败：{e}")
-            return False
-        finally:
-            db.close()
+        stats = reset_all_hearts(exclude_emails=(QA_TEST_EMAIL,))
+        if stats["total"] == 0:
+            logging.warning("⚠️ 没有找到任何用户")
+        return True
             
     except Exception as e:
         logging.error(f"❌ 脚本执行异常：{e}")
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+每日心数重置基准测试
+功能：在临时数据库中生成模拟用户，对比旧版（全部加载进 ORM 逐个修改、单事务提交）与分块集合式 UPDATE 的耗时、
+      峰值内存和单个写事务的最长耗时，并校验两种方式的重置结果一致
+用法：python scripts/benchmark_heart_reset.py [--users 1000000] [--chunk-size 5000] [--skip-legacy]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+QA_TEST_EMAIL = "qa-test@emoflow.internal"
+# 模拟数据中会员所占比例（每多少个用户有一个会员）
+MEMBER_EVERY = 8
+
+
+def seed_users(engine, users: int) -> None:
+    """
+    用递归 CTE 在库内批量生成模拟用户（含一个 QA 测试账号），避免 Python 侧逐行插入
+    """
+    from sqlalchemy import text
+
+    with engine.begin() as conn:
+        conn.execute(text(
+            "WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < :users) "
+            "INSERT INTO users (name, email, heart, subscription_status, auto_renew_status, subscription_environment) "
+            "SELECT 'user_' || n, CASE WHEN n % 3 = 0 THEN NULL ELSE 'user_' || n || '@example.com' END, "
+            "       n % 7, CASE WHEN n % :member_every = 0 THEN 'active' ELSE 'inactive' END, 0, 'sandbox' "
+            "FROM seq"
+        ), {"users": users - 1, "member_every": MEMBER_EVERY})
+        conn.execute(text(
+            "INSERT INTO users (name, email, heart, subscription_status, auto_renew_status, subscription_environment) "
+            "VALUES ('QA Test User', :email, 999999, 'inactive', 0, 'sandbox')"
+        ), {"email": QA_TEST_EMAIL})
+
+
+def scramble_hearts(engine) -> None:
+    """
+    把心数打乱，保证每轮测试都有实际写入
+    """
+    from sqlalchemy import text
+
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE users SET heart = id % 7 WHERE email IS NULL OR email != :email"),
+                     {"email": QA_TEST_EMAIL})
+
+
+def legacy_reset(SessionLocal, User) -> dict:
+    """
+    旧版实现：加载全部用户到 ORM，逐个修改后单次提交
+    """
+    db = SessionLocal()
+    started = time.perf_counter()
+    try:
+        users = db.query(User).all()
+        active = inactive = 0
+        for user in users:
+            if user.email == QA_TEST_EMAIL:
+                continue
+            if user.subscription_status == "active":
+                user.heart = 100
+                active += 1
+            else:
+                user.heart = 10
+                inactive += 1
+        commit_started = time.perf_counter()
+        db.commit()
+        finished = time.perf_counter()
+    finally:
+        db.close()
+    return {"total": active + inactive, "members": active, "free": inactive,
+            "chunks": 1, "max_chunk_ms": round((finished - commit_started) * 1000, 2),
+            "elapsed_ms": round((finished - started) * 1000, 2)}
+
+
+def measure(fn) -> dict:
+    """
+    执行并记录耗时与 Python 侧峰值内存
+    """
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = fn()
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result.setdefault("elapsed_ms", round(elapsed_ms, 2))
+    result["peak_mb"] = round(peak / 1024 / 1024, 1)
+    return result
+
+
+def heart_histogram(engine) -> dict:
+    from sqlalchemy import text
+
+    with engine.connect() as conn:
+        return dict(conn.execute(text("SELECT heart, count(*) FROM users GROUP BY heart")).fetchall())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="每日心数重置基准测试")
+    parser.add_argument("--users", type=int, default=1_000_000, help="模拟用户数")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="集合式重置每个写事务的主键区间长度")
+    parser.add_argument("--skip-legacy", action="store_true", help="跳过旧版实现（用户数很大时旧版会占用大量内存）")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # 数据库模块在导入时根据 DATABASE_URL 创建引擎，需要先设置环境变量
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir, 'hearts.db')}"
+        from database_models import init_db, SessionLocal, User
+        from database_models.database import engine
+        from services.heart_service import reset_all_hearts
+
+        init_db()
+        started = time.perf_counter()
+        seed_users(engine, args.users)
+        print("=" * 72)
+        print(f"📊 每日心数重置基准（{args.users} 个用户，生成耗时 {time.perf_counter() - started:.1f}s）")
+        print("=" * 72)
+        print(f"{'实现':<14}{'更新行数':>10}{'会员':>9}{'总耗时(ms)':>13}{'最长事务(ms)':>14}{'峰值内存(MB)':>14}")
+
+        results = {}
+        if not args.skip_legacy:
+            scramble_hearts(engine)
+            results["legacy orm"] = measure(lambda: legacy_reset(SessionLocal, User))
+            legacy_hearts = heart_histogram(engine)
+
+        scramble_hearts(engine)
+        results["set-based"] = measure(
+            lambda: reset_all_hearts(exclude_emails=(QA_TEST_EMAIL,), chunk_size=args.chunk_size))
+        set_based_hearts = heart_histogram(engine)
+
+        for name, r in results.items():
+            print(f"{name:<16}{r['total']:>10}{r['members']:>10}{r['elapsed_ms']:>14.1f}"
+                  f"{r['max_chunk_ms']:>14.1f}{r['peak_mb']:>14.1f}")
+        print("=" * 72)
+
+        if not args.skip_legacy and legacy_hearts != set_based_hearts:
+            print(f"❌ 两种实现的重置结果不一致: {legacy_hearts} != {set_based_hearts}")
+            sys.exit(1)
+        print(f"✅ 重置结果: {set_based_hearts}")
+
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
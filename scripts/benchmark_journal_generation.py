@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+日记生成调用次数 / token / 耗时对比
+功能：对同一段对话分别执行旧流程（正文、记忆点、标题各调用一次模型）与合并生成（一次调用输出 JSON），
+      统计模型调用次数、prompt/completion token 与端到端耗时，并报告合并生成的解析成功率
+说明：需要真实的 ARK_API_KEY（或 DOUBAO_API_KEY），会产生实际的模型调用费用
+用法：python scripts/benchmark_journal_generation.py [--rounds 5] [--history-file chat.txt]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# 未指定 --history-file 时使用的示例对话（与 StateTracker.summary 的输出格式一致）
+SAMPLE_HISTORY = """user: 今天下班路上突然下大雨，没带伞，在地铁站等了快半小时
+assistant: 被困在地铁站一定有点烦吧，后来是怎么回家的？
+user: 最后还是冒雨跑回去了，鞋子全湿了，不过到家洗了个热水澡舒服多了
+assistant: 热水澡真的很治愈，今天辛苦啦
+user: 嗯，就是有点担心明天会不会感冒，明天还要早起开会"""
+
+USAGE_COUNTERS = ("llm.doubao.calls", "llm.doubao.prompt_tokens", "llm.doubao.completion_tokens")
+
+
+def usage_snapshot() -> dict:
+    from services.metrics import metrics
+
+    counters = metrics.snapshot()["counters"]
+    return {name: counters.get(name, 0) for name in USAGE_COUNTERS}
+
+
+def run_separate(history: str) -> None:
+    """
+    旧流程：正文、记忆点、标题三次调用
+    """
+    from prompts.journal_prompts import get_journal_generation_prompt, get_journal_title_prompt
+    from memory.sync_memory_generator import _create_analysis_prompt
+    from llm.llm_factory import chat_with_doubao_llm, chat_with_llm
+
+    content = chat_with_doubao_llm(get_journal_generation_prompt(emotion="平和", chat_history=history))["answer"]
+    chat_with_llm(_create_analysis_prompt().format(journal_content=content, image_analysis=""))
+    chat_with_llm(get_journal_title_prompt(emotion="平和", journal_content=content))
+
+
+def run_combined(history: str) -> bool:
+    """
+    合并生成：一次调用输出正文、标题与记忆点
+    :return: 三个字段是否全部通过校验
+    """
+    from services.journal_generation_service import JournalGenerationService
+
+    bundle = JournalGenerationService._generate_bundle("平和", history, "")
+    return bool(bundle and bundle["title"] and bundle["memory_point"])
+
+
+def measure(fn, history: str, rounds: int) -> dict:
+    before = usage_snapshot()
+    started = time.perf_counter()
+    ok = sum(1 for _ in range(rounds) if fn(history) is not False)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    after = usage_snapshot()
+    result = {name.rsplit(".", 1)[-1]: (after[name] - before[name]) / rounds for name in USAGE_COUNTERS}
+    result["elapsed_ms"] = elapsed_ms / rounds
+    result["ok"] = ok
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="日记生成调用次数 / token / 耗时对比")
+    parser.add_argument("--rounds", type=int, default=5, help="每种流程执行的轮数")
+    parser.add_argument("--history-file", help="对话历史文本文件（默认使用内置示例对话）")
+    args = parser.parse_args()
+
+    history = SAMPLE_HISTORY
+    if args.history_file:
+        with open(args.history_file, "r", encoding="utf-8") as f:
+            history = f.read()
+
+    results = {
+        "separate": measure(run_separate, history, args.rounds),
+        "combined": measure(run_combined, history, args.rounds),
+    }
+
+    print("=" * 78)
+    print(f"📊 日记生成对比（每种流程 {args.rounds} 轮，以下为每篇日记的平均值）")
+    print("=" * 78)
+    print(f"{'流程':<12}{'调用次数':>10}{'prompt tokens':>16}{'completion tokens':>20}{'耗时(ms)':>12}{'成功':>6}")
+    for name, r in results.items():
+        print(f"{name:<14}{r['calls']:>10.1f}{r['prompt_tokens']:>16.0f}{r['completion_tokens']:>20.0f}"
+              f"{r['elapsed_ms']:>12.0f}{r['ok']:>6}")
+    print("=" * 78)
+
+    separate, combined = results["separate"], results["combined"]
+    for key, label in (("prompt_tokens", "prompt tokens"), ("completion_tokens", "completion tokens"),
+                       ("elapsed_ms", "耗时")):
+        if separate[key]:
+            print(f"✅ {label} 节省 {(1 - combined[key] / separate[key]) * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
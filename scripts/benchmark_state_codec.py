@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+会话状态编解码基准测试
+功能：在 500 条消息的模拟会话上对比旧版 JSON 与各编码方式的编码/解码耗时和存储大小
+用法：python scripts/benchmark_state_codec.py [--messages 500] [--repeat 50]
+"""
+
+import os
+import sys
+import json
+import random
+import argparse
+import timeit
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dialogue import state_codec
+from dialogue.state_tracker import StateTracker
+
+USER_SNIPPETS = [
+    "今天加班到很晚，回家路上突然觉得好累",
+    "和朋友吃了火锅，聊了很多大学时候的事",
+    "最近总是睡不好，半夜会醒好几次",
+    "老板又临时改需求了，感觉之前做的都白费了",
+    "周末去公园散步，看到好多人在放风筝",
+]
+ASSISTANT_SNIPPETS = [
+    "听起来今天真的很辛苦，回到家先让自己好好休息一下吧。",
+    "和老朋友聚一聚总是很治愈，那些回忆一定让你很开心。",
+    "睡不好确实很磨人，最近是有什么事情一直在心里放不下吗？",
+    "辛苦做的东西被推翻，换谁都会觉得沮丧，你现在感觉怎么样？",
+    "这样的周末好惬意，能感受到你当时的放松。",
+]
+
+
+def build_state(messages: int) -> StateTracker:
+    """
+    构造包含指定条数消息的模拟会话
+    """
+    rng = random.Random(42)
+    state = StateTracker()
+    for i in range(messages // 2):
+        state.update_message("user", "，".join(rng.sample(USER_SNIPPETS, rng.randint(1, 3))))
+        state.update_message("assistant", rng.choice(ASSISTANT_SNIPPETS) * rng.randint(1, 3))
+    return state
+
+
+def bench(name, encode_fn, decode_fn, repeat):
+    payload = encode_fn()
+    encode_ms = min(timeit.repeat(encode_fn, number=1, repeat=repeat)) * 1000
+    decode_ms = min(timeit.repeat(lambda: decode_fn(payload), number=1, repeat=repeat)) * 1000
+    size = len(payload.encode("utf-8")) if isinstance(payload, str) else len(payload)
+    print(f"{name:<22}{encode_ms:>12.3f}{decode_ms:>12.3f}{size:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="会话状态编解码基准测试")
+    parser.add_argument("--messages", type=int, default=500, help="模拟会话的消息条数")
+    parser.add_argument("--repeat", type=int, default=50, help="每项测试重复次数（取最快一次）")
+    args = parser.parse_args()
+
+    state = build_state(args.messages)
+    data = state.to_dict()
+
+    print("=" * 58)
+    print(f"📊 会话状态编解码基准（{len(state.history)} 条消息）")
+    print(f"   orjson: {'已安装' if state_codec.orjson else '未安装'}，msgpack: {'已安装' if state_codec.msgpack else '未安装'}")
+    print("=" * 58)
+    print(f"{'格式':<20}{'编码(ms)':>10}{'解码(ms)':>10}{'大小(字节)':>8}")
+
+    # 旧版：json.dumps(..., ensure_ascii=False) 文本
+    bench("legacy json",
+          lambda: json.dumps(data, ensure_ascii=False),
+          lambda raw: StateTracker.from_dict(json.loads(raw)),
+          args.repeat)
+
+    # 未安装 orjson 时 JSON 格式由标准库 json 编码
+    variants = [("orjson" if state_codec.orjson else "json", "json")]
+    if state_codec.msgpack is not None:
+        variants.append(("msgpack", "msgpack"))
+    for label, serializer in variants:
+        for compress in (False, True):
+            threshold = 1 if compress else 0
+            bench(f"{label}{'+zlib' if compress else ''}",
+                  lambda s=serializer, t=threshold: state_codec.encode(data, serializer=s, compress_min_bytes=t),
+                  lambda raw: StateTracker.from_bytes(raw),
+                  args.repeat)
+
+    print("=" * 58)
+
+
+if __name__ == "__main__":
+    main()
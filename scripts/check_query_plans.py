@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+热点查询执行计划检查
+功能：在临时数据库上按当前模型建表并写入模拟数据收集统计信息，对热点查询执行 EXPLAIN QUERY PLAN，
+      确认每条查询都命中预期索引、不出现全表扫描或临时排序；任一检查失败时以非零状态退出
+用法：python scripts/check_query_plans.py [--verbose]；pytest 通过 tests/test_query_plans.py 调用 run_checks
+"""
+
+import os
+import sys
+import argparse
+import tempfile
+
+from datetime import datetime
+
+from sqlalchemy import create_engine, text, tuple_
+from sqlalchemy.orm import sessionmaker
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database_models.database import Base
+from database_models import User, Journal, ChatSession, ChatMessage, Image, JournalImage
+
+
+# 模拟数据规模：用户数、每个用户的日记数、每多少篇日记有一篇带记忆点
+SEED_USERS = 20
+SEED_JOURNALS_PER_USER = 100
+SEED_MEMORY_EVERY = 10
+
+
+def seed_statistics(conn):
+    """
+    写入与线上分布相近的模拟数据并执行 ANALYZE
+    说明：没有统计信息时规划器无法区分列相同的普通索引与部分索引
+    """
+    conn.execute(text(
+        "INSERT INTO journals (user_id, content, memory_point, created_at) "
+        "VALUES (:user_id, 'seed', :memory_point, datetime('now', :offset))"
+    ), [
+        {
+            "user_id": i % SEED_USERS,
+            "memory_point": "seed" if (i // SEED_USERS) % SEED_MEMORY_EVERY == 0 else None,
+            "offset": f"-{i} minutes",
+        }
+        for i in range(SEED_USERS * SEED_JOURNALS_PER_USER)
+    ])
+    conn.execute(text("ANALYZE"))
+
+
+def build_checks(db):
+    """
+    构造需要检查的热点查询
+    :return: [(名称, 查询, 期望使用的索引名；多个索引均可接受时为元组)]
+    """
+    return [
+        ("日记列表", db.query(Journal).filter(Journal.user_id == 1)
+            .order_by(Journal.created_at.desc(), Journal.id.desc()).offset(20).limit(10),
+         "ix_journals_user_created"),
+        ("日记列表游标翻页", db.query(Journal.id, Journal.created_at).filter(
+            Journal.user_id == 1, tuple_(Journal.created_at, Journal.id) < tuple_(datetime(2024, 1, 1), 500))
+            .order_by(Journal.created_at.desc(), Journal.id.desc()).limit(11),
+         "ix_journals_user_created"),
+        # 两个 (user_id, ...) 索引都能覆盖计数，规划器选择任一个都不需要回表
+        ("日记总数", db.query(Journal.id).filter(Journal.user_id == 1),
+         ("ix_journals_user_created", "ix_journals_user_updated")),
+        ("最新记忆点", db.query(Journal).filter(Journal.user_id == 1, Journal.memory_point.isnot(None))
+            .order_by(Journal.created_at.desc()).limit(5),
+         "ix_journals_user_memory_created"),
+        ("按会话ID读取会话", db.query(ChatSession).filter(
+            ChatSession.user_id == 1, ChatSession.session_id == "s", ChatSession.is_active == True),
+         "ix_chat_sessions_user_session_active"),
+        ("历史会话列表", db.query(ChatSession.session_id, ChatSession.updated_at).filter(
+            ChatSession.user_id == 1, ChatSession.is_active == True)
+            .order_by(ChatSession.updated_at.desc()).limit(50),
+         "ix_chat_sessions_user_active_updated"),
+        ("会话消息分页", db.query(ChatMessage.seq, ChatMessage.content).filter(
+            ChatMessage.chat_session_id == 1, ChatMessage.seq < 100)
+            .order_by(ChatMessage.seq.desc()).limit(51),
+         "ix_chat_messages_session_seq"),
+        ("会话图片", db.query(Image).filter(Image.user_id == 1, Image.session_id == "s"),
+         "ix_images_user_session"),
+        ("日记列表图片", db.query(JournalImage.journal_id, Image.id, Image.user_id, Image.filename)
+            .join(Image, Image.id == JournalImage.image_id)
+            .filter(JournalImage.journal_id.in_([1, 2, 3]))
+            .order_by(JournalImage.journal_id, JournalImage.position),
+         "sqlite_autoindex_journal_images_1"),
+        ("订阅通知查找用户", db.query(User).filter(User.original_transaction_id == "t"),
+         "ix_users_original_transaction_id"),
+        ("测试登录查找用户", db.query(User).filter(User.email == "review@test.com"),
+         "ix_users_email"),
+    ]
+
+
+def explain(conn, query):
+    """
+    获取查询的执行计划
+    :return: 执行计划各步骤的描述列表
+    """
+    sql = str(query.statement.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+    return [row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")).fetchall()]
+
+
+def check_plan(plan, expected_index):
+    """
+    检查执行计划
+    :param expected_index: 期望使用的索引名，或可接受的索引名元组
+    :return: 问题描述列表，为空表示通过
+    """
+    problems = []
+    expected = (expected_index,) if isinstance(expected_index, str) else expected_index
+    if not any(index in step for step in plan for index in expected):
+        problems.append(f"未使用索引 {' / '.join(expected)}")
+    for step in plan:
+        if step.startswith("SCAN") and "INDEX" not in step:
+            problems.append(f"全表扫描: {step}")
+        if "USE TEMP B-TREE" in step:
+            problems.append(f"临时排序: {step}")
+    return problems
+
+
+def run_checks():
+    """
+    在临时数据库上检查全部热点查询
+    :return: [(名称, 执行计划, 问题描述列表)]
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp_dir, 'plans.db')}")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        try:
+            with engine.begin() as conn:
+                seed_statistics(conn)
+            with engine.connect() as conn:
+                for name, query, expected_index in build_checks(db):
+                    plan = explain(conn, query)
+                    results.append((name, plan, check_plan(plan, expected_index)))
+        finally:
+            db.close()
+            engine.dispose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="热点查询执行计划检查")
+    parser.add_argument("--verbose", action="store_true", help="输出每条查询的完整执行计划")
+    args = parser.parse_args()
+
+    failed = 0
+    for name, plan, problems in run_checks():
+        print(f"{'✅' if not problems else '❌'} {name}")
+        if problems or args.verbose:
+            for step in plan:
+                print(f"     {step}")
+        for problem in problems:
+            print(f"   ⚠️ {problem}")
+        failed += bool(problems)
+
+    if failed:
+        print(f"❌ {failed} 条查询的执行计划不符合预期")
+        sys.exit(1)
+    print("✅ 所有热点查询均命中预期索引")
+
+
+if __name__ == "__main__":
+    main()
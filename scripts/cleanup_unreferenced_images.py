@@ -11,7 +11,7 @@ import os
 import sys
 import logging
 from datetime import datetime, timezone, timedelta
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker
 
 # 添加项目根目录到Python路径
@@ -20,6 +20,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from database_models.database import Base
 from database_models.image import Image
 from database_models.journal import Journal
+from database_models.journal_image import JournalImage
 
 # 配置日志
 logging.basicConfig(
@@ -50,10 +51,15 @@ def get_referenced_image_filenames():
         return set()
     
     try:
-        # 查询所有日记中的图片ID
-        journals = db.query(Journal).filter(Journal.images.isnot(None)).all()
-        
         referenced_image_ids = set()
+        
+        # 查询日记图片关联表中的图片ID
+        if inspect(db.get_bind()).has_table(JournalImage.__tablename__):
+            rows = db.query(JournalImage.image_id).distinct().all()
+            referenced_image_ids.update(row.image_id for row in rows)
+        
+        # 兼容尚未迁移的数据库：同时读取旧版逗号分隔字段
+        journals = db.query(Journal.images).filter(Journal.images.isnot(None)).all()
         for journal in journals:
             if journal.images:
                 # 解析逗号分隔的图片ID
@@ -0,0 +1,113 @@
+# File: services/etag_service.py
+# 功能：条件请求（ETag / If-None-Match）支持
+# 实现：从数据库中按用户统计的行数、最大ID与最后更新时间（均可由索引直接得到）计算资源版本号，
+#       客户端携带的版本号未变化时直接返回 304，不再查询和组装完整响应；
+#       版本号取自数据库而非进程内计数器，后台线程与其他进程的写入同样会使其变化
+
+import hashlib
+import json
+from typing import Any, Optional
+
+from fastapi import Response
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database_models import Journal, ChatSession
+from services.metrics import metrics
+
+# 响应格式版本（接口返回字段变化时递增，使客户端已缓存的版本失效）
+ETAG_FORMAT_VERSION = 1
+# 条件请求的缓存策略：客户端可以缓存，但每次使用前都要携带 ETag 重新验证
+CONDITIONAL_CACHE_CONTROL = "private, no-cache"
+
+
+class ETagService:
+    """
+    ETag 服务
+    功能：计算各接口的资源版本号、判断 If-None-Match 是否命中
+    """
+
+    @staticmethod
+    def make(*parts: Any) -> str:
+        """
+        由版本信息生成弱 ETag（响应经压缩等转换后仍可比较）
+        """
+        raw = json.dumps([ETAG_FORMAT_VERSION, *parts], ensure_ascii=False, default=str)
+        return 'W/"' + hashlib.sha1(raw.encode("utf-8")).hexdigest()[:32] + '"'
+
+    @staticmethod
+    def matches(if_none_match: Optional[str], etag: str) -> bool:
+        """
+        判断 If-None-Match 请求头是否包含当前版本（按弱比较，忽略 W/ 前缀）
+        """
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        current = etag[2:] if etag.startswith("W/") else etag
+        for candidate in if_none_match.split(","):
+            candidate = candidate.strip()
+            if (candidate[2:] if candidate.startswith("W/") else candidate) == current:
+                return True
+        return False
+
+    def check(self, if_none_match: Optional[str], etag: str, name: str) -> Optional[Response]:
+        """
+        处理条件请求
+        :param if_none_match: 请求头 If-None-Match
+        :param etag: 当前版本号
+        :param name: 接口名称（用于指标）
+        :return: 命中时返回 304 响应，否则返回 None（调用方继续生成完整响应，成功后调用 tag）
+        """
+        if self.matches(if_none_match, etag):
+            metrics.incr(f"etag.{name}.not_modified")
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CONDITIONAL_CACHE_CONTROL})
+        metrics.incr(f"etag.{name}.full")
+        return None
+
+    @staticmethod
+    def tag(response: Response, etag: str) -> None:
+        """
+        在成功的完整响应上设置 ETag（出错的响应不设置，避免客户端缓存错误结果）
+        """
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = CONDITIONAL_CACHE_CONTROL
+
+    # ==================== 资源版本 ====================
+    @staticmethod
+    async def journal_list_version(db: AsyncSession, user_id: int) -> tuple:
+        """
+        日记列表版本：日记数、最大ID与最后更新时间（走 ix_journals_user_updated 覆盖索引）
+        说明：新建、删除、修改（包括后台补写标题与记忆点）日记都会改变结果
+        """
+        row = (await db.execute(
+            select(func.count(), func.max(Journal.id), func.max(Journal.updated_at)).where(Journal.user_id == user_id)
+        )).first()
+        return tuple(row)
+
+    @staticmethod
+    async def journal_version(db: AsyncSession, user_id: int, journal_id: int) -> Optional[tuple]:
+        """
+        单篇日记版本：最后更新时间；日记不存在时返回 None
+        """
+        row = (await db.execute(
+            select(Journal.updated_at).where(Journal.id == journal_id, Journal.user_id == user_id)
+        )).first()
+        return None if row is None else (journal_id, row.updated_at)
+
+    @staticmethod
+    async def chat_session_list_version(db: AsyncSession, user_id: int) -> tuple:
+        """
+        会话列表版本：活跃会话数与最后更新时间（走 ix_chat_sessions_user_active_updated 覆盖索引）
+        """
+        row = (await db.execute(
+            select(func.count(), func.max(ChatSession.updated_at)).where(
+                ChatSession.user_id == user_id,
+                ChatSession.is_active == True
+            )
+        )).first()
+        return tuple(row)
+
+
+# 全局 ETag 服务实例
+etag_service = ETagService()
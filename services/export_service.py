@@ -0,0 +1,514 @@
+# File: services/export_service.py
+# 功能：账户数据导出服务
+# 实现：按数据库游标分批读取日记、会话、消息与图片记录，边生成边输出 zip（不压缩、数据描述符格式），内存占用与账户大小无关；
+#       文本文件在同一个只读事务中生成，输出字节完全确定，可预先算出总长度，并据此支持 HTTP Range 断点续传；
+#       各文件的大小与 CRC 按 ETag 缓存（图片 CRC 在上传时入库），续传时区间之前的文件直接跳过，不再读取
+
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from database_models import User, Journal, ChatSession, ChatMessage, Image, JournalImage
+from database_models.chat_session_archive import ChatSessionArchive
+from database_models.database import IS_SQLITE
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 导出格式版本（格式变化时递增，使旧的 ETag 失效）；2：已归档会话的消息带有 created_at
+EXPORT_FORMAT_VERSION = 2
+# 每次从数据库游标读取的行数
+EXPORT_YIELD_PER = 500
+# 每批读取消息的会话数
+EXPORT_SESSION_BATCH = 50
+# 输出块大小（字节）
+EXPORT_CHUNK_SIZE = 64 * 1024
+# 进程内缓存最近多少次导出（按 ETag）的文件大小与 CRC
+EXPORT_CHECKSUM_CACHE_SIZE = 32
+
+# zip 格式常量
+_ZIP64_LIMIT = 0xFFFFFFFF
+_ZIP_COUNT_LIMIT = 0xFFFF
+_FLAGS = 0x0808  # bit 3：大小与 CRC 写在数据描述符中；bit 11：文件名为 UTF-8
+_DOS_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+
+def _dos_datetime(value: Optional[datetime]) -> Tuple[int, int]:
+    """
+    转换为 zip 使用的 DOS 日期与时间
+    """
+    year, month, day, hour, minute, second = (
+        (value.year, value.month, value.day, value.hour, value.minute, value.second)
+        if value and value.year >= 1980 else _DOS_EPOCH
+    )
+    return (year - 1980) << 9 | month << 5 | day, hour << 11 | minute << 5 | second // 2
+
+
+def _json_line(data: Dict[str, Any]) -> bytes:
+    return (json.dumps(data, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def _isoformat(value) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+
+# 文件大小与 CRC 缓存：{ETag: {文件名: (大小, CRC)}}；同一 ETag 下文本文件内容完全确定，图片文件不会被修改
+_checksum_cache: "OrderedDict[str, Dict[bytes, Tuple[int, int]]]" = OrderedDict()
+_checksum_lock = threading.Lock()
+
+
+def _cached_checksums(etag: str) -> Dict[bytes, Tuple[int, int]]:
+    with _checksum_lock:
+        checksums = _checksum_cache.get(etag)
+        if checksums is None:
+            return {}
+        _checksum_cache.move_to_end(etag)
+        return dict(checksums)
+
+
+def _remember_checksums(etag: str, entries: List["_Entry"]) -> None:
+    known = {entry.name: (entry.size, entry.crc) for entry in entries if entry.crc is not None}
+    if not known:
+        return
+    with _checksum_lock:
+        _checksum_cache.setdefault(etag, {}).update(known)
+        _checksum_cache.move_to_end(etag)
+        while len(_checksum_cache) > EXPORT_CHECKSUM_CACHE_SIZE:
+            _checksum_cache.popitem(last=False)
+
+
+class _Entry:
+    """
+    zip 中的一个文件：名称、修改时间与按块产出内容的函数；大小与 CRC 未知时在首次需要大小时一并计算
+    """
+
+    def __init__(self, name: str, chunks: Callable[[], Iterator[bytes]], size: Optional[int] = None,
+                 modified: Optional[datetime] = None, crc: Optional[int] = None):
+        self.name = name.encode("utf-8")
+        self.chunks = chunks
+        self._size = size
+        self.date, self.time = _dos_datetime(modified)
+        self.crc = crc  # None 表示尚未计算
+        self.offset = 0
+
+    @property
+    def size(self) -> int:
+        if self._size is None:
+            size, crc = 0, 0
+            for chunk in self.chunks():
+                size += len(chunk)
+                crc = zlib.crc32(chunk, crc)
+            self._size, self.crc = size, crc
+        return self._size
+
+    def use_checksum(self, size: int, crc: int) -> None:
+        """
+        使用已知的大小与 CRC（大小与当前文件不一致时忽略）
+        """
+        if self._size is None or self._size == size:
+            self._size, self.crc = size, crc
+
+    def local_header(self) -> bytes:
+        return struct.pack("<IHHHHHIIIHH", 0x04034B50, 20, _FLAGS, 0, self.time, self.date,
+                           0, 0, 0, len(self.name), 0) + self.name
+
+    def data_descriptor(self) -> bytes:
+        return struct.pack("<IIII", 0x08074B50, self.crc, self.size, self.size)
+
+    def central_header(self) -> bytes:
+        zip64 = self.offset >= _ZIP64_LIMIT
+        extra = struct.pack("<HHQ", 0x0001, 8, self.offset) if zip64 else b""
+        return struct.pack("<IHHHHHHIIIHHHHHII", 0x02014B50, 45 if zip64 else 20, 45 if zip64 else 20,
+                           _FLAGS, 0, self.time, self.date, self.crc, self.size, self.size,
+                           len(self.name), len(extra), 0, 0, 0, 0,
+                           _ZIP64_LIMIT if zip64 else self.offset) + self.name + extra
+
+    def local_length(self) -> int:
+        return 30 + len(self.name) + self.size + 16
+
+    def central_length(self) -> int:
+        return 46 + len(self.name) + (12 if self.offset >= _ZIP64_LIMIT else 0)
+
+
+class AccountExport:
+    """
+    单次账户导出
+    功能：在构造时开启只读事务并列出要导出的文件；total_size 预先计算总长度，iter_bytes 按字节区间输出
+    说明：同一事务内多次读取看到的是同一份快照，计算长度与实际输出的内容一致；
+         文本文件输出（或跳过）后即结束事务，输出图片期间不再持有快照，不阻塞 WAL checkpoint；调用方负责最后调用 close
+    """
+
+    def __init__(self, db: Session, user_id: int):
+        self.db = db
+        self.user_id = user_id
+        if IS_SQLITE:
+            # 延迟事务在第一次读取时建立快照，此后导出期间的写入不影响本次导出
+            db.connection().exec_driver_sql("BEGIN")
+        self.etag = self._fingerprint()
+        self.entries = self._build_entries()
+        checksums = _cached_checksums(self.etag)
+        for entry in self.entries:
+            checksum = checksums.get(entry.name)
+            if checksum is not None and entry.crc is None:
+                entry.use_checksum(*checksum)
+        self._total_size: Optional[int] = None
+
+    def close(self) -> None:
+        self.db.close()
+
+    def _release_snapshot(self) -> None:
+        """
+        结束只读事务（文本文件已全部输出或跳过，图片只读取文件）
+        """
+        if self.db.in_transaction():
+            self.db.rollback()
+
+    # ==================== 数据版本 ====================
+    def _fingerprint(self) -> str:
+        """
+        计算导出内容的版本标识（ETag）：各表的行数、最大ID与最后更新时间，任何增删改都会改变结果
+        """
+        db, user_id = self.db, self.user_id
+        rows = [
+            db.execute(select(User.name, User.email, User.birthday, User.subscription_status,
+                              User.subscription_expires_at).where(User.id == user_id)).first(),
+            db.execute(select(func.count(Journal.id), func.max(Journal.id), func.max(Journal.updated_at))
+                       .where(Journal.user_id == user_id)).first(),
+            db.execute(select(func.count(ChatSession.id), func.max(ChatSession.id), func.max(ChatSession.updated_at))
+                       .where(ChatSession.user_id == user_id)).first(),
+            db.execute(select(func.count(ChatMessage.id), func.max(ChatMessage.id))
+                       .where(ChatMessage.user_id == user_id)).first(),
+            db.execute(select(func.count(ChatSessionArchive.chat_session_id), func.max(ChatSessionArchive.archived_at))
+                       .where(ChatSessionArchive.user_id == user_id)).first(),
+            db.execute(select(func.count(Image.id), func.max(Image.id), func.max(Image.updated_at))
+                       .where(Image.user_id == user_id)).first(),
+        ]
+        raw = json.dumps([EXPORT_FORMAT_VERSION] + [list(row) if row is not None else None for row in rows], default=str)
+        return '"export-' + hashlib.sha1(raw.encode("utf-8")).hexdigest() + '"'
+
+    # ==================== 文件列表 ====================
+    def _build_entries(self) -> List[_Entry]:
+        entries = [
+            _Entry("profile.json", self._profile_chunks),
+            _Entry("journals.ndjson", lambda: self._batched(self._journal_lines())),
+            _Entry("chat_sessions.ndjson", lambda: self._batched(self._session_lines())),
+            _Entry("chat_messages.ndjson", lambda: self._batched(self._message_lines())),
+            _Entry("images.ndjson", lambda: self._batched(self._image_lines())),
+        ]
+        self._text_count = len(entries)
+        # 图片文件：大小取自文件系统、CRC 取自上传时的记录，内容在输出时才读取；文件已丢失的图片只保留 images.ndjson 中的记录
+        for image_id, filename, file_path, file_crc32, created_at in self.db.execute(
+            select(Image.id, Image.filename, Image.file_path, Image.file_crc32, Image.created_at)
+            .where(Image.user_id == self.user_id).order_by(Image.id)
+        ).yield_per(EXPORT_YIELD_PER):
+            try:
+                size = os.path.getsize(file_path)
+            except OSError:
+                continue
+            entries.append(_Entry(f"images/{filename}", self._file_chunks(file_path), size=size, modified=created_at,
+                                  crc=file_crc32))
+        return entries
+
+    @staticmethod
+    def _batched(lines: Iterator[bytes]) -> Iterator[bytes]:
+        """
+        把逐行输出合并为约 EXPORT_CHUNK_SIZE 大小的块
+        """
+        buffer, size = [], 0
+        for line in lines:
+            buffer.append(line)
+            size += len(line)
+            if size >= EXPORT_CHUNK_SIZE:
+                yield b"".join(buffer)
+                buffer, size = [], 0
+        if buffer:
+            yield b"".join(buffer)
+
+    @staticmethod
+    def _file_chunks(file_path: str) -> Callable[[], Iterator[bytes]]:
+        def chunks() -> Iterator[bytes]:
+            with open(file_path, "rb") as f:
+                while True:
+                    chunk = f.read(EXPORT_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    yield chunk
+        return chunks
+
+    def _profile_chunks(self) -> Iterator[bytes]:
+        user = self.db.execute(
+            select(User.id, User.name, User.email, User.birthday, User.subscription_status,
+                   User.subscription_expires_at).where(User.id == self.user_id)
+        ).first()
+        yield json.dumps({
+            "user_id": user.id,
+            "name": user.name,
+            "email": user.email,
+            "birthday": _isoformat(user.birthday),
+            "subscription_status": user.subscription_status,
+            "subscription_expires_at": _isoformat(user.subscription_expires_at),
+            "format_version": EXPORT_FORMAT_VERSION,
+        }, ensure_ascii=False, indent=2).encode("utf-8")
+
+    def _journal_lines(self) -> Iterator[bytes]:
+        """
+        日记按 id 顺序输出；日记图片按 (journal_id, position) 顺序另开一个游标，与日记流归并，不逐篇查询
+        """
+        image_rows = iter(self.db.execute(
+            select(JournalImage.journal_id, Image.filename)
+            .join(Journal, Journal.id == JournalImage.journal_id)
+            .join(Image, Image.id == JournalImage.image_id)
+            .where(Journal.user_id == self.user_id)
+            .order_by(JournalImage.journal_id, JournalImage.position)
+        ).yield_per(EXPORT_YIELD_PER))
+        pending = next(image_rows, None)
+
+        for journal in self.db.execute(
+            select(Journal.id, Journal.title, Journal.content, Journal.emotion, Journal.memory_point,
+                   Journal.session_id, Journal.created_at, Journal.updated_at)
+            .where(Journal.user_id == self.user_id).order_by(Journal.id)
+        ).yield_per(EXPORT_YIELD_PER):
+            images = []
+            while pending is not None and pending.journal_id <= journal.id:
+                if pending.journal_id == journal.id:
+                    images.append(f"images/{pending.filename}")
+                pending = next(image_rows, None)
+            yield _json_line({
+                "journal_id": journal.id,
+                "title": journal.title,
+                "content": journal.content,
+                "emotion": journal.emotion,
+                "memory_point": journal.memory_point,
+                "session_id": journal.session_id,
+                "images": images,
+                "created_at": _isoformat(journal.created_at),
+                "updated_at": _isoformat(journal.updated_at),
+            })
+
+    def _session_lines(self) -> Iterator[bytes]:
+        for chat_session in self.db.execute(
+            select(ChatSession.session_id, ChatSession.message_count, ChatSession.is_active,
+                   ChatSession.created_at, ChatSession.updated_at)
+            .where(ChatSession.user_id == self.user_id).order_by(ChatSession.id)
+        ).yield_per(EXPORT_YIELD_PER):
+            yield _json_line({
+                "session_id": chat_session.session_id,
+                "message_count": chat_session.message_count,
+                "is_active": chat_session.is_active,
+                "created_at": _isoformat(chat_session.created_at),
+                "updated_at": _isoformat(chat_session.updated_at),
+            })
+
+    def _message_lines(self) -> Iterator[bytes]:
+        """
+        按会话分批输出消息：未归档会话从 chat_messages 按 (会话, 序号) 索引顺序读取，已归档会话逐个解压归档
+        """
+        from dialogue.session_archive import session_archiver
+
+        sessions = self.db.execute(
+            select(ChatSession.id, ChatSession.session_id, ChatSession.is_archived)
+            .where(ChatSession.user_id == self.user_id).order_by(ChatSession.id)
+        ).yield_per(EXPORT_SESSION_BATCH)
+        for batch in sessions.partitions():
+            session_ids = {row.id: row.session_id for row in batch}
+            live_ids = [row.id for row in batch if not row.is_archived]
+            archived_ids = [row.id for row in batch if row.is_archived]
+
+            if live_ids:
+                for message in self.db.execute(
+                    select(ChatMessage.chat_session_id, ChatMessage.seq, ChatMessage.role, ChatMessage.content,
+                           ChatMessage.created_at)
+                    .where(ChatMessage.chat_session_id.in_(live_ids))
+                    .order_by(ChatMessage.chat_session_id, ChatMessage.seq)
+                ).yield_per(EXPORT_YIELD_PER):
+                    yield _json_line({
+                        "session_id": session_ids[message.chat_session_id],
+                        "seq": message.seq,
+                        "role": message.role,
+                        "content": message.content,
+                        "created_at": _isoformat(message.created_at),
+                    })
+
+            for chat_session_id in archived_ids:
+                archive = self.db.get(ChatSessionArchive, chat_session_id)
+                if archive is None:
+                    continue
+                for seq, role, content, created_at in session_archiver.read_messages(archive):
+                    yield _json_line({
+                        "session_id": session_ids[chat_session_id],
+                        "seq": seq,
+                        "role": role,
+                        "content": content,
+                        "created_at": _isoformat(created_at),
+                    })
+                self.db.expunge(archive)
+
+    def _image_lines(self) -> Iterator[bytes]:
+        for image in self.db.execute(
+            select(Image.id, Image.filename, Image.mime_type, Image.width, Image.height, Image.session_id,
+                   Image.analysis_result, Image.created_at)
+            .where(Image.user_id == self.user_id).order_by(Image.id)
+        ).yield_per(EXPORT_YIELD_PER):
+            yield _json_line({
+                "image_id": image.id,
+                "file": f"images/{image.filename}",
+                "mime_type": image.mime_type,
+                "width": image.width,
+                "height": image.height,
+                "session_id": image.session_id,
+                "analysis_result": image.analysis_result,
+                "created_at": _isoformat(image.created_at),
+            })
+
+    # ==================== zip 输出 ====================
+    def _layout(self) -> Tuple[int, int, bool]:
+        """
+        计算各文件的偏移量
+        :return: (中央目录偏移量, 中央目录长度, 是否需要 zip64 结束记录)
+        """
+        offset = 0
+        for entry in self.entries:
+            entry.offset = offset
+            offset += entry.local_length()
+        central_size = sum(entry.central_length() for entry in self.entries)
+        zip64 = (offset >= _ZIP64_LIMIT or central_size >= _ZIP64_LIMIT
+                 or len(self.entries) >= _ZIP_COUNT_LIMIT)
+        return offset, central_size, zip64
+
+    @property
+    def total_size(self) -> int:
+        """
+        导出文件的总字节数（文本文件需要完整读取一遍数据库计算大小，图片只读取文件大小）
+        """
+        if self._total_size is None:
+            central_offset, central_size, zip64 = self._layout()
+            self._total_size = central_offset + central_size + (56 + 20 if zip64 else 0) + 22
+            _remember_checksums(self.etag, self.entries[:self._text_count])
+        return self._total_size
+
+    def _end_records(self, central_offset: int, central_size: int, zip64: bool) -> bytes:
+        count = len(self.entries)
+        records = b""
+        if zip64:
+            zip64_offset = central_offset + central_size
+            records += struct.pack("<IQHHIIQQQQ", 0x06064B50, 44, 45, 45, 0, 0,
+                                   count, count, central_size, central_offset)
+            records += struct.pack("<IIQI", 0x07064B50, 0, zip64_offset, 1)
+        records += struct.pack("<IHHHHIIH", 0x06054B50, 0, 0,
+                               min(count, _ZIP_COUNT_LIMIT), min(count, _ZIP_COUNT_LIMIT),
+                               min(central_size, _ZIP64_LIMIT), min(central_offset, _ZIP64_LIMIT), 0)
+        return records
+
+    def iter_bytes(self, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """
+        输出 [start, end] 区间（含两端）的字节
+        说明：区间之前的文件 CRC 已知时直接跳过，未知时（早期上传的图片且未缓存）仍需读取以计算 CRC（写入中央目录）；
+             到达 end 后立即停止；已算出的 CRC 在结束或中断时写入缓存，供下次续传使用
+        """
+        end = self.total_size - 1 if end is None else end
+        central_offset, central_size, zip64 = self._layout()
+        try:
+            yield from self._iter_range(start, end, central_offset, central_size, zip64)
+        finally:
+            _remember_checksums(self.etag, self.entries)
+
+    def _iter_range(self, start: int, end: int, central_offset: int, central_size: int, zip64: bool) -> Iterator[bytes]:
+        position = 0
+        skipped = 0
+
+        def window(data: bytes) -> bytes:
+            nonlocal position
+            chunk_start, position = position, position + len(data)
+            if position <= start or chunk_start > end:
+                return b""
+            return data[max(start - chunk_start, 0):end + 1 - chunk_start]
+
+        for index, entry in enumerate(self.entries):
+            if index == self._text_count:
+                self._release_snapshot()
+            entry_end = entry.offset + entry.local_length()
+            if entry_end <= start and entry.crc is not None:
+                position = entry_end
+                skipped += entry.size
+                continue
+            piece = window(entry.local_header())
+            if piece:
+                yield piece
+            crc, written = 0, 0
+            for chunk in entry.chunks():
+                crc = zlib.crc32(chunk, crc)
+                written += len(chunk)
+                piece = window(chunk)
+                if piece:
+                    yield piece
+            if written != entry.size:
+                # 文件在导出期间被修改或删除，已输出的偏移量无法再保证一致
+                raise RuntimeError(f"导出文件 {entry.name.decode('utf-8')} 大小变化: {entry.size} -> {written}")
+            entry.crc = crc
+            piece = window(entry.data_descriptor())
+            if piece:
+                yield piece
+            if position > end:
+                return
+        self._release_snapshot()
+        if skipped:
+            metrics.incr("export.resume_skipped_bytes", skipped)
+
+        central = b"".join(entry.central_header() for entry in self.entries)
+        piece = window(central + self._end_records(central_offset, central_size, zip64))
+        if piece:
+            yield piece
+        metrics.incr("export.completed")
+
+
+class ExportService:
+    """
+    账户数据导出服务
+    功能：创建导出、解析 Range 请求头
+    """
+
+    @staticmethod
+    def open(db: Session, user_id: int) -> AccountExport:
+        """
+        开始一次导出（在 db 上开启只读事务，导出结束后由调用方 close）
+        """
+        metrics.incr("export.started")
+        return AccountExport(db, user_id)
+
+    @staticmethod
+    def parse_range(header: Optional[str], total_size: int) -> Optional[Tuple[int, int]]:
+        """
+        解析单区间 Range 请求头（bytes=start-end / bytes=start- / bytes=-suffix）
+        :return: (start, end)；未提供、格式不支持或多区间时返回 None（按完整内容响应）
+        :raises ValueError: 区间超出内容范围（应返回 416）
+        """
+        if not header or not header.startswith("bytes=") or "," in header:
+            return None
+        first, _, last = header[len("bytes="):].strip().partition("-")
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else total_size - 1
+            else:
+                start, end = max(total_size - int(last), 0), total_size - 1
+        except ValueError:
+            return None
+        if start > end and first and last:
+            return None
+        if start >= total_size:
+            raise ValueError("Range 超出内容范围")
+        return start, min(end, total_size - 1)
+
+
+# 全局导出服务实例
+export_service = ExportService()
@@ -0,0 +1,152 @@
+# File: services/heart_service.py
+# 功能：用户心数（每日额度）服务
+# 实现：按需重置——users.heart_reset_date 记录心数最后一次按日重置的日期，读取时若不是今天则按订阅状态视为当日额度，
+#       扣减时在同一条条件 UPDATE 中完成重置与扣减；另保留分块集合式 UPDATE 的全量重置，供手动脚本使用
+
+import logging
+import os
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import and_, case, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from database_models import User, SessionLocal, write_session
+
+logger = logging.getLogger(__name__)
+
+# 会员与普通用户每日重置后的心数
+MEMBER_DAILY_HEART = 100
+FREE_DAILY_HEART = 10
+
+# 每日额度按北京时间自然日重置
+HEART_RESET_TZ = timezone(timedelta(hours=8))
+
+# QA 测试账号不参与每日重置（与 main.py 读取同一环境变量）
+QA_TEST_EMAIL = os.getenv("QA_TEST_EMAIL", "qa-test@emoflow.internal")
+
+# 每个写事务更新的主键区间长度；越小写锁持有时间越短，聊天扣减等写入越不容易被阻塞
+HEART_RESET_CHUNK_SIZE = int(os.getenv("HEART_RESET_CHUNK_SIZE", "5000"))
+
+
+def heart_today() -> date:
+    """
+    当前的额度日期（北京时间）
+    """
+    return datetime.now(HEART_RESET_TZ).date()
+
+
+def daily_heart(subscription_status: Optional[str]) -> int:
+    """
+    按订阅状态返回当日额度
+    """
+    return MEMBER_DAILY_HEART if subscription_status == "active" else FREE_DAILY_HEART
+
+
+def effective_heart(heart: int, subscription_status: Optional[str], heart_reset_date: Optional[date],
+                    email: Optional[str] = None) -> int:
+    """
+    计算用户当前实际可用的心数（今天尚未重置过的用户视为当日额度，不写库）
+    :param heart: 数据库中存储的心数
+    :param subscription_status: 订阅状态
+    :param heart_reset_date: 心数最后一次按日重置的日期
+    :param email: 用户邮箱，QA 测试账号不参与重置
+    """
+    if email == QA_TEST_EMAIL or heart_reset_date == heart_today():
+        return heart
+    return daily_heart(subscription_status)
+
+
+def set_heart(user: User, heart: int) -> None:
+    """
+    直接设置用户心数（充值、订阅生效、手动修改等），并记为今天已重置，避免当天再被按日重置覆盖
+    """
+    user.heart = heart
+    user.heart_reset_date = heart_today()
+
+
+def consume_heart(db: Session, user_id: int, amount: int = 1) -> bool:
+    """
+    扣减心数：一条条件 UPDATE 内完成“今天首次访问先重置为当日额度”与扣减，多进程并发下同样正确
+    :param db: 数据库会话（调用方负责事务，通常为 write_session）
+    :param user_id: 用户ID
+    :param amount: 扣减数量
+    :return: 是否扣减成功；心数不足或用户不存在时返回 False
+    """
+    today = heart_today()
+    current = case(
+        (User.heart_reset_date == today, User.heart),
+        else_=case((User.subscription_status == "active", MEMBER_DAILY_HEART), else_=FREE_DAILY_HEART),
+    )
+    result = db.execute(
+        update(User)
+        .where(User.id == user_id, current >= amount)
+        .values(heart=current - amount, heart_reset_date=today),
+        execution_options={"synchronize_session": False},
+    )
+    return result.rowcount == 1
+
+
+def _reset_condition(lo: int, hi: int, exclude_emails: Iterable[str]):
+    """
+    构造分块重置的过滤条件：主键落在 [lo, hi) 且不属于排除的账号
+    说明：email 为 NULL 时 NOT IN 的结果也是 NULL，需要单独放行
+    """
+    condition = and_(User.id >= lo, User.id < hi)
+    exclude_emails = list(exclude_emails)
+    if exclude_emails:
+        condition = and_(condition, or_(User.email.is_(None), User.email.notin_(exclude_emails)))
+    return condition
+
+
+def reset_all_hearts(exclude_emails: Iterable[str] = (), chunk_size: int = HEART_RESET_CHUNK_SIZE) -> Dict[str, float]:
+    """
+    立即重置所有用户的心数：会员重置为 MEMBER_DAILY_HEART，其余用户重置为 FREE_DAILY_HEART
+    说明：日常由 consume_heart / effective_heart 按需重置，这里仅供手动补偿等场景使用
+    :param exclude_emails: 不参与重置的账号邮箱（如 QA 测试账号）
+    :param chunk_size: 每个写事务覆盖的主键区间长度
+    :return: 统计信息（total 实际更新行数、members 会员数、free 普通用户数、chunks 事务数、max_chunk_ms 单个事务最长耗时）
+    """
+    exclude_emails = list(exclude_emails)
+    db = SessionLocal()
+    try:
+        min_id, max_id = db.execute(select(func.min(User.id), func.max(User.id))).one()
+    finally:
+        db.close()
+
+    stats = {"total": 0, "members": 0, "free": 0, "chunks": 0, "max_chunk_ms": 0.0}
+    if min_id is None:
+        return stats
+
+    heart_value = case(
+        (User.subscription_status == "active", MEMBER_DAILY_HEART),
+        else_=FREE_DAILY_HEART,
+    )
+    today = heart_today()
+    for lo in range(min_id, max_id + 1, chunk_size):
+        condition = _reset_condition(lo, lo + chunk_size, exclude_emails)
+        started = time.perf_counter()
+        with write_session() as db:
+            updated = db.execute(
+                update(User).where(condition).values(heart=heart_value, heart_reset_date=today),
+                execution_options={"synchronize_session": False},
+            ).rowcount
+            members = db.execute(
+                select(func.count()).select_from(User).where(condition, User.subscription_status == "active")
+            ).scalar()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        stats["total"] += updated
+        stats["members"] += members
+        stats["chunks"] += 1
+        stats["max_chunk_ms"] = max(stats["max_chunk_ms"], elapsed_ms)
+
+    stats["free"] = stats["total"] - stats["members"]
+    stats["max_chunk_ms"] = round(stats["max_chunk_ms"], 2)
+    from services.user_cache import user_cache
+    user_cache.invalidate_all()
+    logger.info(f"✅ 已重置 {stats['total']} 个用户: {stats['members']}个会员重置为{MEMBER_DAILY_HEART}, "
+                f"{stats['free']}个普通用户重置为{FREE_DAILY_HEART}（{stats['chunks']} 个事务，"
+                f"单个事务最长 {stats['max_chunk_ms']}ms）")
+    return stats
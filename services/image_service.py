@@ -5,18 +5,28 @@
 import os
 import uuid
 import json
+import shutil
 import logging
-from typing import Dict, Any, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Iterable, List, Optional, Tuple
 from PIL import Image
 import io
 import base64
+import zlib
 from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from database_models import Image as ImageModel
+from database_models import Image as ImageModel, JournalImage
 from llm.qwen_vl_analyzer import qwen_vl_analyzer
 
 logger = logging.getLogger(__name__)
 
+# 图片并行处理线程数（所有请求共享，限制同时进行的图片分析调用数）
+IMAGE_INGEST_WORKERS = int(os.getenv("IMAGE_INGEST_WORKERS", "4"))
+# 单次请求最多处理的图片数，超出部分记为失败
+MAX_IMAGES_PER_REQUEST = int(os.getenv("MAX_IMAGES_PER_REQUEST", "9"))
+
 class ImageService:
     """
     图片处理服务
@@ -25,11 +35,17 @@ class ImageService:
     
     def __init__(self):
         self.upload_dir = "uploads/images"
+        self.trash_dir = "uploads/.trash"  # 待后台删除的目录，放在图片目录之外，避免被图片清理任务扫描
         self.max_file_size = 5 * 1024 * 1024  # 5MB
         self.allowed_types = ["image/jpeg", "image/png", "image/gif", "image/webp"]
         
         # 确保上传目录存在
         os.makedirs(self.upload_dir, exist_ok=True)
+        
+        # 后台文件删除线程（单线程，避免大量删除同时占用磁盘 IO）
+        self._file_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="file-cleanup")
+        # 多图上传的并行处理线程（解码、校验、写盘与图片分析）
+        self._ingest_executor = ThreadPoolExecutor(max_workers=IMAGE_INGEST_WORKERS, thread_name_prefix="image-ingest")
     
     def save_image(self, image_data: bytes, user_id: int, session_id: str, 
                    original_filename: str = "image.jpg") -> Dict[str, Any]:
@@ -42,50 +58,12 @@ class ImageService:
         :return: 保存结果
         """
         try:
-            # 验证图片
-            self._validate_image(image_data)
-            
-            # 生成文件名和路径
-            file_id = str(uuid.uuid4())
-            file_extension = self._get_file_extension(original_filename)
-            filename = f"{file_id}{file_extension}"
-            file_path = os.path.join(self.upload_dir, f"user_{user_id}", filename)
-            
-            # 确保用户目录存在
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            
-            # 保存图片
-            with open(file_path, 'wb') as f:
-                f.write(image_data)
-            
-            # 获取图片信息
-            image_info = self._get_image_info(image_data)
+            stored = self._store_file(image_data, user_id, original_filename)
             
             # 分析图片
             analysis_result = qwen_vl_analyzer.analyze_image(image_data)
             
-            # 保存到数据库
-            image_record = self._save_to_database(
-                user_id=user_id,
-                session_id=session_id,
-                filename=filename,
-                file_path=file_path,
-                file_size=len(image_data),
-                mime_type=image_info['mime_type'],
-                width=image_info['width'],
-                height=image_info['height'],
-                analysis_result=analysis_result
-            )
-            
-            logger.info(f"✅ 图片保存成功: {image_record.id}")
-            
-            return {
-                "success": True,
-                "image_id": image_record.id,
-                "filename": filename,
-                "file_path": file_path,
-                "analysis": analysis_result
-            }
+            return self._save_record(stored, user_id, session_id, analysis_result)
             
         except Exception as e:
             logger.error(f"❌ 图片保存失败: {e}")
@@ -94,6 +72,145 @@ class ImageService:
                 "error": str(e)
             }
     
+    def _store_file(self, image_data: bytes, user_id: int, original_filename: str) -> Dict[str, Any]:
+        """
+        验证图片并写入磁盘
+        :return: {"filename", "file_path", "file_size", "file_crc32", "info", "data"}
+        """
+        # 验证图片
+        self._validate_image(image_data)
+        
+        # 生成文件名和路径
+        file_id = str(uuid.uuid4())
+        file_extension = self._get_file_extension(original_filename)
+        filename = f"{file_id}{file_extension}"
+        file_path = os.path.join(self.upload_dir, f"user_{user_id}", filename)
+        
+        # 确保用户目录存在
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        
+        # 保存图片
+        with open(file_path, 'wb') as f:
+            f.write(image_data)
+        
+        # 获取图片信息
+        return {
+            "filename": filename,
+            "file_path": file_path,
+            "file_size": len(image_data),
+            "file_crc32": zlib.crc32(image_data),
+            "info": self._get_image_info(image_data),
+            "data": image_data,
+        }
+    
+    def _save_record(self, stored: Dict[str, Any], user_id: int, session_id: str,
+                     analysis_result: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        保存图片记录到数据库，返回与 save_image 相同格式的结果
+        """
+        image_id = self._save_to_database(
+            user_id=user_id,
+            session_id=session_id,
+            filename=stored["filename"],
+            file_path=stored["file_path"],
+            file_size=stored["file_size"],
+            file_crc32=stored["file_crc32"],
+            mime_type=stored["info"]['mime_type'],
+            width=stored["info"]['width'],
+            height=stored["info"]['height'],
+            analysis_result=analysis_result
+        )
+        
+        logger.info(f"✅ 图片保存成功: {image_id}")
+        
+        return {
+            "success": True,
+            "image_id": image_id,
+            "filename": stored["filename"],
+            "file_path": stored["file_path"],
+            "analysis": analysis_result
+        }
+    
+    @staticmethod
+    def decode_base64_image(image_data_b64: str) -> bytes:
+        """
+        解码 Base64 图片数据（兼容带 data:image/...;base64, 前缀的格式）
+        """
+        return base64.b64decode(image_data_b64.split(',')[1] if ',' in image_data_b64 else image_data_b64)
+    
+    def _prepare_one(self, image_data_b64: str, user_id: int, original_filename: str) -> Dict[str, Any]:
+        """
+        解码、验证并写盘单张图片（在并行处理线程中执行）
+        """
+        try:
+            image_data = self.decode_base64_image(image_data_b64)
+        except Exception as e:
+            raise ValueError(f"图片数据解码失败: {e}")
+        return self._store_file(image_data, user_id, original_filename)
+    
+    def save_images(self, images_b64: List[str], user_id: int, session_id: str,
+                    filename_prefix: str = "image") -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        并行保存并分析多张图片
+        :param images_b64: Base64 编码的图片数据列表
+        :param user_id: 用户ID
+        :param session_id: 会话ID
+        :param filename_prefix: 原始文件名前缀（文件名为 {prefix}_{序号}.jpg）
+        :return: (成功的图片，按上传顺序排列的 save_image 结果, 失败的图片 [{"index": 上传序号, "error": 原因}])
+        说明：
+            1. 解码、验证与写盘并行执行
+            2. 有效图片按 VL_BATCH_SIZE 分批，每批一次请求批量分析，各批之间并行（批量失败时逐张分析）
+            3. 按上传顺序写入图片记录
+            并发数由共享线程池限制；单次最多处理 MAX_IMAGES_PER_REQUEST 张，超出部分直接记为失败
+        """
+        from llm.qwen_vl_analyzer import VL_BATCH_SIZE
+        
+        accepted = images_b64[:MAX_IMAGES_PER_REQUEST]
+        failed: List[Dict[str, Any]] = []
+        
+        # 1. 解码、验证与写盘
+        prepare_futures = [
+            self._ingest_executor.submit(self._prepare_one, image_data_b64, user_id, f"{filename_prefix}_{index + 1}.jpg")
+            for index, image_data_b64 in enumerate(accepted)
+        ]
+        prepared: List[Tuple[int, Dict[str, Any]]] = []
+        for index, future in enumerate(prepare_futures):
+            try:
+                prepared.append((index, future.result()))
+            except Exception as e:
+                failed.append({"index": index, "error": str(e)})
+        
+        # 2. 分批分析
+        batches = [prepared[start:start + VL_BATCH_SIZE] for start in range(0, len(prepared), VL_BATCH_SIZE)]
+        analysis_futures = [
+            self._ingest_executor.submit(qwen_vl_analyzer.analyze_images, [stored["data"] for _, stored in batch])
+            for batch in batches
+        ]
+        
+        # 3. 按顺序写入图片记录
+        saved: List[Dict[str, Any]] = []
+        for batch, future in zip(batches, analysis_futures):
+            try:
+                analyses = future.result()
+            except Exception as e:
+                logger.error(f"❌ 图片分析异常: {e}")
+                analyses = [{"summary": "图片分析失败，无法识别内容", "emotion": "未知", "objects": [],
+                             "scene": "未知", "mood": "未知", "error": str(e)}] * len(batch)
+            for (index, stored), analysis_result in zip(batch, analyses):
+                try:
+                    saved.append(self._save_record(stored, user_id, session_id, analysis_result))
+                except Exception as e:
+                    logger.error(f"❌ 图片保存失败: {e}")
+                    failed.append({"index": index, "error": str(e)})
+        
+        for index in range(len(accepted), len(images_b64)):
+            failed.append({"index": index, "error": f"单次最多上传 {MAX_IMAGES_PER_REQUEST} 张图片"})
+        failed.sort(key=lambda item: item["index"])
+        
+        if failed:
+            logger.warning(f"⚠️ 多图处理部分失败: user_id={user_id}, 成功 {len(saved)} 张, 失败 {failed}")
+        return saved, failed
+    
     def _validate_image(self, image_data: bytes) -> None:
         """
         验证图片数据
@@ -139,38 +256,30 @@ class ImageService:
     
     def _save_to_database(self, user_id: int, session_id: str, filename: str, 
                          file_path: str, file_size: int, mime_type: str, 
-                         width: int, height: int, analysis_result: Dict[str, Any]) -> ImageModel:
+                         width: int, height: int, analysis_result: Dict[str, Any],
+                         file_crc32: Optional[int] = None) -> int:
         """
-        保存图片记录到数据库
+        保存图片记录到数据库（多张图片并行保存时经写锁排队）
+        :return: 图片ID
         """
-        from database_models import SessionLocal
-        import json
+        from database_models import write_session
         
-        db: Session = SessionLocal()
-        try:
+        with write_session() as db:
             image_record = ImageModel(
                 user_id=user_id,
                 session_id=session_id,
                 filename=filename,
                 file_path=file_path,
                 file_size=file_size,
+                file_crc32=file_crc32,
                 mime_type=mime_type,
                 width=width,
                 height=height,
                 analysis_result=json.dumps(analysis_result, ensure_ascii=False)
             )
-            
             db.add(image_record)
-            db.commit()
-            db.refresh(image_record)
-            
-            return image_record
-            
-        except Exception as e:
-            db.rollback()
-            raise e
-        finally:
-            db.close()
+            db.flush()
+            return image_record.id
     
     def get_image_analysis(self, image_id: int, user_id: int) -> Optional[Dict[str, Any]]:
         """
@@ -225,6 +334,154 @@ class ImageService:
             return False
         finally:
             db.close()
+    
+    @staticmethod
+    def image_url(user_id: int, filename: str) -> str:
+        """
+        生成图片访问URL
+        """
+        return f"/api/images/user_{user_id}/{filename}"
+    
+    @staticmethod
+    def _journal_images_statement(journal_ids: List[int]):
+        """
+        构造批量查询日记图片的语句（同步与异步查询共用）
+        """
+        return select(
+            JournalImage.journal_id,
+            ImageModel.id,
+            ImageModel.user_id,
+            ImageModel.filename,
+        ).join(ImageModel, ImageModel.id == JournalImage.image_id).where(
+            JournalImage.journal_id.in_(journal_ids)
+        ).order_by(JournalImage.journal_id, JournalImage.position)
+    
+    def _group_journal_images(self, rows) -> Dict[int, List[Dict[str, Any]]]:
+        """
+        按日记ID分组图片查询结果
+        """
+        result: Dict[int, List[Dict[str, Any]]] = {}
+        for row in rows:
+            result.setdefault(row.journal_id, []).append({
+                "image_id": row.id,
+                "url": self.image_url(row.user_id, row.filename),
+            })
+        return result
+    
+    def get_journal_images(self, db: Session, journal_ids: Iterable[int]) -> Dict[int, List[Dict[str, Any]]]:
+        """
+        批量获取多篇日记关联的图片（一次 JOIN 查询）
+        :param db: 数据库会话
+        :param journal_ids: 日记ID列表
+        :return: {日记ID: [{"image_id", "url"}]}，按图片顺序排列；没有图片的日记不出现在结果中
+        """
+        journal_ids = list(journal_ids)
+        if not journal_ids:
+            return {}
+        return self._group_journal_images(db.execute(self._journal_images_statement(journal_ids)).all())
+    
+    async def get_journal_images_async(self, db: AsyncSession, journal_ids: Iterable[int]) -> Dict[int, List[Dict[str, Any]]]:
+        """
+        批量获取多篇日记关联的图片（异步版本，供 async 接口使用）
+        :param db: 异步数据库会话
+        :param journal_ids: 日记ID列表
+        :return: 同 get_journal_images
+        """
+        journal_ids = list(journal_ids)
+        if not journal_ids:
+            return {}
+        return self._group_journal_images((await db.execute(self._journal_images_statement(journal_ids))).all())
+    
+    def set_journal_images(self, db: Session, journal_id: int, image_ids: Iterable[int]) -> None:
+        """
+        设置日记关联的图片（覆盖原有关联，不提交事务）
+        :param db: 数据库会话
+        :param journal_id: 日记ID
+        :param image_ids: 按顺序排列的图片ID列表
+        """
+        db.query(JournalImage).filter(JournalImage.journal_id == journal_id).delete(synchronize_session=False)
+        unique_ids = list(dict.fromkeys(int(image_id) for image_id in image_ids))
+        db.add_all([
+            JournalImage(journal_id=journal_id, image_id=image_id, position=position)
+            for position, image_id in enumerate(unique_ids)
+        ])
+    
+    def delete_images(self, db: Session, image_ids: Iterable[int]) -> int:
+        """
+        删除图片文件、图片记录及其日记关联（不提交事务）
+        :param db: 数据库会话
+        :param image_ids: 图片ID列表
+        :return: 删除的图片记录数
+        """
+        image_ids = list(image_ids)
+        if not image_ids:
+            return 0
+        
+        images = db.query(ImageModel.id, ImageModel.file_path).filter(ImageModel.id.in_(image_ids)).all()
+        for image in images:
+            try:
+                if os.path.exists(image.file_path):
+                    os.remove(image.file_path)
+            except Exception as e:
+                logger.warning(f"⚠️ 删除图片文件失败: {image.file_path}, {e}")
+        
+        db.query(JournalImage).filter(JournalImage.image_id.in_(image_ids)).delete(synchronize_session=False)
+        return db.query(ImageModel).filter(ImageModel.id.in_(image_ids)).delete(synchronize_session=False)
+
+    def remove_user_files(self, user_id: int) -> bool:
+        """
+        删除用户的图片目录：先原子重命名到回收目录（立即生效），再由后台线程递归删除
+        :param user_id: 用户ID
+        :return: 是否存在需要删除的目录
+        """
+        user_dir = os.path.join(self.upload_dir, f"user_{user_id}")
+        if not os.path.isdir(user_dir):
+            return False
+        
+        os.makedirs(self.trash_dir, exist_ok=True)
+        trash_path = os.path.join(self.trash_dir, f"user_{user_id}_{uuid.uuid4().hex}")
+        os.rename(user_dir, trash_path)
+        self._submit_removal(trash_path)
+        return True
+    
+    def purge_trash(self) -> int:
+        """
+        删除回收目录中遗留的目录（进程在后台删除完成前退出时产生，启动时调用）
+        :return: 提交删除的目录数
+        """
+        if not os.path.isdir(self.trash_dir):
+            return 0
+        entries = [os.path.join(self.trash_dir, name) for name in os.listdir(self.trash_dir)]
+        for path in entries:
+            self._submit_removal(path)
+        return len(entries)
+    
+    def _submit_removal(self, path: str) -> None:
+        """
+        提交后台删除任务；线程池已关闭时留给下次启动的 purge_trash 处理
+        """
+        try:
+            self._file_executor.submit(self._remove_path, path)
+        except RuntimeError:
+            logger.warning(f"⚠️ 文件删除线程已关闭，留待下次启动清理: {path}")
+    
+    @staticmethod
+    def _remove_path(path: str) -> None:
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+            logger.info(f"🗑️ 已删除目录: {path}")
+        except Exception as e:
+            logger.warning(f"⚠️ 后台删除失败: {path}, {e}")
+    
+    def shutdown(self) -> None:
+        """
+        关闭后台文件删除线程与图片处理线程，不等待未开始的任务
+        """
+        self._file_executor.shutdown(wait=False, cancel_futures=True)
+        self._ingest_executor.shutdown(wait=False, cancel_futures=True)
 
 # 全局图片服务实例
 image_service = ImageService()
@@ -0,0 +1,577 @@
+# File: services/journal_generation_service.py
+# 功能：日记生成服务
+# 实现：根据会话历史调用大模型生成日记并入库；默认一次调用以 JSON 同时生成正文、标题与记忆点，逐字段校验，
+#       解析失败时退回单独生成正文，缺失的标题/记忆点由独立线程池后台补齐；
+#       支持任务模式——提交后立即返回任务ID，由线程池生成，客户端轮询或通过 SSE 获取结果；
+#       对话分析判断会话即将结束时后台预生成草稿，生成日记时若会话消息数未变化则直接使用草稿
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from database_models import SessionLocal, write_session, User, Journal, Image
+from dialogue.session_manager import session_manager
+from services.image_service import image_service
+from services.journal_service import journal_service
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 日记生成线程数（每个任务主要等待大模型响应）
+JOURNAL_JOB_WORKERS = int(os.getenv("JOURNAL_JOB_WORKERS", "4"))
+# 记忆点 / 标题后台生成线程数
+MEMORY_POINT_WORKERS = int(os.getenv("MEMORY_POINT_WORKERS", "2"))
+# 已结束的任务保留时间（秒），超时后查询返回不存在；任务保存在进程内，多进程部署时需要会话粘滞
+JOURNAL_JOB_TTL_SECONDS = float(os.getenv("JOURNAL_JOB_TTL_SECONDS", "3600"))
+# SSE 推送检查任务状态的间隔（秒）与心跳间隔（秒）
+JOURNAL_JOB_POLL_SECONDS = float(os.getenv("JOURNAL_JOB_POLL_SECONDS", "0.5"))
+JOURNAL_JOB_HEARTBEAT_SECONDS = float(os.getenv("JOURNAL_JOB_HEARTBEAT_SECONDS", "15"))
+# 草稿预生成线程数（与日记任务分开，避免预生成占满用户主动发起的任务）
+JOURNAL_DRAFT_WORKERS = int(os.getenv("JOURNAL_DRAFT_WORKERS", "2"))
+# 草稿保留时间（秒），超时后生成日记时重新调用大模型
+JOURNAL_DRAFT_TTL_SECONDS = float(os.getenv("JOURNAL_DRAFT_TTL_SECONDS", "1800"))
+
+# 大模型未返回内容时的默认日记
+DEFAULT_JOURNAL_TEXT = "今天的心情有点复杂，暂时说不清楚。"
+
+# 是否一次调用同时生成正文、标题与记忆点（关闭后正文单独生成，标题与记忆点后台生成）
+JOURNAL_COMBINED_GENERATION = os.getenv("JOURNAL_COMBINED_GENERATION", "true").lower() in ("1", "true", "yes")
+# 合并生成结果的字段长度上限（超出视为该字段无效）；提示词要求正文 80–100 字、标题 ≤10 字、记忆点 ≤25 字，这里留有余量
+JOURNAL_CONTENT_MAX_CHARS = 400
+JOURNAL_TITLE_MAX_CHARS = 20
+JOURNAL_MEMORY_POINT_MAX_CHARS = 60
+
+# 任务状态
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+FINISHED_STATUSES = (JOB_SUCCEEDED, JOB_FAILED)
+
+
+def _clean_field(value: Any, max_chars: int, strip_chars: str = "") -> Optional[str]:
+    """
+    校验合并生成结果中的单个字段：必须是非空字符串且不超过长度上限，否则返回 None
+    """
+    if not isinstance(value, str):
+        return None
+    value = value.strip().strip(strip_chars).strip()
+    if not value or len(value) > max_chars:
+        return None
+    return value
+
+
+def parse_journal_bundle(text: str) -> Dict[str, Optional[str]]:
+    """
+    解析合并生成的 JSON 输出并逐字段校验
+    :param text: 模型输出（允许包裹在代码块或前后带有多余文字）
+    :return: {"content", "title", "memory_point"}；title / memory_point 无效时为 None
+    :raises ValueError: 无法解析出 JSON 对象，或正文无效
+    """
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end <= start:
+        raise ValueError("输出中没有 JSON 对象")
+    data = json.loads(text[start:end + 1])
+    if not isinstance(data, dict):
+        raise ValueError("输出不是 JSON 对象")
+
+    content = _clean_field(data.get("content"), JOURNAL_CONTENT_MAX_CHARS)
+    if content is None:
+        raise ValueError("日记正文为空或过长")
+    return {
+        "content": content,
+        "title": _clean_field(data.get("title"), JOURNAL_TITLE_MAX_CHARS, "《》\"“”"),
+        "memory_point": _clean_field(data.get("memory_point"), JOURNAL_MEMORY_POINT_MAX_CHARS, "\"“”"),
+    }
+
+
+class JournalJob:
+    """
+    日记生成任务
+    """
+
+    def __init__(self, user_id: int, session_id: str, emotion: Optional[str]):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.session_id = session_id
+        self.emotion = emotion
+        self.status = JOB_PENDING
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "session_id": self.session_id,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+        if self.result is not None:
+            data["journal"] = self.result
+        if self.error is not None:
+            data["error"] = self.error
+        return data
+
+
+class JournalDraft:
+    """
+    日记草稿（对话即将结束时预生成）
+    """
+
+    def __init__(self, user_id: int, session_id: str, emotion: Optional[str], message_count: int):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.emotion = emotion
+        self.message_count = message_count  # 生成草稿时会话的累计消息条数
+        self.created_at = time.time()
+        self.future: Optional[Future] = None  # 结果为 (bundle, image_analysis)
+
+
+class JournalGenerationService:
+    """
+    日记生成服务
+    功能：同步生成（generate）与任务模式（submit / get_job / watch）共用同一生成流程；合并生成未得到的标题与记忆点后台补齐
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=JOURNAL_JOB_WORKERS, thread_name_prefix="journal-job")
+        self._memory_executor = ThreadPoolExecutor(max_workers=MEMORY_POINT_WORKERS, thread_name_prefix="journal-enrich")
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, JournalJob] = {}
+        self._draft_executor = ThreadPoolExecutor(max_workers=JOURNAL_DRAFT_WORKERS, thread_name_prefix="journal-draft")
+        self._drafts: Dict[tuple, JournalDraft] = {}
+
+    # ==================== 生成流程 ====================
+    def generate(self, user_id: int, session_id: str, emotion: Optional[str] = None) -> Dict[str, Any]:
+        """
+        根据会话历史生成日记并入库；合并生成未得到的标题/记忆点提交后台生成
+        :param user_id: 用户ID
+        :param session_id: 会话ID
+        :param emotion: 用户选择的情绪
+        :return: 日记数据（journal_id、content、title、emotion、images、image_urls）
+        """
+        started = time.perf_counter()
+
+        # 获取完整对话历史与会话中的图片
+        state = session_manager.get_or_create_session(user_id, session_id)
+        message_count = state.total_messages()
+        session_images, image_urls, image_analysis = self._session_images(user_id, session_id)
+
+        # 会话在预生成草稿后没有新消息时直接使用草稿
+        bundle = self._take_draft(user_id, session_id, emotion, message_count, image_analysis)
+        if bundle is None:
+            bundle = self._compose(emotion, state.summary(last_n=1000), image_analysis)
+
+        # 入库（调用大模型期间不持有任何数据库连接）
+        from memory.sync_memory_generator import clean_memory_point
+        created_at = datetime.now(timezone(timedelta(hours=8)))
+        with write_session() as db:
+            # 生成期间账号可能已注销
+            if not db.query(User.id).filter(User.id == user_id).first():
+                raise LookupError(f"用户不存在: {user_id}")
+            journal_entry = Journal(
+                user_id=user_id,
+                content=bundle["content"],
+                title=bundle["title"],
+                memory_point=clean_memory_point(bundle["memory_point"], created_at) if bundle["memory_point"] else None,
+                session_id=session_id,
+                emotion=emotion,
+                created_at=created_at,
+                updated_at=created_at,
+            )
+            db.add(journal_entry); db.flush()
+            image_service.set_journal_images(db, journal_entry.id, session_images)
+            journal_id = journal_entry.id
+        journal_service.adjust_count(user_id, 1)
+        logger.info(f"✅ 日记已保存 ID={journal_id}，耗时 {(time.perf_counter() - started) * 1000:.0f}ms")
+
+        if bundle["memory_point"]:
+            from memory import invalidate_user_memories
+            invalidate_user_memories(user_id)
+        else:
+            self.schedule_memory_point(journal_id)
+        if not bundle["title"]:
+            self.schedule_title(journal_id)
+        return {
+            "journal_id": journal_id,
+            "content": bundle["content"],
+            "title": bundle["title"],
+            "emotion": emotion,
+            "images": session_images,
+            "image_urls": image_urls,
+        }
+
+    @classmethod
+    def _compose(cls, emotion: Optional[str], context_summary: str, image_analysis: str) -> Dict[str, Optional[str]]:
+        """
+        调用大模型生成日记（合并生成失败或关闭时退回单独生成正文）
+        :return: {"content", "title", "memory_point"}
+        """
+        bundle = None
+        if JOURNAL_COMBINED_GENERATION:
+            bundle = cls._generate_bundle(emotion, context_summary, image_analysis)
+        if bundle is None:
+            bundle = {"content": cls._generate_content(emotion, context_summary), "title": None, "memory_point": None}
+        return bundle
+
+    @staticmethod
+    def _generate_content(emotion: Optional[str], context_summary: str) -> str:
+        """
+        单独生成日记正文（关闭合并生成或合并生成解析失败时使用）
+        """
+        from prompts.journal_prompts import get_journal_generation_prompt
+        from llm.llm_factory import chat_with_doubao_llm
+        journal_system_prompt = get_journal_generation_prompt(emotion=emotion or "平和", chat_history=context_summary)
+        journal_result = chat_with_doubao_llm(journal_system_prompt)
+        return journal_result.get("answer", DEFAULT_JOURNAL_TEXT)
+
+    @staticmethod
+    def _generate_bundle(emotion: Optional[str], context_summary: str, image_analysis: str) -> Optional[Dict[str, Optional[str]]]:
+        """
+        一次调用生成正文、标题与记忆点
+        :return: 校验后的结果；调用或解析失败时返回 None（由调用方退回单独生成正文）
+        """
+        from prompts.journal_prompts import get_journal_bundle_prompt
+        from llm.llm_factory import get_doubao_llm
+        from langchain_core.messages import HumanMessage
+
+        started = time.perf_counter()
+        prompt = get_journal_bundle_prompt(emotion=emotion or "平和", chat_history=context_summary,
+                                           image_analysis=image_analysis)
+        try:
+            # 直接调用豆包：失败时不使用 chat_with_llm 的兜底文案，而是退回单独生成
+            bundle = parse_journal_bundle(get_doubao_llm()._call([HumanMessage(content=prompt)]))
+        except Exception as e:
+            metrics.incr("journal_llm.bundle_fallback")
+            logger.warning(f"⚠️ 合并生成日记失败，退回单独生成正文: {e}")
+            return None
+
+        metrics.incr("journal_llm.bundle_ok")
+        metrics.incr("journal_llm.bundle_ms", round((time.perf_counter() - started) * 1000, 1))
+        # 每个有效字段省去一次单独的模型调用（记忆点、标题各一次）
+        saved = sum(1 for field in ("title", "memory_point") if bundle[field])
+        metrics.incr("journal_llm.calls_saved", saved)
+        for field in ("title", "memory_point"):
+            if not bundle[field]:
+                metrics.incr(f"journal_llm.invalid_{field}")
+        return bundle
+
+    @staticmethod
+    def _session_images(user_id: int, session_id: str):
+        """
+        一次查询获取会话中的图片ID、访问URL与图片分析描述
+        """
+        from memory.sync_memory_generator import format_image_analysis
+        db = SessionLocal()
+        try:
+            images = db.query(Image.id, Image.user_id, Image.filename, Image.analysis_result).filter(
+                Image.user_id == user_id,
+                Image.session_id == session_id
+            ).order_by(Image.id).all()
+        except Exception as e:
+            logger.warning(f"⚠️ 获取会话图片失败: {e}")
+            images = []
+        finally:
+            db.close()
+        session_images: List[str] = [str(img.id) for img in images]
+        image_urls: List[str] = [image_service.image_url(img.user_id, img.filename) for img in images]
+        return session_images, image_urls, format_image_analysis(img.analysis_result for img in images)
+
+    # ==================== 草稿预生成 ====================
+    def schedule_draft(self, user_id: int, session_id: str, emotion: Optional[str] = None) -> bool:
+        """
+        提交草稿预生成任务（立即返回）；对话分析判断会话即将结束时调用
+        同一会话已有相同消息数与情绪的草稿（生成中或已完成）时不重复提交
+        :param user_id: 用户ID
+        :param session_id: 会话ID
+        :param emotion: 用户当前选择的情绪
+        :return: 是否提交了新的草稿任务
+        """
+        state = session_manager.get_or_create_session(user_id, session_id)
+        message_count = state.total_messages()
+        context_summary = state.summary(last_n=1000)
+        key = (user_id, session_id)
+
+        with self._lock:
+            self._purge_expired_drafts()
+            draft = self._drafts.get(key)
+            if draft is not None and draft.message_count == message_count and draft.emotion == emotion:
+                return False
+            if draft is not None:
+                draft.future.cancel()
+            draft = JournalDraft(user_id, session_id, emotion, message_count)
+            try:
+                draft.future = self._draft_executor.submit(self._run_draft, draft, context_summary)
+            except RuntimeError:
+                self._drafts.pop(key, None)
+                return False
+            self._drafts[key] = draft
+        metrics.incr("journal_draft.scheduled")
+        logger.info(f"📝 日记草稿预生成已提交: user={user_id}, session={session_id}, messages={message_count}")
+        return True
+
+    def _run_draft(self, draft: JournalDraft, context_summary: str):
+        """
+        生成草稿（在线程池中执行）
+        :return: (bundle, 生成时使用的图片分析描述)
+        """
+        started = time.perf_counter()
+        try:
+            _, _, image_analysis = self._session_images(draft.user_id, draft.session_id)
+            bundle = self._compose(draft.emotion, context_summary, image_analysis)
+        except Exception as e:
+            metrics.incr("journal_draft.failed")
+            logger.warning(f"⚠️ 日记草稿预生成失败: user={draft.user_id}, session={draft.session_id}, error={e}")
+            raise
+        metrics.incr("journal_draft.time_ms", round((time.perf_counter() - started) * 1000, 1))
+        return bundle, image_analysis
+
+    def _take_draft(self, user_id: int, session_id: str, emotion: Optional[str], message_count: int,
+                    image_analysis: str) -> Optional[Dict[str, Optional[str]]]:
+        """
+        取出并校验会话的草稿（取出后即失效，每份草稿最多使用一次）
+        草稿仍在生成中时等待其完成（耗时受大模型调用超时约束），不再另起一次生成；
+        草稿尚在排队时取消草稿，由调用方直接生成
+        :return: 消息数、情绪与图片均未变化时返回草稿内容，否则返回 None（由调用方重新生成）
+        """
+        with self._lock:
+            draft = self._drafts.pop((user_id, session_id), None)
+        if draft is None:
+            metrics.incr("journal_draft.miss")
+            return None
+        if time.time() - draft.created_at > JOURNAL_DRAFT_TTL_SECONDS:
+            draft.future.cancel()
+            metrics.incr("journal_draft.miss")
+            return None
+        if draft.message_count != message_count or draft.emotion != emotion:
+            draft.future.cancel()
+            metrics.incr("journal_draft.stale")
+            return None
+        if draft.future.cancel():
+            # 草稿还没开始生成，等待排队没有意义
+            metrics.incr("journal_draft.miss")
+            return None
+
+        try:
+            bundle, draft_image_analysis = draft.future.result()
+        except Exception:
+            # 生成失败或已取消
+            metrics.incr("journal_draft.miss")
+            return None
+        if draft_image_analysis != image_analysis:
+            metrics.incr("journal_draft.stale")
+            return None
+        metrics.incr("journal_draft.hit")
+        return dict(bundle)
+
+    def _purge_expired_drafts(self) -> None:
+        """
+        清理已过期的草稿（调用方持有锁）
+        """
+        now = time.time()
+        for key in [key for key, draft in self._drafts.items() if now - draft.created_at > JOURNAL_DRAFT_TTL_SECONDS]:
+            self._drafts.pop(key).future.cancel()
+
+    # ==================== 记忆点 / 标题后台生成 ====================
+    def schedule_memory_point(self, journal_id: int) -> bool:
+        """
+        提交记忆点生成任务（立即返回）
+        :param journal_id: 日记ID
+        :return: 是否提交成功；应用关闭后返回 False
+        """
+        try:
+            self._memory_executor.submit(self._generate_memory_point, journal_id)
+        except RuntimeError:
+            logger.warning(f"⚠️ 记忆点线程池已关闭，日记 {journal_id} 留待批量分析补齐")
+            return False
+        metrics.incr("memory_point.scheduled")
+        return True
+
+    @staticmethod
+    def _generate_memory_point(journal_id: int) -> None:
+        try:
+            from memory import generate_memory_point_for_journal
+            if generate_memory_point_for_journal(journal_id):
+                metrics.incr("memory_point.completed")
+                logger.info(f"✅ 日记 {journal_id} 记忆点生成成功")
+            else:
+                metrics.incr("memory_point.failed")
+                logger.warning(f"⚠️ 日记 {journal_id} 记忆点生成失败")
+        except Exception as e:
+            metrics.incr("memory_point.failed")
+            logger.warning(f"⚠️ 日记 {journal_id} 记忆点生成失败: {e}")
+
+    def schedule_title(self, journal_id: int) -> bool:
+        """
+        提交标题生成任务（立即返回）
+        :param journal_id: 日记ID
+        :return: 是否提交成功；应用关闭后返回 False
+        """
+        try:
+            self._memory_executor.submit(self._generate_title, journal_id)
+        except RuntimeError:
+            return False
+        metrics.incr("journal_title.scheduled")
+        return True
+
+    @staticmethod
+    def _generate_title(journal_id: int) -> None:
+        """
+        单独生成日记标题；写回时只更新仍没有标题的日记
+        """
+        from prompts.journal_prompts import get_journal_title_prompt
+        from llm.llm_factory import get_doubao_llm
+        from langchain_core.messages import HumanMessage
+
+        db = SessionLocal()
+        try:
+            journal = db.query(Journal.content, Journal.emotion).filter(Journal.id == journal_id).first()
+        finally:
+            db.close()
+        if journal is None:
+            return
+
+        try:
+            prompt = get_journal_title_prompt(emotion=journal.emotion or "平和", journal_content=journal.content)
+            title = _clean_field(get_doubao_llm()._call([HumanMessage(content=prompt)]),
+                                 JOURNAL_TITLE_MAX_CHARS, "《》\"“”")
+            if title is None:
+                raise ValueError("标题为空或过长")
+            with write_session() as db:
+                db.query(Journal).filter(Journal.id == journal_id, Journal.title.is_(None)).update(
+                    {Journal.title: title}, synchronize_session=False)
+            metrics.incr("journal_title.completed")
+        except Exception as e:
+            metrics.incr("journal_title.failed")
+            logger.warning(f"⚠️ 日记 {journal_id} 标题生成失败: {e}")
+
+    # ==================== 任务模式 ====================
+    def submit(self, user_id: int, session_id: str, emotion: Optional[str] = None) -> JournalJob:
+        """
+        提交日记生成任务（立即返回）；同一会话已有未结束的任务时直接返回该任务，避免重复点击生成多篇日记
+        :param user_id: 用户ID
+        :param session_id: 会话ID
+        :param emotion: 用户选择的情绪
+        :raises RuntimeError: 应用关闭后线程池不再接受任务
+        """
+        with self._lock:
+            self._purge_expired()
+            for job in self._jobs.values():
+                if job.user_id == user_id and job.session_id == session_id and job.status not in FINISHED_STATUSES:
+                    metrics.incr("journal_job.deduplicated")
+                    return job
+            job = JournalJob(user_id, session_id, emotion)
+            self._jobs[job.id] = job
+
+        try:
+            self._executor.submit(self._run_job, job)
+        except RuntimeError:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            raise
+        metrics.incr("journal_job.submitted")
+        logger.info(f"📝 日记生成任务已提交: job={job.id}, user={user_id}, session={session_id}")
+        return job
+
+    def _run_job(self, job: JournalJob) -> None:
+        """
+        执行日记生成任务（在线程池中执行）
+        """
+        started = time.perf_counter()
+        with self._lock:
+            job.status = JOB_RUNNING
+        try:
+            result = self.generate(job.user_id, job.session_id, job.emotion)
+            with self._lock:
+                job.result = result
+                job.status = JOB_SUCCEEDED
+            metrics.incr("journal_job.succeeded")
+        except Exception as e:
+            logger.error(f"❌ 日记生成任务失败: job={job.id}, error={e}")
+            with self._lock:
+                job.error = "生成日记失败"
+                job.status = JOB_FAILED
+            metrics.incr("journal_job.failed")
+        finally:
+            with self._lock:
+                job.finished_at = time.time()
+            metrics.incr("journal_job.time_ms", round((time.perf_counter() - started) * 1000, 1))
+
+    def get_job(self, job_id: str, user_id: int) -> Optional[Dict[str, Any]]:
+        """
+        查询任务状态
+        :param job_id: 任务ID
+        :param user_id: 用户ID（只能查询自己的任务）
+        :return: 任务快照；任务不存在、已过期或不属于该用户时返回 None
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.user_id != user_id or self._expired(job, time.time()):
+                return None
+            return job.to_dict()
+
+    async def watch(self, job_id: str, user_id: int) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        跟踪任务状态，供 SSE 推送
+        :return: 异步迭代器；状态变化时产出任务快照，长时间无变化时产出 None（用于发送心跳），任务结束或消失后停止
+        """
+        last_status = None
+        last_sent = time.monotonic()
+        while True:
+            snapshot = self.get_job(job_id, user_id)
+            if snapshot is None:
+                return
+            if snapshot["status"] != last_status:
+                last_status = snapshot["status"]
+                last_sent = time.monotonic()
+                yield snapshot
+                if last_status in FINISHED_STATUSES:
+                    return
+            elif time.monotonic() - last_sent >= JOURNAL_JOB_HEARTBEAT_SECONDS:
+                last_sent = time.monotonic()
+                yield None
+            await asyncio.sleep(JOURNAL_JOB_POLL_SECONDS)
+
+    @staticmethod
+    def _expired(job: JournalJob, now: float) -> bool:
+        return job.finished_at is not None and now - job.finished_at > JOURNAL_JOB_TTL_SECONDS
+
+    def _purge_expired(self) -> None:
+        """
+        清理已过期的任务（调用方持有锁）
+        """
+        now = time.time()
+        for job_id in [job_id for job_id, job in self._jobs.items() if self._expired(job, now)]:
+            del self._jobs[job_id]
+
+    def forget_user(self, user_id: int) -> None:
+        """
+        清除用户的任务记录与草稿（注销账号时调用）
+        """
+        with self._lock:
+            for job_id in [job_id for job_id, job in self._jobs.items() if job.user_id == user_id]:
+                del self._jobs[job_id]
+            for key in [key for key in self._drafts if key[0] == user_id]:
+                self._drafts.pop(key).future.cancel()
+
+    def shutdown(self) -> None:
+        """
+        关闭线程池，不等待未开始的任务
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._memory_executor.shutdown(wait=False, cancel_futures=True)
+        self._draft_executor.shutdown(wait=False, cancel_futures=True)
+
+
+# 全局日记生成服务实例
+journal_generation_service = JournalGenerationService()
@@ -0,0 +1,264 @@
+# File: services/journal_search_service.py
+# 功能：日记全文检索服务
+# 实现：基于 journals_fts（FTS5 trigram 分词，覆盖正文、记忆点与标题）按 bm25 相关度排序，按 (相关度, id) 游标分页，
+#       只为当前页生成高亮摘要；关键词不足 3 个字（trigram 无法匹配）或数据库不支持 FTS5 时退回 LIKE 匹配、按时间倒序
+
+import base64
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import DateTime, Float, Integer, String, and_, or_, select, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database_models import Journal
+from database_models.migrations import JOURNAL_FTS_TABLE
+from services.journal_service import InvalidCursorError
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# trigram 分词下每个检索词至少 3 个字才能命中索引
+FTS_MIN_TERM_CHARS = 3
+# 检索词数量与查询长度上限
+SEARCH_MAX_TERMS = 8
+SEARCH_MAX_QUERY_CHARS = 100
+# 摘要长度（trigram 分词下约等于字数）与高亮标记
+SEARCH_SNIPPET_TOKENS = 24
+HIGHLIGHT_OPEN = "<mark>"
+HIGHLIGHT_CLOSE = "</mark>"
+SNIPPET_ELLIPSIS = "…"
+# bm25 列权重：正文、记忆点、标题（命中标题与记忆点的日记排在前面）
+BM25_WEIGHTS = (1.0, 2.0, 3.0)
+
+# 相关度排序的分页查询：bm25 只能在 MATCH 查询中计算，外层再按游标过滤
+_FTS_PAGE_SQL = text(f"""
+SELECT id, title, emotion, created_at, score FROM (
+    SELECT j.id AS id, j.title AS title, j.emotion AS emotion, j.created_at AS created_at,
+           bm25({JOURNAL_FTS_TABLE}, {', '.join(str(w) for w in BM25_WEIGHTS)}) AS score
+    FROM {JOURNAL_FTS_TABLE} JOIN journals j ON j.id = {JOURNAL_FTS_TABLE}.rowid
+    WHERE {JOURNAL_FTS_TABLE} MATCH :match AND j.user_id = :user_id
+)
+WHERE :first_page OR score > :score OR (score = :score AND id > :last_id)
+ORDER BY score, id
+LIMIT :limit
+""").columns(id=Integer, title=String, emotion=String, created_at=DateTime, score=Float)
+
+# 当前页的高亮摘要（只对本页的日记计算 snippet）
+_FTS_SNIPPET_SQL = f"""
+SELECT rowid,
+       snippet({JOURNAL_FTS_TABLE}, 0, :open, :close, :ellipsis, :tokens) AS content_snippet,
+       snippet({JOURNAL_FTS_TABLE}, 1, :open, :close, :ellipsis, :tokens) AS memory_point_snippet
+FROM {JOURNAL_FTS_TABLE}
+WHERE {JOURNAL_FTS_TABLE} MATCH :match AND rowid IN ({{ids}})
+"""
+
+
+class JournalSearchService:
+    """
+    日记全文检索服务
+    功能：解析检索词、执行 FTS5 / LIKE 检索、编解码检索游标
+    """
+
+    def __init__(self):
+        self._fts_available: Optional[bool] = None
+
+    # ==================== 检索词与游标 ====================
+    @staticmethod
+    def parse_terms(query: str) -> List[str]:
+        """
+        按空白切分检索词（多个词之间为"且"关系），去重并限制数量
+        """
+        terms = list(dict.fromkeys(query[:SEARCH_MAX_QUERY_CHARS].split()))
+        return terms[:SEARCH_MAX_TERMS]
+
+    @staticmethod
+    def _match_expression(terms: List[str]) -> str:
+        """
+        构造 FTS5 MATCH 表达式：每个词作为短语加引号，避免用户输入被解析为 FTS 查询语法
+        """
+        return " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+    @staticmethod
+    def _encode_cursor(mode: str, key: Any, journal_id: int) -> str:
+        raw = json.dumps([mode, key, journal_id], ensure_ascii=False)
+        return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+    @staticmethod
+    def _decode_cursor(cursor: str, mode: str) -> Tuple[Any, int]:
+        """
+        解析检索游标
+        :raises InvalidCursorError: 游标格式错误，或与本次检索方式不一致（检索词变化导致 FTS / LIKE 切换）
+        """
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+            cursor_mode, key, journal_id = json.loads(raw)
+            if cursor_mode != mode:
+                raise ValueError(cursor_mode)
+            if mode == "like":
+                key = datetime.fromisoformat(key)
+            return key, int(journal_id)
+        except Exception:
+            raise InvalidCursorError(f"无效的检索游标: {cursor}")
+
+    # ==================== 检索 ====================
+    async def _has_fts(self, db: AsyncSession) -> bool:
+        """
+        检查全文检索表是否存在（迁移时按数据库能力创建，结果在进程内缓存）
+        """
+        if self._fts_available is None:
+            if db.bind.dialect.name != "sqlite":
+                self._fts_available = False
+            else:
+                self._fts_available = (await db.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+                ), {"name": JOURNAL_FTS_TABLE})).first() is not None
+        return self._fts_available
+
+    async def search(self, db: AsyncSession, user_id: int, query: str, limit: int,
+                     cursor: Optional[str] = None) -> Dict[str, Any]:
+        """
+        检索用户日记
+        :param db: 异步数据库会话
+        :param user_id: 用户ID
+        :param query: 检索内容（多个词用空格分隔）
+        :param limit: 每页条数
+        :param cursor: 上一页返回的 next_cursor
+        :return: {"mode": "fts"/"like", "results": [...], "has_more": bool, "next_cursor": str/None}
+        :raises InvalidCursorError: 游标无效
+        """
+        terms = self.parse_terms(query)
+        if not terms:
+            return {"mode": "like", "results": [], "has_more": False, "next_cursor": None}
+
+        if all(len(term) >= FTS_MIN_TERM_CHARS for term in terms) and await self._has_fts(db):
+            metrics.incr("journal_search.fts")
+            return await self._search_fts(db, user_id, terms, limit, cursor)
+        metrics.incr("journal_search.like")
+        return await self._search_like(db, user_id, terms, limit, cursor)
+
+    async def _search_fts(self, db: AsyncSession, user_id: int, terms: List[str], limit: int,
+                          cursor: Optional[str]) -> Dict[str, Any]:
+        """
+        FTS5 检索：按 bm25 相关度排序，只为当前页生成高亮摘要
+        """
+        score, last_id = self._decode_cursor(cursor, "fts") if cursor else (0.0, 0)
+        match = self._match_expression(terms)
+        rows = (await db.execute(_FTS_PAGE_SQL, {
+            "match": match, "user_id": user_id, "first_page": cursor is None,
+            "score": score, "last_id": last_id, "limit": limit + 1,
+        })).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        snippets = {}
+        if rows:
+            ids = [row.id for row in rows]
+            snippet_sql = text(_FTS_SNIPPET_SQL.format(ids=", ".join(str(journal_id) for journal_id in ids)))
+            snippets = {row.rowid: row for row in (await db.execute(snippet_sql, {
+                "match": match, "open": HIGHLIGHT_OPEN, "close": HIGHLIGHT_CLOSE,
+                "ellipsis": SNIPPET_ELLIPSIS, "tokens": SEARCH_SNIPPET_TOKENS,
+            })).all()}
+
+        results = []
+        for row in rows:
+            snippet = snippets.get(row.id)
+            results.append({
+                "journal_id": row.id,
+                "title": row.title,
+                "emotion": row.emotion,
+                "created_at": row.created_at.isoformat() if row.created_at else None,
+                "content_snippet": snippet.content_snippet if snippet else None,
+                "memory_point_snippet": snippet.memory_point_snippet if snippet else None,
+                "score": row.score,
+            })
+        return {
+            "mode": "fts",
+            "results": results,
+            "has_more": has_more,
+            "next_cursor": self._encode_cursor("fts", rows[-1].score, rows[-1].id) if has_more else None,
+        }
+
+    async def _search_like(self, db: AsyncSession, user_id: int, terms: List[str], limit: int,
+                           cursor: Optional[str]) -> Dict[str, Any]:
+        """
+        LIKE 检索（短关键词或不支持 FTS5 时）：只扫描该用户的日记，按时间倒序
+        """
+        conditions = [Journal.user_id == user_id]
+        for term in terms:
+            pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            conditions.append(or_(
+                Journal.content.like(pattern, escape="\\"),
+                Journal.memory_point.like(pattern, escape="\\"),
+                Journal.title.like(pattern, escape="\\"),
+            ))
+        if cursor:
+            conditions.append(tuple_(Journal.created_at, Journal.id) < tuple_(*self._decode_cursor(cursor, "like")))
+
+        rows = (await db.execute(
+            select(Journal.id, Journal.title, Journal.emotion, Journal.created_at, Journal.content, Journal.memory_point)
+            .where(and_(*conditions))
+            .order_by(Journal.created_at.desc(), Journal.id.desc())
+            .limit(limit + 1)
+        )).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        results = [{
+            "journal_id": row.id,
+            "title": row.title,
+            "emotion": row.emotion,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+            "content_snippet": self.make_snippet(row.content, terms),
+            "memory_point_snippet": self.make_snippet(row.memory_point, terms),
+            "score": None,
+        } for row in rows]
+        return {
+            "mode": "like",
+            "results": results,
+            "has_more": has_more,
+            "next_cursor": self._encode_cursor("like", rows[-1].created_at.isoformat(), rows[-1].id) if has_more else None,
+        }
+
+    @staticmethod
+    def make_snippet(value: Optional[str], terms: List[str]) -> Optional[str]:
+        """
+        生成与 FTS5 snippet 格式一致的高亮摘要（LIKE 检索使用）：以第一个命中位置为中心截取，并高亮所有命中的检索词
+        """
+        if not value:
+            return value
+        lowered = value.lower()
+        positions = [lowered.find(term.lower()) for term in terms]
+        positions = [position for position in positions if position >= 0]
+        start = max(min(positions) - SEARCH_SNIPPET_TOKENS // 2, 0) if positions else 0
+        end = min(start + SEARCH_SNIPPET_TOKENS, len(value))
+        fragment = value[start:end]
+
+        # 先在原文中标出所有命中区间并合并重叠部分，再统一插入高亮标记
+        lowered_fragment = fragment.lower()
+        spans = []
+        for term in terms:
+            index = lowered_fragment.find(term.lower())
+            while index >= 0:
+                spans.append((index, index + len(term)))
+                index = lowered_fragment.find(term.lower(), index + len(term))
+        merged: List[List[int]] = []
+        for span_start, span_end in sorted(spans):
+            if merged and span_start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], span_end)
+            else:
+                merged.append([span_start, span_end])
+        pieces, index = [], 0
+        for span_start, span_end in merged:
+            pieces.append(fragment[index:span_start])
+            pieces.append(HIGHLIGHT_OPEN + fragment[span_start:span_end] + HIGHLIGHT_CLOSE)
+            index = span_end
+        pieces.append(fragment[index:])
+        fragment = "".join(pieces)
+
+        return (SNIPPET_ELLIPSIS if start > 0 else "") + fragment + (SNIPPET_ELLIPSIS if end < len(value) else "")
+
+
+# 全局日记检索服务实例
+journal_search_service = JournalSearchService()
@@ -0,0 +1,127 @@
+# File: services/journal_service.py
+# 功能：日记列表分页服务
+# 实现：按 (created_at, id) 游标分页（翻到第 N 页与第 1 页代价相同），并按用户缓存日记总数，创建/删除日记时增量更新
+
+import base64
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database_models import Journal
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 日记总数缓存有效期（秒）；进程内增量更新，多进程部署时由过期时间兜底
+JOURNAL_COUNT_TTL_SECONDS = float(os.getenv("JOURNAL_COUNT_TTL_SECONDS", "300"))
+
+
+class InvalidCursorError(ValueError):
+    """分页游标无法解析"""
+    pass
+
+
+class JournalService:
+    """
+    日记列表分页服务
+    功能：构造游标分页查询、编解码游标、维护每个用户的日记总数缓存
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[int, Tuple[float, int]] = {}
+        self._versions: Dict[int, int] = {}
+
+    # ==================== 游标分页 ====================
+    @staticmethod
+    def encode_cursor(created_at: datetime, journal_id: int) -> str:
+        """
+        将一页最后一篇日记的 (created_at, id) 编码为不透明游标
+        """
+        raw = f"{created_at.isoformat()}|{journal_id}"
+        return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+        """
+        解析游标
+        :raises InvalidCursorError: 游标格式错误
+        """
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+            created_at, journal_id = raw.rsplit("|", 1)
+            return datetime.fromisoformat(created_at), int(journal_id)
+        except Exception:
+            raise InvalidCursorError(f"无效的分页游标: {cursor}")
+
+    @staticmethod
+    def list_statement(user_id: int, limit: int, cursor: Optional[Tuple[datetime, int]] = None, offset: int = 0):
+        """
+        构造日记列表查询（只查询列表展示所需字段），多取一条用于判断是否还有下一页
+        :param cursor: 上一页最后一篇日记的 (created_at, id)；给定时按游标定位，走 ix_journals_user_created 索引直接跳转
+        :param offset: 兼容旧版按页码翻页（未给定游标时使用）
+        """
+        statement = select(Journal.id, Journal.content, Journal.title, Journal.emotion, Journal.created_at).where(
+            Journal.user_id == user_id
+        )
+        if cursor is not None:
+            statement = statement.where(tuple_(Journal.created_at, Journal.id) < tuple_(*cursor))
+        elif offset:
+            statement = statement.offset(offset)
+        return statement.order_by(Journal.created_at.desc(), Journal.id.desc()).limit(limit + 1)
+
+    # ==================== 日记总数缓存 ====================
+    async def count_async(self, db: AsyncSession, user_id: int) -> int:
+        """
+        获取用户日记总数（优先读缓存）
+        :param db: 异步数据库会话
+        :param user_id: 用户ID
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._counts.get(user_id)
+            if entry and now - entry[0] < JOURNAL_COUNT_TTL_SECONDS:
+                metrics.incr("journal_count_cache.hit")
+                return entry[1]
+            version = self._versions.get(user_id, 0)
+        metrics.incr("journal_count_cache.miss")
+
+        total = (await db.execute(
+            select(func.count(Journal.id)).where(Journal.user_id == user_id)
+        )).scalar()
+        with self._lock:
+            # 读取期间有日记创建/删除时本次结果可能已过时，不写入缓存
+            if self._versions.get(user_id, 0) == version:
+                self._counts[user_id] = (time.monotonic(), total)
+        return total
+
+    def adjust_count(self, user_id: int, delta: int) -> None:
+        """
+        创建/删除日记并提交后增量更新总数
+        :param user_id: 用户ID
+        :param delta: 变化量（创建为 1，删除为 -1）
+        """
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            entry = self._counts.get(user_id)
+            if entry:
+                self._counts[user_id] = (entry[0], max(entry[1] + delta, 0))
+
+    def invalidate_count(self, user_id: int) -> None:
+        """
+        批量增删日记（QA 数据、注销账号等）后失效总数缓存
+        :param user_id: 用户ID
+        """
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            self._counts.pop(user_id, None)
+
+
+# 全局日记服务实例
+journal_service = JournalService()
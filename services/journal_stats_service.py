@@ -0,0 +1,132 @@
+# File: services/journal_stats_service.py
+# 功能：情绪日历与趋势统计服务
+# 实现：只读取 journal_emotion_daily（由触发器增量维护的每日情绪计数），不扫描 journals；
+#       用 NumPy 把每日计数按日/周/月分桶，一次 np.add.at 汇总出 桶×情绪 的计数矩阵，再向量化求合计与主导情绪
+
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database_models import JournalEmotionDaily
+from services.metrics import metrics
+
+# 支持的分桶粒度与未指定起始日期时的默认跨度
+STATS_BUCKETS = ("day", "week", "month")
+STATS_DEFAULT_SPAN = {"day": 30, "week": 12 * 7, "month": 365}
+# 单次统计的最大天数
+STATS_MAX_DAYS = 3 * 366
+# 未设置情绪的日记在统计中的标签
+UNKNOWN_EMOTION = "unknown"
+
+
+class JournalStatsService:
+    """
+    情绪统计服务
+    功能：校验统计区间、读取每日情绪计数并按日/周/月汇总
+    """
+
+    @staticmethod
+    def today() -> date:
+        return datetime.now(timezone(timedelta(hours=8))).date()
+
+    def resolve_range(self, bucket: str, start: Optional[date], end: Optional[date]) -> tuple:
+        """
+        补全并校验统计区间
+        :raises ValueError: 粒度不支持、起止日期颠倒或区间过长
+        """
+        if bucket not in STATS_BUCKETS:
+            raise ValueError(f"不支持的统计粒度: {bucket}")
+        end = end or self.today()
+        start = start or end - timedelta(days=STATS_DEFAULT_SPAN[bucket] - 1)
+        if start > end:
+            raise ValueError("开始日期不能晚于结束日期")
+        if (end - start).days + 1 > STATS_MAX_DAYS:
+            raise ValueError(f"统计区间不能超过 {STATS_MAX_DAYS} 天")
+        return start, end
+
+    @staticmethod
+    def _bucket_starts(days: np.ndarray, bucket: str) -> np.ndarray:
+        """
+        计算每个日期所属桶的起始日期（周从周一开始，月从 1 日开始）
+        """
+        if bucket == "week":
+            # 1970-01-01 是周四：(天数 + 3) % 7 即为周一起算的星期序号
+            return days - (days.astype(np.int64) + 3) % 7
+        if bucket == "month":
+            return days.astype("datetime64[M]").astype("datetime64[D]")
+        return days
+
+    async def stats(self, db: AsyncSession, user_id: int, bucket: str, start: date, end: date) -> Dict[str, Any]:
+        """
+        统计区间内的情绪分布
+        :param db: 异步数据库会话
+        :param user_id: 用户ID
+        :param bucket: 分桶粒度（day/week/month）
+        :param start: 开始日期（含）
+        :param end: 结束日期（含）
+        :return: {"total", "active_days", "emotions", "totals", "buckets": [{"start", "total", "counts", "dominant_emotion"}]}
+                 buckets 覆盖整个区间（没有日记的桶 total 为 0），首尾桶可能只包含区间内的部分日期
+        """
+        rows = (await db.execute(
+            select(JournalEmotionDaily.day, JournalEmotionDaily.emotion, JournalEmotionDaily.count).where(
+                JournalEmotionDaily.user_id == user_id,
+                JournalEmotionDaily.day >= start,
+                JournalEmotionDaily.day <= end,
+            )
+        )).all()
+        metrics.incr("journal_stats.requests")
+
+        # 区间内的全部桶（包括没有日记的桶）
+        first_bucket, last_bucket = self._bucket_starts(np.array([start, end], dtype="datetime64[D]"), bucket)
+        if bucket == "month":
+            bucket_keys = np.arange(first_bucket.astype("datetime64[M]"), last_bucket.astype("datetime64[M]") + 1)
+            bucket_keys = bucket_keys.astype("datetime64[D]")
+        else:
+            bucket_keys = np.arange(first_bucket, last_bucket + 1, 7 if bucket == "week" else 1)
+
+        if rows:
+            days = np.array([row.day for row in rows], dtype="datetime64[D]")
+            counts = np.fromiter((row.count for row in rows), dtype=np.int64, count=len(rows))
+            emotions, emotion_index = np.unique([row.emotion or UNKNOWN_EMOTION for row in rows], return_inverse=True)
+            bucket_index = np.searchsorted(bucket_keys, self._bucket_starts(days, bucket))
+
+            matrix = np.zeros((len(bucket_keys), len(emotions)), dtype=np.int64)
+            np.add.at(matrix, (bucket_index, emotion_index), counts)
+            active_days = int(np.unique(days).size)
+        else:
+            emotions = np.array([], dtype=str)
+            matrix = np.zeros((len(bucket_keys), 0), dtype=np.int64)
+            active_days = 0
+
+        emotion_totals = matrix.sum(axis=0)
+        bucket_totals = matrix.sum(axis=1)
+        dominant = matrix.argmax(axis=1) if len(emotions) else np.zeros(len(bucket_keys), dtype=np.int64)
+        # 情绪按总篇数降序（篇数相同时按名称）
+        order = np.lexsort((emotions, -emotion_totals)) if len(emotions) else np.array([], dtype=np.int64)
+
+        emotion_names: List[str] = [str(emotion) for emotion in emotions]
+        buckets = []
+        for position, key in enumerate(bucket_keys):
+            row = matrix[position]
+            nonzero = np.flatnonzero(row)
+            buckets.append({
+                "start": str(key),
+                "total": int(bucket_totals[position]),
+                "counts": {emotion_names[index]: int(row[index]) for index in nonzero},
+                "dominant_emotion": emotion_names[dominant[position]] if bucket_totals[position] else None,
+            })
+
+        return {
+            "total": int(emotion_totals.sum()),
+            "active_days": active_days,
+            "emotions": [emotion_names[index] for index in order],
+            "totals": {emotion_names[index]: int(emotion_totals[index]) for index in order},
+            "buckets": buckets,
+        }
+
+
+# 全局情绪统计服务实例
+journal_stats_service = JournalStatsService()
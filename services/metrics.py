@@ -0,0 +1,49 @@
+# File: services/metrics.py
+# 功能：进程内运行指标
+# 实现：线程安全的计数器与数值指标，供 /metrics 接口导出
+
+import threading
+from typing import Dict, Union
+
+Number = Union[int, float]
+
+
+class MetricsRegistry:
+    """
+    进程内指标注册表
+    功能：记录计数器（累加）与数值指标（覆盖写入），多 worker 部署时各进程独立统计
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Number] = {}
+        self._gauges: Dict[str, Number] = {}
+
+    def incr(self, name: str, value: Number = 1) -> None:
+        """
+        累加计数器
+        :param name: 指标名
+        :param value: 增量
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: Number) -> None:
+        """
+        写入数值指标
+        :param name: 指标名
+        :param value: 当前值
+        """
+        with self._lock:
+            self._gauges[name] = value
+
+    def snapshot(self) -> Dict[str, Dict[str, Number]]:
+        """
+        导出当前所有指标
+        """
+        with self._lock:
+            return {"counters": dict(self._counters), "gauges": dict(self._gauges)}
+
+
+# 全局指标实例
+metrics = MetricsRegistry()
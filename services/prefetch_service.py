@@ -0,0 +1,111 @@
+# File: services/prefetch_service.py
+# 功能：用户会话预热服务
+# 实现：用户打开应用（登录、获取资料、获取会话列表）时在后台线程池中预加载用户资料、最近会话与记忆点，使首轮对话命中缓存
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Set
+
+from dialogue.session_manager import session_manager
+from services.metrics import metrics
+from services.user_cache import user_cache
+
+logger = logging.getLogger(__name__)
+
+# 预热线程数
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "2"))
+# 同一用户两次预热的最小间隔（秒），避免客户端连续请求重复预热
+PREFETCH_COOLDOWN_SECONDS = float(os.getenv("PREFETCH_COOLDOWN_SECONDS", "60"))
+# 与 chat_once 中读取的记忆点数量保持一致，预热结果才能被对话直接命中
+PREFETCH_MEMORY_LIMIT = 5
+
+
+class PrefetchService:
+    """
+    用户会话预热服务
+    功能：异步预加载用户资料、最近的活跃会话和最新记忆点，不阻塞触发预热的请求
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._in_flight: Set[int] = set()
+        self._last_prefetch: Dict[int, float] = {}
+
+    def schedule(self, user_id: int) -> bool:
+        """
+        提交用户预热任务（立即返回）
+        :param user_id: 用户ID
+        :return: 是否提交了新的预热任务；正在预热或处于冷却期时返回 False
+        """
+        now = time.monotonic()
+        with self._lock:
+            if user_id in self._in_flight or now - self._last_prefetch.get(user_id, float("-inf")) < PREFETCH_COOLDOWN_SECONDS:
+                metrics.incr("prefetch.skipped")
+                return False
+            self._in_flight.add(user_id)
+            self._last_prefetch[user_id] = now
+
+        try:
+            self._executor.submit(self._prefetch_user, user_id)
+        except RuntimeError:
+            # 应用关闭后线程池不再接受任务
+            with self._lock:
+                self._in_flight.discard(user_id)
+            return False
+        metrics.incr("prefetch.scheduled")
+        return True
+
+    def _prefetch_user(self, user_id: int) -> None:
+        """
+        预加载用户资料、最近会话与记忆点（在线程池中执行）
+        """
+        started = time.perf_counter()
+        try:
+            user_cache.get(user_id)
+            session_id = session_manager.warm_latest_session(user_id)
+
+            from memory import get_user_latest_memories
+            get_user_latest_memories(user_id, limit=PREFETCH_MEMORY_LIMIT)
+
+            metrics.incr("prefetch.completed")
+            logger.debug(f"✅ 用户预热完成: user_id={user_id}, session_id={session_id}, "
+                         f"耗时 {(time.perf_counter() - started) * 1000:.1f}ms")
+        except Exception as e:
+            metrics.incr("prefetch.failed")
+            logger.warning(f"⚠️ 用户预热失败: user_id={user_id}, error={e}")
+        finally:
+            with self._lock:
+                self._in_flight.discard(user_id)
+
+    def prune_expired(self) -> int:
+        """
+        清理已过冷却期的预热记录（由缓存清理任务定期调用，避免记录随用户数无限增长）
+        :return: 清理的记录数
+        """
+        cutoff = time.monotonic() - PREFETCH_COOLDOWN_SECONDS
+        with self._lock:
+            expired = [user_id for user_id, last in self._last_prefetch.items() if last <= cutoff]
+            for user_id in expired:
+                del self._last_prefetch[user_id]
+        return len(expired)
+
+    def forget_user(self, user_id: int) -> None:
+        """
+        清除用户的预热记录（注销账号时调用）
+        """
+        with self._lock:
+            self._last_prefetch.pop(user_id, None)
+
+    def shutdown(self) -> None:
+        """
+        关闭预热线程池，不等待未开始的任务
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# 全局预热服务实例
+prefetch_service = PrefetchService()
@@ -0,0 +1,114 @@
+# File: services/query_profiler.py
+# 功能：数据库查询统计
+# 实现：在 SQLAlchemy 引擎的游标执行事件上计时，按请求（contextvars）累计查询次数与耗时；
+#       记录慢查询，请求结束时把同一语句的重复执行标记为疑似 N+1，并汇总到进程内指标与 Server-Timing 响应头
+
+import logging
+import os
+import time
+from collections import Counter
+from contextvars import ContextVar, Token
+from typing import Optional, Tuple
+
+from sqlalchemy import event
+
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 单条语句耗时超过该值（毫秒）记为慢查询
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+# 同一请求内同一语句执行次数达到该值时记为疑似 N+1
+DB_N_PLUS_ONE_THRESHOLD = int(os.getenv("DB_N_PLUS_ONE_THRESHOLD", "10"))
+
+
+class RequestQueryStats:
+    """
+    单个请求的查询统计
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.time_ms = 0.0
+        self.statements: Counter = Counter()
+
+    def record(self, statement: str, elapsed_ms: float) -> None:
+        self.queries += 1
+        self.time_ms += elapsed_ms
+        self.statements[statement] += 1
+
+    def repeated_statements(self, threshold: int):
+        """
+        返回执行次数达到阈值的语句 [(语句, 次数)]
+        """
+        return [(statement, count) for statement, count in self.statements.most_common() if count >= threshold]
+
+    def server_timing(self) -> str:
+        """
+        格式化为 Server-Timing 响应头的值
+        """
+        return f'db;dur={self.time_ms:.1f};desc="{self.queries} queries"'
+
+
+# 当前请求的统计；后台线程、定时任务等请求之外的查询只计入全局指标
+_current_stats: ContextVar[Optional[RequestQueryStats]] = ContextVar("request_query_stats", default=None)
+
+
+class QueryProfiler:
+    """
+    数据库查询统计器
+    功能：挂载到引擎后统计所有语句；请求中间件调用 start_request / finish_request 划定请求范围
+    """
+
+    def install(self, *engines) -> None:
+        """
+        在引擎上注册计时事件（异步引擎传入其 sync_engine）
+        """
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @staticmethod
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info["query_started"].pop()) * 1000
+
+        metrics.incr("db.queries")
+        metrics.incr("db.time_ms", round(elapsed_ms, 3))
+        if elapsed_ms >= DB_SLOW_QUERY_MS:
+            metrics.incr("db.slow_queries")
+            logger.warning(f"🐢 慢查询 {elapsed_ms:.1f}ms: {statement[:500]}")
+
+        stats = _current_stats.get()
+        if stats is not None:
+            stats.record(statement, elapsed_ms)
+
+    def start_request(self) -> Tuple[RequestQueryStats, Token]:
+        """
+        开始统计一个请求
+        :return: (本请求的统计对象, 用于 finish_request 的上下文令牌)
+        """
+        stats = RequestQueryStats()
+        return stats, _current_stats.set(stats)
+
+    def finish_request(self, stats: RequestQueryStats, token: Token, label: str) -> None:
+        """
+        结束请求统计，检查疑似 N+1 并写入指标
+        :param stats: start_request 返回的统计对象
+        :param token: start_request 返回的上下文令牌
+        :param label: 请求标识（如 "GET /journal/list"），用于日志
+        """
+        _current_stats.reset(token)
+        metrics.incr("db.requests")
+        repeated = stats.repeated_statements(DB_N_PLUS_ONE_THRESHOLD)
+        if repeated:
+            metrics.incr("db.n_plus_one_requests")
+            for statement, count in repeated:
+                logger.warning(f"⚠️ 疑似 N+1 查询: {label} 同一语句执行 {count} 次: {statement[:300]}")
+
+
+# 全局查询统计器实例
+query_profiler = QueryProfiler()
@@ -0,0 +1,216 @@
+# File: services/sync_service.py
+# 功能：客户端增量同步服务
+# 实现：change_log 由触发器维护（每条日记/会话/图片只保留最近一次变更，删除记为墓碑），按自增ID单调递增；
+#       客户端携带上次返回的同步令牌，只读取该ID之后的变更并批量加载对应数据；
+#       墓碑保留 SYNC_TOMBSTONE_RETENTION_DAYS 天，更早签发的令牌要求客户端全量重新同步
+
+import base64
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database_models import write_session, ChangeLog, Journal, ChatSession, Image
+from services.image_service import image_service
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 墓碑保留天数；超过该时长未同步的设备需要全量重新同步
+SYNC_TOMBSTONE_RETENTION_DAYS = int(os.getenv("SYNC_TOMBSTONE_RETENTION_DAYS", "90"))
+# 每次同步返回的最大变更条数
+SYNC_DEFAULT_LIMIT = 200
+SYNC_MAX_LIMIT = 1000
+
+
+class InvalidSyncTokenError(ValueError):
+    """同步令牌无法解析"""
+    pass
+
+
+class SyncService:
+    """
+    增量同步服务
+    功能：编解码同步令牌、读取变更并组装数据、清理过期墓碑
+    """
+
+    # ==================== 同步令牌 ====================
+    @staticmethod
+    def encode_token(change_id: int, issued_at: Optional[int] = None) -> str:
+        """
+        将已同步到的变更ID与签发时间编码为不透明令牌
+        :param issued_at: 签发时间戳，默认为当前时间
+        """
+        raw = json.dumps([change_id, int(time.time()) if issued_at is None else issued_at])
+        return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+    @staticmethod
+    def decode_token(token: str) -> Tuple[int, int]:
+        """
+        解析同步令牌
+        :return: (变更ID, 签发时间戳)
+        :raises InvalidSyncTokenError: 令牌格式错误
+        """
+        try:
+            raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode("utf-8")
+            change_id, issued_at = json.loads(raw)
+            return int(change_id), int(issued_at)
+        except Exception:
+            raise InvalidSyncTokenError(f"无效的同步令牌: {token}")
+
+    # ==================== 增量同步 ====================
+    async def changes(self, db: AsyncSession, user_id: int, token: Optional[str], limit: int) -> Dict[str, Any]:
+        """
+        读取令牌之后的变更
+        :param db: 异步数据库会话
+        :param user_id: 用户ID
+        :param token: 上次同步返回的 next_token；为空表示首次同步
+        :param limit: 最多返回的变更条数
+        :return: {"changes": [...], "next_token": str, "has_more": bool, "reset": bool}
+                 reset 为 True 时令牌已过期（期间的删除记录可能已被清理），客户端应清空本地数据后按本次结果全量同步
+                 has_more 为 True 时 next_token 沿用本轮同步开始时的签发时间，追上最新变更后才使用当前时间，
+                 避免翻页期间墓碑被清理后续传令牌仍显得新鲜
+        :raises InvalidSyncTokenError: 令牌无效
+        """
+        since, reset = 0, False
+        issued_at = int(time.time())
+        if token:
+            since, token_issued_at = self.decode_token(token)
+            if time.time() - token_issued_at > SYNC_TOMBSTONE_RETENTION_DAYS * 86400:
+                since, reset = 0, True
+                metrics.incr("sync.reset")
+            else:
+                issued_at = token_issued_at
+
+        rows = (await db.execute(
+            select(ChangeLog.id, ChangeLog.entity, ChangeLog.entity_id, ChangeLog.op)
+            .where(ChangeLog.user_id == user_id, ChangeLog.id > since)
+            .order_by(ChangeLog.id)
+            .limit(limit + 1)
+        )).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        # 按类型批量加载本页涉及的数据（每种类型一次查询）
+        upserts: Dict[str, List[int]] = {}
+        for row in rows:
+            if row.op == "upsert":
+                upserts.setdefault(row.entity, []).append(row.entity_id)
+        loaded = {
+            "journal": await self._load_journals(db, user_id, upserts.get("journal", [])),
+            "session": await self._load_sessions(db, user_id, upserts.get("session", [])),
+            "image": await self._load_images(db, user_id, upserts.get("image", [])),
+        }
+
+        changes = []
+        for row in rows:
+            data = loaded.get(row.entity, {}).get(row.entity_id) if row.op == "upsert" else None
+            if data is None:
+                # 读取变更后数据已被删除：直接按删除返回（随后的墓碑会在下次同步再次返回，客户端幂等处理）
+                changes.append({"type": row.entity, "id": row.entity_id, "op": "delete"})
+            else:
+                changes.append({"type": row.entity, "id": row.entity_id, "op": "upsert", "data": data})
+
+        metrics.incr("sync.requests")
+        metrics.incr("sync.changes", len(changes))
+        return {
+            "changes": changes,
+            "next_token": self.encode_token(rows[-1].id if rows else since, issued_at if has_more else None),
+            "has_more": has_more,
+            "reset": reset,
+        }
+
+    @staticmethod
+    def _isoformat(value: Optional[datetime]) -> Optional[str]:
+        return value.isoformat() if value else None
+
+    async def _load_journals(self, db: AsyncSession, user_id: int, ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        if not ids:
+            return {}
+        journals = (await db.execute(
+            select(Journal.id, Journal.content, Journal.title, Journal.emotion, Journal.created_at, Journal.updated_at)
+            .where(Journal.id.in_(ids), Journal.user_id == user_id)
+        )).all()
+        journal_images = await image_service.get_journal_images_async(db, [journal.id for journal in journals])
+        result = {}
+        for journal in journals:
+            images = journal_images.get(journal.id, [])
+            result[journal.id] = {
+                "journal_id": journal.id,
+                "content": journal.content,
+                "title": journal.title,
+                "emotion": journal.emotion,
+                "images": [str(image["image_id"]) for image in images],
+                "image_urls": [image["url"] for image in images],
+                "created_at": self._isoformat(journal.created_at),
+                "updated_at": self._isoformat(journal.updated_at),
+            }
+        return result
+
+    async def _load_sessions(self, db: AsyncSession, user_id: int, ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        if not ids:
+            return {}
+        sessions = (await db.execute(
+            select(ChatSession.id, ChatSession.session_id, ChatSession.message_count, ChatSession.last_role,
+                   ChatSession.last_message_preview, ChatSession.is_active, ChatSession.created_at,
+                   ChatSession.updated_at)
+            .where(ChatSession.id.in_(ids), ChatSession.user_id == user_id)
+        )).all()
+        return {s.id: {
+            "session_id": s.session_id,
+            "message_count": s.message_count or 0,
+            "last_role": s.last_role,
+            "last_message_preview": s.last_message_preview or "",
+            "is_active": bool(s.is_active),
+            "created_at": self._isoformat(s.created_at),
+            "updated_at": self._isoformat(s.updated_at),
+        } for s in sessions}
+
+    async def _load_images(self, db: AsyncSession, user_id: int, ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        if not ids:
+            return {}
+        images = (await db.execute(
+            select(Image.id, Image.user_id, Image.filename, Image.mime_type, Image.width, Image.height,
+                   Image.session_id, Image.created_at)
+            .where(Image.id.in_(ids), Image.user_id == user_id)
+        )).all()
+        return {image.id: {
+            "image_id": image.id,
+            "url": image_service.image_url(image.user_id, image.filename),
+            "mime_type": image.mime_type,
+            "width": image.width,
+            "height": image.height,
+            "session_id": image.session_id,
+            "created_at": self._isoformat(image.created_at),
+        } for image in images}
+
+    # ==================== 维护 ====================
+    @staticmethod
+    def prune_tombstones(days: int = SYNC_TOMBSTONE_RETENTION_DAYS) -> int:
+        """
+        删除超过保留期的墓碑（签发时间早于保留期的令牌会被要求全量重新同步，不再需要这些记录）
+        :return: 删除的记录数
+        """
+        cutoff = datetime.now(timezone(timedelta(hours=8))).replace(tzinfo=None) - timedelta(days=days)
+        with write_session() as db:
+            deleted = db.execute(
+                delete(ChangeLog).where(ChangeLog.op == "delete", ChangeLog.changed_at < cutoff)
+            ).rowcount
+        metrics.incr("sync.tombstones_pruned", deleted)
+        return deleted
+
+    @staticmethod
+    def forget_user(db, user_id: int) -> None:
+        """
+        删除用户的全部变更记录（注销账号时在同一事务中调用，不提交）
+        """
+        db.execute(delete(ChangeLog).where(ChangeLog.user_id == user_id))
+
+
+# 全局同步服务实例
+sync_service = SyncService()
@@ -0,0 +1,187 @@
+# File: services/user_cache.py
+# 功能：用户资料读穿透缓存
+# 实现：进程内按用户ID缓存常用用户字段（昵称、生日、心数、订阅状态等），带过期时间；所有写入路径提交后显式失效；
+#       缓存保存数据库原值，返回时换算当日实际可用心数，跨过零点的缓存也不会返回昨天的心数
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import select
+
+from database_models import SessionLocal, AsyncSessionLocal, User
+from services.heart_service import effective_heart
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 缓存有效期（秒）；多进程部署时其他进程的写入无法通知本进程，由过期时间兜底
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+# 最多缓存的用户数，超出时淘汰最久未访问的用户
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+
+# 缓存的用户字段
+PROFILE_FIELDS = (
+    "id",
+    "name",
+    "email",
+    "birthday",
+    "heart",
+    "heart_reset_date",
+    "subscription_status",
+    "subscription_product_id",
+    "subscription_expires_at",
+    "auto_renew_status",
+    "subscription_environment",
+)
+
+
+class UserProfileCache:
+    """
+    用户资料读穿透缓存
+    功能：未命中时从数据库加载并写入缓存；写入用户数据的代码在提交后调用 invalidate
+    说明：每次失效都会递增用户的版本号，加载期间发生失效时本次结果不写入缓存，避免旧数据覆盖新数据；
+         缓存按最近访问排序，超出 USER_CACHE_MAX_ENTRIES 时淘汰最久未访问的用户，过期条目与版本号由 prune_expired 定期清理
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._versions: Dict[int, int] = {}
+        self._generation = 0  # invalidate_all 时递增
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def _profile_statement(user_id: int):
+        """
+        构造读取用户资料字段的查询（同步与异步查询共用）
+        """
+        return select(*(getattr(User, field) for field in PROFILE_FIELDS)).where(User.id == user_id)
+
+    @staticmethod
+    def _present(profile: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        复制缓存的资料，并将 heart 换算为当日实际可用的心数
+        """
+        profile = dict(profile)
+        profile["heart"] = effective_heart(profile["heart"], profile["subscription_status"],
+                                           profile["heart_reset_date"], profile["email"])
+        return profile
+
+    def _lookup(self, user_id: int):
+        """
+        查找缓存并记录命中情况
+        :return: (缓存的资料或 None, 加载前的版本标记)
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and now - entry[0] < USER_CACHE_TTL_SECONDS:
+                self._entries.move_to_end(user_id)
+                self._hits += 1
+                hit = True
+            else:
+                if entry:
+                    del self._entries[user_id]
+                self._misses += 1
+                hit = False
+            token = (self._generation, self._versions.get(user_id, 0))
+            hit_rate = self._hits / (self._hits + self._misses)
+            size = len(self._entries)
+
+        metrics.incr("user_cache.hit" if hit else "user_cache.miss")
+        metrics.set_gauge("user_cache.hit_rate", round(hit_rate, 4))
+        metrics.set_gauge("user_cache.size", size)
+        return (self._present(entry[1]) if hit else None), token
+
+    def _store(self, user_id: int, row, token) -> Optional[Dict[str, Any]]:
+        """
+        写入加载结果；加载期间发生过失效时只返回结果不写入缓存
+        """
+        if row is None:
+            return None
+        profile = dict(row._mapping)
+        with self._lock:
+            if token == (self._generation, self._versions.get(user_id, 0)):
+                self._entries[user_id] = (time.monotonic(), profile)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > USER_CACHE_MAX_ENTRIES:
+                    self._entries.popitem(last=False)
+        return self._present(profile)
+
+    def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """
+        读取用户资料
+        :param user_id: 用户ID
+        :return: 用户资料字典（调用方可随意修改，不影响缓存）；用户不存在时返回 None
+        """
+        profile, token = self._lookup(user_id)
+        if profile is not None:
+            return profile
+
+        db = SessionLocal()
+        try:
+            row = db.execute(self._profile_statement(user_id)).first()
+        finally:
+            db.close()
+        return self._store(user_id, row, token)
+
+    async def get_async(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """
+        读取用户资料（异步版本，参数与返回值同 get）
+        """
+        profile, token = self._lookup(user_id)
+        if profile is not None:
+            return profile
+
+        async with AsyncSessionLocal() as db:
+            row = (await db.execute(self._profile_statement(user_id))).first()
+        return self._store(user_id, row, token)
+
+    def invalidate(self, user_id: int) -> None:
+        """
+        失效单个用户的缓存（写入用户数据并提交后调用）
+        :param user_id: 用户ID
+        """
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    def prune_expired(self) -> int:
+        """
+        清理过期条目，以及已没有缓存条目的用户版本号（由内存缓存清理任务定期调用）
+        说明：版本号被清理后会从 0 重新计数，为避免加载中的旧结果因版本号相同而写入，清理版本号时递增 generation
+        :return: 清理的缓存条目数
+        """
+        now = time.monotonic()
+        with self._lock:
+            expired = [user_id for user_id, (stored_at, _) in self._entries.items()
+                       if now - stored_at >= USER_CACHE_TTL_SECONDS]
+            for user_id in expired:
+                del self._entries[user_id]
+            stale_versions = [user_id for user_id in self._versions if user_id not in self._entries]
+            for user_id in stale_versions:
+                del self._versions[user_id]
+            if stale_versions:
+                self._generation += 1
+            size = len(self._entries)
+        metrics.set_gauge("user_cache.size", size)
+        return len(expired)
+
+    def invalidate_all(self) -> None:
+        """
+        失效所有用户的缓存（批量重置心数等全表写入后调用）
+        """
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self._generation += 1
+        logger.debug("清空用户资料缓存")
+
+
+# 全局用户资料缓存实例
+user_cache = UserProfileCache()
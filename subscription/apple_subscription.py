@@ -10,6 +10,8 @@ from datetime import datetime, timezone
 from sqlalchemy.orm import Session
 from database_models.user import User
 from database_models import SessionLocal
+from services.heart_service import set_heart
+from services.user_cache import user_cache
 from jose import jwt as jose_jwt
 
 logger = logging.getLogger(__name__)
@@ -192,6 +194,7 @@ def update_user_subscription(db: Session, user_id: int, subscription_info: Dict[
     
     db.commit()
     db.refresh(user)
+    user_cache.invalidate(user_id)
     
     logger.info(f"✅ 用户订阅信息已更新: user_id={user_id}, status={user.subscription_status}")
     
@@ -212,15 +215,19 @@ def get_user_subscription_status(db: Session, user_id: int) -> Dict[str, Any]:
     if not user:
         raise AppleSubscriptionError("用户不存在")
     
-    # 检查订阅是否过期
+    # 检查订阅是否过期（SQLite 读出的时间不带时区，按 UTC 比较）
     now = datetime.now(timezone.utc)
-    if (user.subscription_expires_at and 
+    expires_at = user.subscription_expires_at
+    if expires_at and expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    if (expires_at and 
         user.subscription_status == SUBSCRIPTION_STATUS_ACTIVE and 
-        user.subscription_expires_at <= now):
+        expires_at <= now):
         # 订阅已过期，更新状态
         user.subscription_status = SUBSCRIPTION_STATUS_EXPIRED
         db.commit()
         db.refresh(user)
+        user_cache.invalidate(user_id)
     
     return {
         "subscription_status": user.subscription_status,
@@ -342,9 +349,10 @@ def handle_apple_webhook_notification(notification_data: Dict[str, Any]) -> Dict
                             
                             # 如果续费成功且为有效订阅，重置心心为100
                             if user.subscription_status == "active":
-                                user.heart = 100
+                                set_heart(user, 100)
                                 db.commit()
                                 db.refresh(user)
+                                user_cache.invalidate(user.id)
                             
                             logger.info(f"✅ 自动续费处理完成: user_id={user.id}, "
                                       f"新过期时间={user.subscription_expires_at}, "
@@ -390,6 +398,7 @@ def handle_apple_webhook_notification(notification_data: Dict[str, Any]) -> Dict
                         if user and user.subscription_status == "active":
                             user.subscription_status = SUBSCRIPTION_STATUS_EXPIRED
                             db.commit()
+                            user_cache.invalidate(user.id)
                             logger.info(f"✅ 已更新用户 {user.id} 订阅状态为过期")
                     finally:
                         db.close()
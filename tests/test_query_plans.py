@@ -0,0 +1,15 @@
+# File: tests/test_query_plans.py
+# 功能：热点查询执行计划回归测试
+# 实现：调用 scripts/check_query_plans.py 的 run_checks，任一查询未命中预期索引、出现全表扫描或临时排序即失败
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+from check_query_plans import run_checks
+
+
+def test_hot_queries_use_expected_indexes():
+    failures = {name: (problems, plan) for name, plan, problems in run_checks() if problems}
+    assert not failures, failures
@@ -13,6 +13,7 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from sqlalchemy.orm import Session
 from database_models.database import SessionLocal
 from database_models.user import User
+from services.heart_service import set_heart
 import logging
 
 # 配置日志
@@ -42,8 +43,8 @@ def update_user_heart(user_id: int, new_heart_count: int) -> bool:
         old_heart = user.heart
         logger.info(f"🔍 找到用户: ID={user.id}, 姓名='{user.name}', 当前心心数量={old_heart}")
         
-        # 更新心心数量
-        user.heart = new_heart_count
+        # 更新心心数量（同时记为今天已重置，当天不会被按日重置覆盖）
+        set_heart(user, new_heart_count)
         db.commit()
         db.refresh(user)
         